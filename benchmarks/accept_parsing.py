@@ -0,0 +1,68 @@
+# vim: set fileencoding=utf-8 :
+#
+# Copyright (c) 2013 Daniel Truemper <truemped at googlemail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+"""Compare the cached and uncached `Accept` header parsing.
+
+Run it with::
+
+    $ python benchmarks/accept_parsing.py
+"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+
+import random
+import timeit
+
+from supercell.acceptparsing import (parse_accept_header,
+                                     cached_parse_accept_header)
+
+
+HEADERS = [
+    'application/json',
+    'application/json, text/plain, */*',
+    'application/vnd.supercell-v1.1+json',
+    'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,' +
+    '*/*;q=0.8',
+    '*/*',
+    '',
+]
+
+
+def _mix(size=10000, seed=42):
+    """A realistic mix is dominated by very few distinct values."""
+    rnd = random.Random(seed)
+    weights = [40, 25, 15, 10, 7, 3]
+    population = []
+    for (header, weight) in zip(HEADERS, weights):
+        population.extend([header] * weight)
+    return [rnd.choice(population) for _ in range(size)]
+
+
+def main(repeat=5):
+    headers = _mix()
+
+    for (name, fn) in (('uncached', parse_accept_header),
+                       ('cached', cached_parse_accept_header)):
+        def run():
+            for header in headers:
+                fn(header)
+        best = min(timeit.repeat(run, number=1, repeat=repeat))
+        print('%-10s %10.0f headers/s' % (name, len(headers) / best))
+
+
+if __name__ == '__main__':
+    main()
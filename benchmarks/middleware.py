@@ -0,0 +1,117 @@
+# vim: set fileencoding=utf-8 :
+#
+# Copyright (c) 2013 Daniel Truemper <truemped at googlemail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+"""Measure the overhead per middleware layer of the compiled middleware chain
+compared to one coroutine per middleware.
+
+Run it with::
+
+    $ python benchmarks/middleware.py
+"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+
+from functools import wraps
+import timeit
+
+from schematics.models import Model
+from schematics.types import StringType
+from tornado.gen import coroutine, Return
+
+from supercell.mediatypes import ReturnInformationT
+from supercell.middleware import Middleware
+
+
+class Message(Model):
+    message = StringType()
+
+
+class SyncMiddleware(Middleware):
+
+    def before(self, handler, args, kwargs):
+        pass
+
+    def after(self, handler, args, kwargs, result):
+        pass
+
+
+class CoroutineMiddleware(Middleware):
+
+    @coroutine
+    def before(self, handler, args, kwargs):
+        pass
+
+    @coroutine
+    def after(self, handler, args, kwargs, result):
+        pass
+
+
+def _layered(middleware, fn):
+    """Wrap `fn` in one coroutine per middleware."""
+
+    @coroutine
+    @wraps(fn)
+    def before(other, *args, **kwargs):
+        before_result = yield middleware.before(other, args, kwargs)
+        if isinstance(before_result, (ReturnInformationT, Model)):
+            raise Return(before_result)
+        result = yield fn(other, *args, **kwargs)
+        after_result = yield middleware.after(other, args, kwargs, result)
+        if isinstance(after_result, (ReturnInformationT, Model)):
+            raise Return(after_result)
+        raise Return(result)
+
+    return before
+
+
+_MESSAGE = Message({'message': 'hello'})
+
+
+@coroutine
+def _get(handler):
+    raise Return(_MESSAGE)
+
+
+def _handler(middleware_class, layers, compiled):
+    fn = _get
+    for _ in range(layers):
+        middleware = middleware_class()
+        fn = middleware(fn) if compiled else _layered(middleware, fn)
+    return fn
+
+
+def main(repeat=5, number=10000, layers=4):
+    # one coroutine per middleware cannot run synchronous middlewares
+    for (middleware_class, name, compiled) in (
+            (CoroutineMiddleware, 'layered', False),
+            (CoroutineMiddleware, 'compiled', True),
+            (SyncMiddleware, 'compiled', True)):
+        timings = []
+        for n in range(layers + 1):
+            fn = _handler(middleware_class, n, compiled)
+            timings.append(min(timeit.repeat(
+                lambda: fn(None).result(), number=number,
+                repeat=repeat)) / number)
+        per_layer = (timings[-1] - timings[0]) / layers
+        print('%-20s %-8s %6.1f us/request with %d layers, '
+              '%5.1f us per layer' %
+              (middleware_class.__name__, name, timings[-1] * 1e6,
+               layers, per_layer * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+# vim: set fileencoding=utf-8 :
+#
+# Copyright (c) 2013 Daniel Truemper <truemped at googlemail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+"""Compare schematics and the compiled models when consuming and providing
+nested models.
+
+Run it with::
+
+    $ python benchmarks/models.py
+"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+
+import timeit
+
+from schematics.models import Model
+from schematics.types import BooleanType, FloatType, IntType, StringType
+from schematics.types.compound import ListType, ModelType
+
+from supercell.compiledmodel import compile_model
+
+
+class Tag(Model):
+    name = StringType(required=True)
+    weight = FloatType(default=1.0)
+
+
+class Author(Model):
+    name = StringType(required=True)
+    email = StringType()
+    age = IntType(min_value=0)
+
+
+class Comment(Model):
+    author = ModelType(Author, required=True)
+    text = StringType()
+    likes = IntType()
+
+
+class Document(Model):
+    doc_id = StringType(required=True)
+    title = StringType()
+    published = BooleanType()
+    author = ModelType(Author, required=True)
+    tags = ListType(ModelType(Tag))
+    comments = ListType(ModelType(Comment))
+
+
+def _document(i):
+    author = {'name': 'author %d' % i, 'email': 'a%d@example.com' % i,
+              'age': 42}
+    return {
+        'doc_id': 'doc-%d' % i,
+        'title': 'A document',
+        'published': True,
+        'author': author,
+        'tags': [{'name': 'tag %d' % t} for t in range(5)],
+        'comments': [{'author': author, 'text': 'comment %d' % c,
+                      'likes': c} for c in range(10)],
+    }
+
+
+def _schematics_consume(data):
+    model = Document(data)
+    model.validate()
+    return model
+
+
+def _schematics_provide(model):
+    model.validate()
+    return model.to_primitive()
+
+
+_COMPILED = compile_model(Document)
+
+
+def _compiled_consume(data):
+    model = _COMPILED.convert(data)
+    _COMPILED.validate(model)
+    return model
+
+
+def _compiled_provide(model):
+    _COMPILED.validate(model)
+    return _COMPILED.to_primitive(model)
+
+
+def main(repeat=5, size=1000):
+    documents = [_document(i) for i in range(size)]
+    models = [Document(doc) for doc in documents]
+
+    for (name, consume, provide) in (
+            ('schematics', _schematics_consume, _schematics_provide),
+            ('compiled', _compiled_consume, _compiled_provide)):
+        def run_consume():
+            for doc in documents:
+                consume(doc)
+
+        def run_provide():
+            for model in models:
+                provide(model)
+
+        consumed = min(timeit.repeat(run_consume, number=1, repeat=repeat))
+        provided = min(timeit.repeat(run_provide, number=1, repeat=repeat))
+        print('%-10s consume %8.0f models/s   provide %8.0f models/s' %
+              (name, size / consumed, size / provided))
+
+
+if __name__ == '__main__':
+    main()
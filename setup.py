@@ -42,6 +42,17 @@ if PY2:
     extras_require['futures'] = 'futures == 2.2.0'
 
 
+install_requires = [
+    'tornado >= 4.2',
+    'schematics >= 1.0.2',
+    'scales >= 1.0.8'
+]
+
+if PY2:
+    # the executors are based on concurrent.futures
+    install_requires.append('futures >= 2.2.0')
+
+
 setup(
     name='supercell',
     version='.'.join([str(v) for v in init.__version__]),
@@ -55,11 +66,7 @@ setup(
                 'loosely follow the idea of domain driven design.',
     packages=['supercell'],
 
-    install_requires=[
-        'tornado >= 4.2',
-        'schematics >= 1.0.2',
-        'scales >= 1.0.8'
-    ],
+    install_requires=install_requires,
 
     tests_require=tests_require,
     extras_require=extras_require,
@@ -24,7 +24,7 @@ http://lucumr.pocoo.org/2013/5/21/porting-to-python-3-redux/
 import sys
 
 __all__ = ['unichr', 'range_type', 'text_type', 'string_types', 'iterkeys',
-           'itervalues', 'iteritems', 'imap', 'izip', 'ifilter']
+           'itervalues', 'iteritems', 'imap', 'izip', 'ifilter', 'UserDict']
 
 
 PY2 = sys.version_info[0] == 2
@@ -46,6 +46,8 @@ if not PY2:
     imap = map
     izip = zip
 
+    from collections import UserDict
+
 else:
     unichr = chr
     range_type = xrange
@@ -57,6 +59,7 @@ else:
     iteritems = lambda d: d.iteritems()
 
     from itertools import imap, izip, ifilter
+    from UserDict import UserDict
 
 
 def with_metaclass(meta, *bases):
@@ -0,0 +1,79 @@
+# vim: set fileencoding=utf-8 :
+#
+# Copyright (c) 2013 Daniel Truemper <truemped at googlemail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+"""Small bounded LRU mapping used for the various request level caches."""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+
+from collections import OrderedDict
+
+
+__all__ = ['LRUCache']
+
+
+_MISSING = object()
+
+
+class LRUCache(object):
+    """A bounded mapping evicting the least recently used entry when more
+    than `maxsize` entries are stored.
+
+    This is not thread safe, which is fine as long as it is only used from
+    the `IOLoop` thread. The number of `hits` and `misses` of :func:`get` is
+    counted for statistics.
+    """
+
+    def __init__(self, maxsize=128):
+        assert maxsize > 0, 'maxsize must be positive'
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        """Return the value for `key` and mark it as most recently used."""
+        value = self._data.pop(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        """Remove all entries."""
+        self._data.clear()
+
+    def resize(self, maxsize):
+        """Change the maximum number of entries, evicting the least recently
+        used ones if necessary."""
+        assert maxsize > 0, 'maxsize must be positive'
+        self.maxsize = maxsize
+        while len(self._data) > maxsize:
+            self._data.popitem(last=False)
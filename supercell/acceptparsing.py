@@ -11,6 +11,10 @@
 #
 # It is based on a snipped found in this project:
 #   https://github.com/martinblech/mimerender
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+
+from supercell._lru import LRUCache
 
 
 def parse_accept_header(accept):
@@ -78,3 +82,51 @@ def parse_accept_header(accept):
         result.append((media_type, dict(media_params), q))
     result.sort(key=lambda r: -r[2])
     return result
+
+
+class _FrozenParams(dict):
+    """Read only media range parameters shared between cached results."""
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError('cached accept header parameters are immutable')
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+
+ACCEPT_CACHE_SIZE = 256
+"""Default number of distinct header values kept by
+:func:`cached_parse_accept_header`."""
+
+
+_ACCEPT_CACHE = LRUCache(ACCEPT_CACHE_SIZE)
+
+
+def cached_parse_accept_header(accept):
+    """
+    Like :func:`parse_accept_header` but memoizes the result in a bounded
+    LRU cache keyed by the raw header value.
+
+    As the result is shared between callers it is returned as a tuple of
+    3-tuples and the parameter dicts are read only.
+    """
+    result = _ACCEPT_CACHE.get(accept)
+    if result is None:
+        result = tuple((media_type, _FrozenParams(params), q)
+                       for (media_type, params, q)
+                       in parse_accept_header(accept))
+        _ACCEPT_CACHE[accept] = result
+    return result
+
+
+def set_accept_cache_size(size):
+    """Change the number of header values kept by
+    :func:`cached_parse_accept_header`."""
+    _ACCEPT_CACHE.resize(size)
+
+
+def accept_cache_stats():
+    """Return the `hits`, `misses` and current `size` of the accept header
+    cache."""
+    return {'hits': _ACCEPT_CACHE.hits, 'misses': _ACCEPT_CACHE.misses,
+            'size': len(_ACCEPT_CACHE), 'maxsize': _ACCEPT_CACHE.maxsize}
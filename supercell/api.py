@@ -28,8 +28,9 @@ from supercell.decorators import provides, consumes
 from supercell.health import (HealthCheckOk, HealthCheckWarning,
                               HealthCheckError)
 from supercell.environment import Environment
+from supercell.executor import run_in_executor
 from supercell.consumer import ConsumerBase, JsonConsumer
-from supercell.provider import ProviderBase, JsonProvider
+from supercell.provider import ProviderBase, JsonProvider, NdJsonProvider
 from supercell.requesthandler import RequestHandler
 from supercell.service import Service
 from supercell.stats import latency, metered
@@ -43,6 +44,7 @@ __all__ = [
     'latency',
     'metered',
     'provides',
+    'run_in_executor',
     'CacheConfig',
     'ContentType',
     'ConsumerBase',
@@ -58,6 +60,7 @@ __all__ = [
     'ProviderBase',
     'JsonConsumer',
     'JsonProvider',
+    'NdJsonProvider',
     'RequestHandler',
     'Return',
     'Service',
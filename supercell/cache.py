@@ -32,25 +32,61 @@ The details of setting the `CacheControl` header are documented in the
 :func:`CacheConfig`. The `expires` argument simply takes a
 :func:`datetime.timedelta` as input and will then generate the `Expires` header
 based on the current time and the :func:`datetime.timedelta`.
+
+With `server_cache=True` the responses are also cached by supercell itself::
+
+    self.environment.add_handler(..., cache=CacheConfig(timedelta(minutes=1),
+                                                        server_cache=True))
+
+Responses to GET and HEAD requests are then stored in the
+:class:`ResponseCache` of the environment, keyed by the request URI and the
+negotiated content type, for `max_age`. Subsequent requests are answered from
+the cache without calling the handler. Responses that are `private` or
+`no_store` are never stored.
+
+.. warning:: Cached responses are served from `prepare()`, before the
+   middlewares of the handler method would run. Enabling the server side
+   cache for a handler with middlewares on its `get()` or `head()` method
+   therefore raises a `ValueError` in `add_handler()`, as authentication,
+   rate limiting or any other `Middleware.before` check would be skipped.
+
+With `etag=True` a strong `Etag` is added to GET and HEAD responses and
+requests with a matching `If-None-Match` header are answered with
+`304 Not Modified`. By default the `Etag` is the SHA-1 hash of the response
+body. If the handler implements
+:func:`~supercell.requesthandler.RequestHandler.etag_version`, the version
+it returns is used instead and checked before the handler method is called,
+so that neither the model nor the response body have to be built::
+
+    @provides(MediaType.ApplicationJson)
+    class Document(RequestHandler):
+
+        def etag_version(self, doc_id):
+            return self.db.get_revision(doc_id)
 """
 from __future__ import (absolute_import, division, print_function,
                         with_statement)
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+import hashlib
+import time
+
+from tornado.httputil import format_timestamp
 
 
-__all__ = ['CacheConfig']
+__all__ = ['CacheConfig', 'ResponseCache']
 
 
 CacheConfigT = namedtuple('CacheConfigT', ['max_age', 's_max_age', 'public',
                                            'private', 'no_cache', 'no_store',
                                            'must_revalidate',
-                                           'proxy_revalidate'])
+                                           'proxy_revalidate',
+                                           'server_cache', 'etag'])
 
 
 def CacheConfig(max_age, s_max_age=None, public=False, private=False,
                 no_cache=False, no_store=False, must_revalidate=True,
-                proxy_revalidate=False):
+                proxy_revalidate=False, server_cache=False, etag=False):
     """Create a :class:`CacheConfigT` with default values.
     :param max_age: Number of seconds the response can be cached
     :type max_age: datetime.timedelta
@@ -80,11 +116,30 @@ def CacheConfig(max_age, s_max_age=None, public=False, private=False,
     :param proxy_revalidate: Like `must_revalidate` except it only applies to
                              public caches
     :type proxy_revalidate: bool
+
+    :param server_cache: Store the responses in the server side
+                         :class:`ResponseCache` for `max_age`. Cached
+                         responses are served without running the
+                         middlewares of the handler
+    :type server_cache: bool
+
+    :param etag: Add a strong `Etag` and answer matching conditional
+                 requests with `304 Not Modified`
+    :type etag: bool
     """
     return CacheConfigT(max_age, s_max_age=s_max_age, public=public,
                         private=private, no_cache=no_cache, no_store=no_store,
                         must_revalidate=must_revalidate,
-                        proxy_revalidate=proxy_revalidate)
+                        proxy_revalidate=proxy_revalidate,
+                        server_cache=server_cache, etag=etag)
+
+
+def server_cacheable(cache_config):
+    """Return `True` if responses may be stored in the :class:`ResponseCache`
+    according to the :class:`CacheConfigT`."""
+    return bool(cache_config and cache_config.server_cache and
+                not cache_config.private and not cache_config.no_store and
+                cache_config.max_age)
 
 
 def compute_cache_header(cache_config):
@@ -96,9 +151,10 @@ def compute_cache_header(cache_config):
     :rtype: str
     """
     params = []
-    params.append('max-age=%s' % cache_config.max_age.seconds)
+    params.append('max-age=%d' % cache_config.max_age.total_seconds())
     if cache_config.s_max_age:
-        params.append('s-max-age=%s' % cache_config.s_max_age.seconds)
+        params.append('s-max-age=%d' %
+                      cache_config.s_max_age.total_seconds())
     if cache_config.public:
         params.append('public')
     if cache_config.private:
@@ -113,3 +169,133 @@ def compute_cache_header(cache_config):
         params.append('proxy-revalidate')
 
     return ', '.join(params)
+
+
+def compute_etag(chunks):
+    """Compute a strong `Etag` for the response body `chunks` from the
+    SHA-1 hash of the body, without joining the chunks.
+
+    :param chunks: The response body
+    :type chunks: list of bytes
+    :rtype: str
+    """
+    hasher = hashlib.sha1()
+    for chunk in chunks:
+        hasher.update(chunk)
+    return '"%s"' % hasher.hexdigest()
+
+
+def compute_version_etag(version, content_type, encoding=None):
+    """Compute a strong `Etag` from a version returned by a handler.
+
+    The representation is part of the `Etag`, as different content types and
+    content codings of the same version are different entities.
+
+    :param version: The version of the resource
+    :param content_type: The negotiated content type
+    :type content_type: str
+    :param encoding: The negotiated content coding
+    :type encoding: str
+    :rtype: str
+    """
+    data = ('%s;%s' % (content_type, version)).encode('utf8')
+    if encoding:
+        data += (';' + encoding).encode('utf8')
+    return compute_etag([data])
+
+
+_EXPIRES_HEADERS = {}
+
+
+def compute_expires_header(seconds):
+    """Compute the `Expires` header for a response that expires in
+    `seconds`.
+
+    The formatted HTTP date only changes once per second, so the last value
+    is remembered for each distinct number of seconds.
+
+    :param seconds: Number of seconds from now
+    :type seconds: int
+    :return: The HTTP date for the `Expires` header
+    :rtype: str
+    """
+    now = int(time.time())
+    cached = _EXPIRES_HEADERS.get(seconds, None)
+    if cached is not None and cached[0] == now:
+        return cached[1]
+    value = format_timestamp(now + seconds)
+    _EXPIRES_HEADERS[seconds] = (now, value)
+    return value
+
+
+CachedResponse = namedtuple('CachedResponse', ['expires', 'headers', 'body',
+                                               'size'])
+
+
+class ResponseCache(object):
+    """Server side cache for complete responses.
+
+    The cache is bounded by the total size of the stored bodies in bytes.
+    When it is exceeded, the least recently used responses are evicted. The
+    number of `hits`, `misses` and `evictions` is counted and available in
+    the **/_system/stats/_internal/response_cache** stats.
+    """
+
+    def __init__(self, max_size=64 * 1024 * 1024):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """Return the :class:`CachedResponse` for `key` or `None` if there is
+        no fresh response."""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires < time.time():
+            self.size -= entry.size
+            self.misses += 1
+            return None
+        self._entries[key] = entry
+        self.hits += 1
+        return entry
+
+    def set(self, key, headers, body, max_age):
+        """Store a response for `max_age` seconds.
+
+        :param headers: list of `(name, value)` tuples
+        :param body: the response body
+        :type body: bytes
+        :param max_age: number of seconds the response is fresh
+        """
+        size = len(body)
+        if size > self.max_size:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= old.size
+        self._entries[key] = CachedResponse(time.time() + max_age, headers,
+                                            body, size)
+        self.size += size
+        while self.size > self.max_size:
+            (_, entry) = self._entries.popitem(last=False)
+            self.size -= entry.size
+            self.evictions += 1
+
+    def clear(self):
+        """Remove all responses."""
+        self._entries.clear()
+        self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Return the cache statistics."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'entries': len(self._entries),
+                'size': self.size, 'max_size': self.max_size}
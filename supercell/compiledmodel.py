@@ -0,0 +1,387 @@
+# vim: set fileencoding=utf-8 :
+#
+# Copyright (c) 2013 Daniel Truemper <truemped at googlemail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+"""Compiled conversion, validation and serialization of schematics models.
+
+Schematics walks the fields of a model dynamically whenever a model is
+created, validated or serialized: it computes the accepted input names, looks
+up roles and serialization options and tries every conversion twice. For
+models consumed and provided by supercell all of this is known in advance, so
+:func:`compile_model` computes it once per model class and returns a
+:class:`CompiledModel` working on a flat list of the fields.
+
+The compiled functions behave like their schematics counterparts, including
+the raised exceptions and error messages::
+
+    compiled = compile_model(MyModel)
+
+    model = compiled.convert(data)      # MyModel(data)
+    compiled.validate(model)            # model.validate()
+    compiled.to_primitive(model)        # model.to_primitive()
+
+Nested models (`ModelType`) and lists of nested models are compiled as well,
+other compound types are delegated to schematics. Models using features that
+are not compiled, i.e. serializables, model level validators, roles, a field
+order or overridden model methods, are handled by schematics itself.
+
+The consumers compile the models of :func:`~supercell.api.consumes` when the
+handler class is decorated, the providers compile the returned models on
+first use.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+
+from schematics.exceptions import (ConversionError, ModelConversionError,
+                                   ModelValidationError, ValidationError)
+from schematics.models import Model
+from schematics.transforms import convert, export_loop
+from schematics.types.compound import ListType, ModelType, MultiType
+
+
+__all__ = ['CompiledModel', 'compile_model']
+
+
+_COMPILED = {}
+
+
+def compile_model(model_class):
+    """Return the :class:`CompiledModel` for `model_class`.
+
+    The result is cached per class. If the model cannot be compiled, an
+    object with the same interface calling schematics is returned.
+    """
+    compiled = _COMPILED.get(model_class, None)
+    if compiled is None:
+        if _compilable(model_class):
+            compiled = CompiledModel(model_class)
+        else:
+            compiled = SchematicsModel(model_class)
+        _COMPILED[model_class] = compiled
+    return compiled
+
+
+def _compilable(model_class):
+    """Return `True` if the model only uses features that are compiled."""
+    if not isinstance(model_class, type) or not issubclass(model_class, Model):
+        return False
+    options = model_class._options
+    return (model_class.__init__ == Model.__init__ and
+            model_class.convert == Model.convert and
+            model_class.validate == Model.validate and
+            model_class.to_primitive == Model.to_primitive and
+            not model_class._serializables and
+            not model_class._validator_functions and
+            not options.roles and
+            not getattr(options, 'fields_order', None))
+
+
+def _to_primitive_converter(field, value):
+    return field.to_primitive(value, context=None)
+
+
+def _validate_instance(value):
+    """Validate a nested model like `ModelType` does."""
+    try:
+        if isinstance(value, Model):
+            compile_model(value.__class__).validate(value)
+        else:
+            value.validate()
+    except ModelValidationError as exc:
+        raise ValidationError(exc.messages)
+
+
+def _compile_scalar(field):
+    to_native = field.to_native
+    validate = field.validate
+
+    def validated(value):
+        value = to_native(value)
+        validate(value)
+        return value
+
+    return (to_native, validated, field.to_primitive)
+
+
+def _compile_compound(field):
+    """Delegate compound types to schematics."""
+    to_native = field.to_native
+    validate = field.validate
+    export_loop = field.export_loop
+
+    def validated(value):
+        value = to_native(value)
+        validate(value)
+        return value
+
+    def export(value):
+        return export_loop(value, _to_primitive_converter, role=None,
+                           print_none=False)
+
+    return (to_native, validated, export)
+
+
+def _plain(field, field_type, builtin_validators):
+    """Return `True` if `field` is a `field_type` without choices and
+    custom validators."""
+    return (type(field) is field_type and field.choices is None and
+            len(field.validators) ==
+            len(field_type._validators) + builtin_validators)
+
+
+def _compiled_model_type(field):
+    return _plain(field, ModelType, 1)
+
+
+def _compile_model_type(field):
+    model_class = field.model_class
+    strict = field.strict
+    to_native = field.to_native
+
+    def convert_value(value):
+        if value is None or isinstance(value, model_class):
+            return value
+        if not isinstance(value, dict):
+            return to_native(value)
+        return compile_model(model_class).convert_nested(value, strict)
+
+    def validated(value):
+        value = convert_value(value)
+        _validate_instance(value)
+        return value
+
+    def export(value):
+        if isinstance(value, model_class):
+            return compile_model(value.__class__).export_nested(value)
+        return compile_model(model_class).export_nested(value)
+
+    return (convert_value, validated, export)
+
+
+def _compile_model_list(field):
+    (convert_item, _, export_item) = _compile_model_type(field.field)
+    force_list = field._force_list
+    check_length = field.check_length
+    allow_none = field.allow_none()
+
+    def convert_value(value):
+        return [convert_item(item) for item in force_list(value)]
+
+    def validated(value):
+        # schematics validates the items before and after checking the
+        # length, the second time cannot fail
+        items = convert_value(value)
+        errors = []
+        for item in items:
+            try:
+                _validate_instance(item)
+            except ValidationError as exc:
+                errors.append(exc.messages)
+        if errors:
+            raise ValidationError(errors)
+        check_length(items)
+        return items
+
+    def export(value):
+        data = []
+        for item in value:
+            shaped = export_item(item)
+            if shaped is not None:
+                data.append(shaped)
+        if data or allow_none:
+            return data
+        return None
+
+    return (convert_value, validated, export)
+
+
+def _compile_field(field):
+    """Return the convert, validate and export functions of a field."""
+    if _compiled_model_type(field):
+        return _compile_model_type(field)
+    if _plain(field, ListType, 2) and _compiled_model_type(field.field):
+        return _compile_model_list(field)
+    if isinstance(field, MultiType):
+        return _compile_compound(field)
+    return _compile_scalar(field)
+
+
+def _list_or_string(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+class CompiledModel(object):
+    """Conversion, validation and serialization of a model class over a flat
+    list of its fields."""
+
+    def __init__(self, model_class):
+        self.model_class = model_class
+        serialize_when_none = model_class._options.serialize_when_none
+        fields = []
+        accepted = set()
+        for (name, field) in model_class._fields.items():
+            serialized_name = field.serialized_name or name
+            keys = _list_or_string(field.deserialize_from)
+            keys.extend([serialized_name, name])
+            keys = [key for key in keys if key]
+            accepted.update(keys)
+            # the last of the keys present in the input wins
+            lookup = []
+            for key in reversed(keys):
+                if key not in lookup:
+                    lookup.append(key)
+            allow_none = serialize_when_none
+            if field.serialize_when_none is not None:
+                allow_none = field.serialize_when_none
+            (convert_value, validated, export) = _compile_field(field)
+            fields.append((name, serialized_name, tuple(lookup), field,
+                           field._default is not None, field.required,
+                           convert_value, validated, export, allow_none))
+        self.fields = tuple(fields)
+        self.accepted = frozenset(accepted)
+
+    def convert_data(self, raw_data, strict=True):
+        """Return the converted data of a model like
+        :func:`schematics.transforms.convert`."""
+        if not isinstance(raw_data, dict):
+            return convert(self.model_class, raw_data, strict=strict)
+        errors = {}
+        if strict:
+            accepted = self.accepted
+            for key in raw_data:
+                if key not in accepted:
+                    errors[key] = 'Rogue field'
+        data = {}
+        for (name, serialized_name, lookup, field, has_default, _,
+             convert_value, _, _, _) in self.fields:
+            value = None
+            for key in lookup:
+                if key in raw_data:
+                    value = raw_data[key]
+                    break
+            if value is None:
+                if has_default:
+                    value = field.default
+                if value is None:
+                    data[name] = None
+                    continue
+            try:
+                data[name] = convert_value(value)
+            except (ConversionError, ValidationError) as exc:
+                errors[serialized_name] = exc.messages
+        if errors:
+            raise ModelConversionError(errors, data)
+        return data
+
+    def convert(self, raw_data):
+        """Create a model from `raw_data` like `model_class(raw_data)`."""
+        if raw_data is None:
+            raw_data = {}
+        model = self.model_class.__new__(self.model_class)
+        model._initial = raw_data
+        model._data = self.convert_data(raw_data)
+        return model
+
+    def convert_nested(self, raw_data, strict):
+        """Create a nested model like `ModelType` does."""
+        model = self.model_class.__new__(self.model_class)
+        model._initial = {}
+        model._data = data = self.convert_data({})
+        for (key, value) in self.convert_data(raw_data, strict).items():
+            if value is not None:
+                data[key] = value
+        return model
+
+    def validate(self, model):
+        """Validate a model like `model.validate()`.
+
+        :raises: :exc:`schematics.exceptions.ModelValidationError`
+        """
+        source = model._data
+        errors = {}
+        data = {}
+        for (name, serialized_name, lookup, field, has_default, required, _,
+             validated, _, _) in self.fields:
+            value = None
+            for key in lookup:
+                if key in source:
+                    value = source[key]
+                    break
+            if value is None:
+                if has_default:
+                    value = field.default
+                if value is None:
+                    if required:
+                        errors[serialized_name] = [field.messages['required']]
+                    data[name] = None
+                    continue
+            try:
+                data[name] = validated(value)
+            except (ConversionError, ValidationError) as exc:
+                errors[serialized_name] = exc.messages
+        if errors:
+            raise ModelValidationError(errors)
+        source.update(data)
+
+    def to_primitive(self, model):
+        """Serialize a model like `model.to_primitive()`."""
+        source = getattr(model, '_data', model)
+        data = {}
+        for (name, serialized_name, _, _, _, _, _, _, export,
+             allow_none) in self.fields:
+            value = source[name]
+            if value is not None:
+                shaped = export(value)
+                if shaped is not None:
+                    data[serialized_name] = shaped
+                elif allow_none:
+                    data[serialized_name] = None
+            elif allow_none:
+                data[serialized_name] = None
+        return data or None
+
+    export_nested = to_primitive
+
+
+class SchematicsModel(object):
+    """The :class:`CompiledModel` interface for models that cannot be
+    compiled, calling the model class and its methods."""
+
+    def __init__(self, model_class):
+        self.model_class = model_class
+
+    def convert_data(self, raw_data, strict=True):
+        return convert(self.model_class, raw_data, strict=strict)
+
+    def convert(self, raw_data):
+        return self.model_class(raw_data)
+
+    def convert_nested(self, raw_data, strict):
+        model = self.model_class()
+        return model.import_data(raw_data, strict=strict)
+
+    def validate(self, model):
+        model.validate()
+
+    def to_primitive(self, model):
+        return model.to_primitive()
+
+    def export_nested(self, model):
+        return export_loop(self.model_class, model, _to_primitive_converter)
@@ -0,0 +1,139 @@
+# vim: set fileencoding=utf-8 :
+#
+# Copyright (c) 2013 Daniel Truemper <truemped at googlemail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+"""Compression of response bodies.
+
+Compression is enabled with the *compression* configuration setting::
+
+    $ python myservice.py --compression --compression_min_size=1024
+
+Responses with a compressible content type and a body of at least
+*compression_min_size* bytes are then compressed with **br** (if the `brotli`
+library is installed) or **gzip**, depending on the `Accept-Encoding` header
+of the client. The compression levels are set with *gzip_level* and
+*brotli_quality*. Bodies larger than *compression_offload_size* bytes are
+compressed in the default executor of the environment, as this is CPU bound
+and both libraries release the GIL while compressing.
+
+With `CacheConfig(server_cache=True)` the compressed variants are stored in
+the response cache, so that they are only compressed once.
+
+Streamed responses are never compressed by **supercell**. This replaces the
+`compress_response` setting of tornado, which compresses every response on
+the IOLoop.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from supercell._lru import LRUCache
+
+
+__all__ = ['compress', 'compressible', 'negotiate_encoding']
+
+
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+"""The supported content codings in the order of preference."""
+
+
+COMPRESSIBLE_TYPES = frozenset(['application/json', 'application/x-ndjson',
+                                'application/javascript', 'application/xml'])
+"""Content types besides `text/*`, `*+json` and `*+xml` that are
+compressed."""
+
+
+ENCODING_CACHE_SIZE = 64
+"""Number of distinct `Accept-Encoding` headers remembered."""
+
+
+_ENCODING_CACHE = LRUCache(ENCODING_CACHE_SIZE)
+
+
+_MISSING = object()
+
+
+def compressible(content_type):
+    """Return `True` if responses of `content_type` should be compressed."""
+    ctype = content_type.split(';', 1)[0].strip().lower()
+    return (ctype.startswith('text/') or ctype in COMPRESSIBLE_TYPES or
+            ctype.endswith('+json') or ctype.endswith('+xml'))
+
+
+def _parse_accept_encoding(accept_encoding):
+    """Return the preferred of the :data:`ENCODINGS` accepted by the client
+    or `None`."""
+    accepted = {}
+    for coding in accept_encoding.split(','):
+        parts = coding.split(';')
+        name = parts[0].strip().lower()
+        q = 1.0
+        for part in parts[1:]:
+            (key, _, value) = part.partition('=')
+            if key.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name] = q
+
+    wildcard = accepted.get('*', 0.0)
+    best = None
+    best_q = 0.0
+    for encoding in ENCODINGS:
+        q = accepted.get(encoding, wildcard)
+        if q > best_q:
+            best = encoding
+            best_q = q
+    return best
+
+
+def negotiate_encoding(accept_encoding):
+    """Return the content coding to use for the `accept_encoding` header or
+    `None` if the response should not be compressed.
+
+    The result is memoized in a bounded LRU cache keyed by the raw header
+    value.
+    """
+    if not accept_encoding:
+        return None
+    encoding = _ENCODING_CACHE.get(accept_encoding, _MISSING)
+    if encoding is _MISSING:
+        encoding = _parse_accept_encoding(accept_encoding)
+        _ENCODING_CACHE[accept_encoding] = encoding
+    return encoding
+
+
+def compress(data, encoding, level):
+    """Compress `data` with the content coding `encoding`.
+
+    :param data: the response body
+    :type data: bytes
+    :param encoding: **br** or **gzip**
+    :param level: the brotli quality or the gzip compression level
+    :type level: int
+    :rtype: bytes
+    """
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
@@ -19,14 +19,19 @@ from __future__ import (absolute_import, division, print_function,
                         with_statement)
 
 from collections import defaultdict
+import codecs
 import json
+import re
 
+from supercell import jsoncodec
 from supercell._compat import with_metaclass
+from supercell.compiledmodel import compile_model
 from supercell.mediatypes import ContentType, MediaType
-from supercell.acceptparsing import parse_accept_header
+from supercell.acceptparsing import cached_parse_accept_header
 
 
-__all__ = ['NoConsumerFound', 'ConsumerBase', 'JsonConsumer']
+__all__ = ['NoConsumerFound', 'ConsumerBase', 'JsonConsumer',
+           'NdJsonConsumer', 'LazyModel']
 
 
 class NoConsumerFound(Exception):
@@ -91,7 +96,7 @@ class ConsumerBase(with_metaclass(ConsumerMeta, object)):
 
         :raises: :exc:`NoConsumerFound`
         """
-        accept = parse_accept_header(content_type)
+        accept = cached_parse_accept_header(content_type)
         if len(accept) == 0:
             raise NoConsumerFound()
 
@@ -117,11 +122,115 @@ class ConsumerBase(with_metaclass(ConsumerMeta, object)):
         """This method should return the correct representation as a parsed
         model.
 
+        The model is converted but not validated, so that the handler may
+        complete it. It is consumed when the handler is called or, with
+        `consumes(..., lazy=True)`, on the first access to the model.
+
         :param model: the model to convert to a certain content type
         :type model: :class:`schematics.models.Model`
         """
         raise NotImplementedError
 
+    def consume_stream(self, handler, model):
+        """Return a parser for streamed request bodies.
+
+        This is used for handlers decorated with `consumes(..., stream=True)`.
+        The returned object must provide a `feed(data)` method, returning the
+        list of models completely parsed from the request body so far, and a
+        `close()` method returning the remaining models at the end of the
+        body. Both raise an exception on invalid input.
+
+        :param model: the model to convert to a certain content type
+        :type model: :class:`schematics.models.Model`
+        """
+        raise NotImplementedError
+
+
+class LazyModel(object):
+    """Proxy for a model that is only consumed from the request body when it
+    is accessed for the first time.
+
+    Handlers decorated with `consumes(..., lazy=True)` receive this proxy as
+    `model` keyword argument. Attribute and item access is forwarded to the
+    consumed model and `isinstance(model, MyModel)` holds, so requests
+    rejected by a middleware before the model is touched never pay for
+    decoding the body. Use :func:`resolve_model` to get the real model.
+
+    :param model_class: The class of the consumed model
+    :param consume: Callable returning the consumed model
+    """
+
+    __slots__ = ('_lazy_class', '_lazy_consume', '_lazy_model')
+
+    def __init__(self, model_class, consume):
+        object.__setattr__(self, '_lazy_class', model_class)
+        object.__setattr__(self, '_lazy_consume', consume)
+        object.__setattr__(self, '_lazy_model', None)
+
+    @property
+    def __class__(self):
+        return object.__getattribute__(self, '_lazy_class')
+
+    def __getattr__(self, name):
+        return getattr(resolve_model(self), name)
+
+    def __setattr__(self, name, value):
+        setattr(resolve_model(self), name, value)
+
+    def __delattr__(self, name):
+        delattr(resolve_model(self), name)
+
+    def __getitem__(self, key):
+        return resolve_model(self)[key]
+
+    def __setitem__(self, key, value):
+        resolve_model(self)[key] = value
+
+    def __delitem__(self, key):
+        del resolve_model(self)[key]
+
+    def __contains__(self, key):
+        return key in resolve_model(self)
+
+    def __iter__(self):
+        return iter(resolve_model(self))
+
+    def __len__(self):
+        return len(resolve_model(self))
+
+    def __bool__(self):
+        return bool(resolve_model(self))
+
+    __nonzero__ = __bool__
+
+    def __eq__(self, other):
+        return resolve_model(self) == resolve_model(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(resolve_model(self))
+
+    def __repr__(self):
+        return repr(resolve_model(self))
+
+    def __str__(self):
+        return str(resolve_model(self))
+
+
+def resolve_model(model):
+    """Return the model behind a :class:`LazyModel`, consuming it on first
+    access. Any other object is returned unchanged."""
+    if type(model) is not LazyModel:
+        return model
+    resolved = object.__getattribute__(model, '_lazy_model')
+    if resolved is None:
+        resolved = object.__getattribute__(model, '_lazy_consume')()
+        object.__setattr__(model, '_lazy_model', resolved)
+        object.__setattr__(model, '_lazy_consume', None)
+    return resolved
+
 
 class JsonConsumer(ConsumerBase):
     """Default **application/json** provider."""
@@ -130,10 +239,207 @@ class JsonConsumer(ConsumerBase):
     """The **application/json** :class:`ContentType`."""
 
     def consume(self, handler, model):
-        """Parse the body json via :func:`json.loads` and initialize the
-        `model`.
+        """Parse the body json via :func:`supercell.jsoncodec.loads` and
+        initialize the `model`.
 
         .. seealso:: :py:mod:`supercell.api.provider.ProviderBase.provide`
         """
         # TODO error if no request body is set
-        return model(json.loads(handler.request.body.decode('utf8')))
+        return compile_model(model).convert(
+            jsoncodec.loads(handler.request.body))
+
+    def consume_stream(self, handler, model):
+        """Parse a streamed json array of `model` items.
+
+        .. seealso::
+            :py:mod:`supercell.api.consumer.ConsumerBase.consume_stream`
+        """
+        return JsonArrayParser(model)
+
+
+class NdJsonConsumer(ConsumerBase):
+    """Newline delimited **application/x-ndjson** consumer."""
+
+    CONTENT_TYPE = ContentType(MediaType.ApplicationNdJson)
+    """The **application/x-ndjson** :class:`ContentType`."""
+
+    def consume(self, handler, model):
+        """Initialize the `model` from the only line of the body. As with
+        the :class:`JsonConsumer` the model is not validated."""
+        lines = [line for line in handler.request.body.split(b'\n')
+                 if line.strip()]
+        if len(lines) != 1:
+            raise ValueError('Expected exactly one json document')
+        return compile_model(model).convert(jsoncodec.loads(lines[0]))
+
+    def consume_stream(self, handler, model):
+        """Parse one `model` per line of the streamed body.
+
+        .. seealso::
+            :py:mod:`supercell.api.consumer.ConsumerBase.consume_stream`
+        """
+        return NdJsonParser(model)
+
+
+class NdJsonParser(object):
+    """Incremental parser for newline delimited json documents.
+
+    Only the chunks of the current incomplete line are buffered, they are
+    joined once the line is complete."""
+
+    def __init__(self, model):
+        self.model = compile_model(model)
+        self._chunks = []
+
+    def feed(self, data):
+        """Return the models of all complete lines."""
+        if b'\n' not in data:
+            self._chunks.append(data)
+            return []
+        lines = data.split(b'\n')
+        self._chunks.append(lines[0])
+        lines[0] = b''.join(self._chunks)
+        self._chunks = [lines.pop()]
+        return [self._parse(line) for line in lines if line.strip()]
+
+    def close(self):
+        """Return the model of a last line without a trailing newline."""
+        (line, self._chunks) = (b''.join(self._chunks), [])
+        if line.strip():
+            return [self._parse(line)]
+        return []
+
+    def _parse(self, line):
+        model = self.model.convert(jsoncodec.loads(line))
+        self.model.validate(model)
+        return model
+
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_STRUCTURE = re.compile(r'["{}\[\], \t\n\r]')
+_STRING_END = re.compile(r'["\\]')
+
+(_START, _FIRST_ITEM, _ITEM, _SEPARATOR, _END) = range(5)
+
+
+class JsonArrayParser(object):
+    """Incremental parser for a json array of documents.
+
+    Only the current incomplete array item is buffered. As the json libraries
+    cannot parse partial documents, the end of an item is found by scanning
+    its brackets and strings once and the item is only parsed when it is
+    complete, so invalid items are reported right away."""
+
+    def __init__(self, model):
+        self.model = compile_model(model)
+        self._decoder = codecs.getincrementaldecoder('utf8')()
+        self._json = json.JSONDecoder()
+        self._buf = u''
+        self._state = _START
+        self._scanned = 0
+        self._depth = 0
+        self._in_string = False
+
+    def feed(self, data):
+        """Return the models of all complete array items."""
+        self._buf += self._decoder.decode(data)
+        return self._parse()
+
+    def close(self):
+        """Return the remaining models and check the array is complete."""
+        self._buf += self._decoder.decode(b'', final=True)
+        models = self._parse()
+        if self._state != _END or self._buf.strip():
+            raise ValueError('Incomplete json array')
+        return models
+
+    def _parse(self):
+        buf = self._buf
+        pos = 0
+        models = []
+        while True:
+            pos = _WHITESPACE.match(buf, pos).end()
+            if pos >= len(buf):
+                break
+
+            char = buf[pos]
+            if self._state == _START:
+                if char != '[':
+                    raise ValueError('Expected a json array')
+                self._state = _FIRST_ITEM
+                pos += 1
+
+            elif self._state == _FIRST_ITEM and char == ']':
+                self._state = _END
+                pos += 1
+
+            elif self._state in (_FIRST_ITEM, _ITEM):
+                end = self._item_end(buf, pos)
+                if end is None:
+                    # wait for the rest of the item
+                    break
+                (obj, decoded) = self._json.raw_decode(buf[:end], pos)
+                if decoded != end:
+                    raise ValueError('Invalid item in json array')
+                pos = end
+                model = self.model.convert(obj)
+                self.model.validate(model)
+                models.append(model)
+                self._state = _SEPARATOR
+
+            elif self._state == _SEPARATOR and char in ',]':
+                self._state = _ITEM if char == ',' else _END
+                pos += 1
+
+            else:
+                raise ValueError('Unexpected %r in json array' % char)
+
+        self._buf = buf[pos:]
+        return models
+
+    def _item_end(self, buf, start):
+        """Return the end of the array item starting at `start` or `None` if
+        it is incomplete. Scanning resumes where the last call stopped."""
+        pos = start + self._scanned
+        depth = self._depth
+        in_string = self._in_string
+        end = None
+        while end is None:
+            match = (_STRING_END if in_string else _STRUCTURE).search(buf, pos)
+            if match is None:
+                pos = len(buf)
+                break
+            pos = match.start()
+            char = buf[pos]
+            if in_string:
+                if char == '\\':
+                    if pos + 1 >= len(buf):
+                        # resume at the escape once the next char arrived
+                        break
+                    pos += 2
+                    continue
+                in_string = False
+                if depth == 0:
+                    end = pos + 1
+            elif char == '"':
+                in_string = True
+            elif char in '{[':
+                depth += 1
+            elif char in '}]' and depth > 0:
+                depth -= 1
+                if depth == 0:
+                    end = pos + 1
+            elif depth == 0:
+                # the end of a scalar item
+                end = pos
+            pos += 1
+
+        if end is None:
+            self._scanned = pos - start
+            self._depth = depth
+            self._in_string = in_string
+        else:
+            self._scanned = 0
+            self._depth = 0
+            self._in_string = False
+        return end
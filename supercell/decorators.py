@@ -23,10 +23,15 @@ from __future__ import (absolute_import, division, print_function,
 
 from collections import defaultdict
 
+from tornado.web import stream_request_body
+
+from supercell.compiledmodel import compile_model
 from supercell.mediatypes import ContentType
+from supercell.provider import ProviderMeta, parse_validation_policy
 
 
-def provides(content_type, vendor=None, version=None, default=False):
+def provides(content_type, vendor=None, version=None, default=False,
+             validation=None):
     """Class decorator for mapping HTTP GET responses to content types and
     their representation.
 
@@ -51,6 +56,10 @@ def provides(content_type, vendor=None, version=None, default=False):
     :param float version: The vendor version
     :param bool default: If **True** and no **Accept** header is present, this
                          content type is provided
+    :param validation: The validation policy for models provided with this
+                       content type: **always**, **never**, **debug** or the
+                       fraction of models to validate. Defaults to the
+                       *response_validation* configuration setting
     """
 
     def wrapper(cls):
@@ -65,16 +74,25 @@ def provides(content_type, vendor=None, version=None, default=False):
                             vendor,
                             version)
         cls._PROD_CONTENT_TYPES[content_type].append(ctype)
+        if validation is not None:
+            if '_PROD_VALIDATION' not in cls.__dict__:
+                cls._PROD_VALIDATION = dict(
+                    getattr(cls, '_PROD_VALIDATION', {}))
+            cls._PROD_VALIDATION[ctype] = parse_validation_policy(validation)
         if default:
             assert 'default' not in cls._PROD_CONTENT_TYPES, 'TODO: nice msg'
             cls._PROD_CONTENT_TYPES['default'] = ctype
 
+        # invalidate compiled negotiation tables
+        ProviderMeta.GENERATION += 1
+
         return cls
 
     return wrapper
 
 
-def consumes(content_type, model, vendor=None, version=None):
+def consumes(content_type, model, vendor=None, version=None, stream=False,
+             lazy=False):
     """Class decorator for mapping HTTP POST and PUT bodies to
 
     Example::
@@ -86,11 +104,37 @@ def consumes(content_type, model, vendor=None, version=None):
                 # ...
                 raise s.OkCreated()
 
+    With `stream=True` the request body is not buffered. Instead it is parsed
+    while it arrives and each model is passed to
+    :func:`RequestHandler.model_received`. For **application/json** the body
+    is expected to be an array of models, for **application/x-ndjson** one
+    model per line::
+
+        @s.consumes(s.MediaType.ApplicationNdJson, model=Model, stream=True)
+        class MyBulkHandler(s.RequestHandler):
+
+            @s.async
+            def model_received(self, model):
+                yield self.environment.database.insert(model)
+
+            def post(self, *args, **kwargs):
+                raise s.OkCreated()
+
+    With `lazy=True` the request body is only consumed when the handler
+    accesses the `model` for the first time, so requests rejected by a
+    middleware before never decode the body. Consuming errors are then raised
+    as `400 Bad Request` from the first access to the
+    :class:`supercell.consumer.LazyModel`.
+
     :param str content_type: The base content type such as **application/json**
     :param model: The model that should be consumed.
     :type model: :class:`schematics.models.Model`
     :param str vendor: Any vendor information for the base content type
     :param float version: The vendor version
+    :param bool stream: If **True** the request body is consumed
+                        incrementally
+    :param bool lazy: If **True** the request body is consumed on first
+                      access to the model
     """
 
     def wrapper(cls):
@@ -99,6 +143,8 @@ def consumes(content_type, model, vendor=None, version=None):
             'class decorator'
         assert model, 'In order to consume content a schematics model ' + \
             'class has to be given via the model parameter'
+        assert not (stream and lazy), 'Streamed request bodies cannot be ' + \
+            'consumed lazily'
 
         if not hasattr(cls, '_CONS_CONTENT_TYPES'):
             cls._CONS_CONTENT_TYPES = defaultdict(list)
@@ -108,6 +154,13 @@ def consumes(content_type, model, vendor=None, version=None):
         ct = ContentType(content_type, vendor, version)
         cls._CONS_CONTENT_TYPES[content_type].append(ct)
         cls._CONS_MODEL[ct] = model
+        compile_model(model)
+
+        if lazy:
+            cls._CONS_LAZY = True
+        if stream:
+            cls._CONS_STREAM = True
+            cls = stream_request_body(cls)
         return cls
 
     return wrapper
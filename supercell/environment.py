@@ -30,6 +30,7 @@ from __future__ import (absolute_import, division, print_function,
                         with_statement)
 
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import timedelta
 import json
 
@@ -39,13 +40,45 @@ from greplin.scales import util
 from tornado.gen import coroutine as async
 from tornado.web import Application as _TAPP
 
-from supercell.cache import CacheConfigT
+from supercell.acceptparsing import accept_cache_stats
+from supercell.cache import (CacheConfigT, ResponseCache,
+                             compute_cache_header, compute_expires_header,
+                             server_cacheable)
+from supercell.executor import (DEFAULT_EXECUTOR, PROCESS_EXECUTOR,
+                                InstrumentedExecutor)
 from supercell.health import SystemHealthCheck
+from supercell.histogram import LatencyHistogram
+from supercell.metrics import PrometheusMetricsHandler
+from supercell.middleware import has_middlewares
+from supercell.profiler import ProfileHandler
+from supercell.provider import ProviderBase, parse_validation_policy
 from supercell.requesthandler import RequestHandler
+from supercell.stats import (aggregated_stats, route_stats_path,
+                             stats_container, summarize_stats,
+                             RequestMetrics)
 
 __all__ = ['Environment']
 
 
+CONFIG_ATTRIBUTES = (
+    ('request_metrics', 'collect_request_metrics'),
+    ('server_timing', 'server_timing'),
+    ('executor_workers', 'executor_workers'),
+    ('process_executor_workers', 'process_executor_workers'),
+    ('offload_serialization_size', 'offload_serialization_size'),
+    ('serialization_executor', 'serialization_executor'),
+    ('compression', 'compression'),
+    ('compression_min_size', 'compression_min_size'),
+    ('compression_offload_size', 'compression_offload_size'),
+    ('gzip_level', 'gzip_level'),
+    ('brotli_quality', 'brotli_quality'),
+    ('response_validation', 'response_validation'),
+    ('stats_dir', 'stats_dir'),
+)
+"""Pairs of configuration options and the environment attributes they are
+copied to by :func:`Environment.configure`."""
+
+
 Handler = namedtuple('Handler', ['host_pattern', 'path', 'handler_class',
                                  'init_dict', 'name', 'cache', 'expires'])
 
@@ -71,10 +104,33 @@ class Environment(object):
         """Initialize the handlers and health checks variables."""
         self._handlers = []
         self._cache_infos = {}
+        self._cache_headers = {}
         self._expires_infos = {}
+        self._expires_seconds = {}
+        self._stats_paths = {}
+        self.stats_dir = None
+        self._request_metrics = {}
+        self._phase_histograms = {}
+        self.collect_request_metrics = False
+        self.phase_timing = False
+        self.server_timing = False
+        self._executors = {}
+        self.executor_workers = 8
+        self.process_executor_workers = None
+        self.offload_serialization_size = 0
+        self.serialization_executor = DEFAULT_EXECUTOR
+        self._response_sizes = {}
+        self.compression = False
+        self.compression_min_size = 1024
+        self.compression_offload_size = 256 * 1024
+        self.gzip_level = 6
+        self.brotli_quality = 4
+        self.response_validation = 'always'
+        self._validation_stats = {}
         self._managed_objects = {}
         self._health_checks = {}
         self._finalized = False
+        self.response_cache = ResponseCache()
 
     def add_handler(self, path, handler_class, init_dict=None, name=None,
                     host_pattern='.*$', cache=None, expires=None):
@@ -101,7 +157,9 @@ class Environment(object):
         :type init_dict: dict
 
         :param name: If set the handler and its URL will be available in the
-                     `RequestHandler.reverse_url()` method.
+                     `RequestHandler.reverse_url()` method. The stats of the
+                     handler are recorded with this name instead of the
+                     `path`.
         :type name: str
 
         :param host_pattern: A regular expression for matching the hostname the
@@ -111,6 +169,9 @@ class Environment(object):
 
         :param cache: Cache info for GET and HEAD requests to this handler
                       defined by :class:`supercell.api.cache.CacheConfig`.
+                      The server side cache may not be enabled for handlers
+                      with middlewares on their GET or HEAD methods, as the
+                      cached responses would skip them.
         :type cache: supercell.api.cache.CacheConfig
 
         :param expires: Set the `Expires` header according to the provided
@@ -122,12 +183,24 @@ class Environment(object):
                           handler_class=handler_class, init_dict=init_dict,
                           name=name, cache=cache, expires=expires)
         self._handlers.append(handler)
+        if handler_class not in self._stats_paths:
+            self._stats_paths[handler_class] = \
+                name or route_stats_path(path)
         if cache:
             assert isinstance(cache, CacheConfigT), 'cache not a CacheConfig'
+            if server_cacheable(cache):
+                for verb in ('get', 'head'):
+                    if has_middlewares(getattr(handler_class, verb, None)):
+                        raise ValueError(
+                            'server_cache enabled for %s.%s with middlewares'
+                            % (handler_class.__name__, verb))
             self._cache_infos[handler_class] = cache
+            self._cache_headers[handler_class] = compute_cache_header(cache)
         if expires:
             assert isinstance(expires, timedelta), 'expires not a timedelta'
             self._expires_infos[handler_class] = expires
+            self._expires_seconds[handler_class] = \
+                int(expires.total_seconds())
 
     def add_managed_object(self, name, instance):
         """Add a managed instance to the environment.
@@ -157,14 +230,77 @@ class Environment(object):
         assert name not in self._managed_objects
         self._managed_objects[name] = instance
 
+    def add_executor(self, name, executor, max_workers=None):
+        """Add a named :mod:`concurrent.futures` executor to the
+        environment.
+
+        Blocking code can then be run in it using
+        :func:`supercell.api.run_in_executor`::
+
+            class MyService(s.Service):
+
+                def run(self):
+                    self.environment.add_executor(
+                        'database', ThreadPoolExecutor(4))
+
+        :param name: The executor identifier
+        :type name: str
+
+        :param executor: The executor
+        :type executor: concurrent.futures.Executor
+
+        :param max_workers: The number of workers of the executor, used for
+                            the `queued` stats
+        :type max_workers: int
+        """
+        assert not self._finalized
+        assert name not in self._executors
+        self._executors[name] = InstrumentedExecutor(executor, name,
+                                                     max_workers=max_workers)
+
+    def get_executor(self, name=DEFAULT_EXECUTOR):
+        """Return the :class:`supercell.executor.InstrumentedExecutor` with
+        the given name.
+
+        The **default** thread pool with `executor_workers` threads and the
+        **process** pool with `process_executor_workers` processes are
+        created when they are requested first, i.e. after the worker
+        processes have been forked.
+        """
+        executor = self._executors.get(name, None)
+        if executor is None:
+            if name == DEFAULT_EXECUTOR:
+                workers = self.executor_workers
+                pool = ThreadPoolExecutor(workers)
+            elif name == PROCESS_EXECUTOR:
+                workers = self.process_executor_workers or None
+                pool = ProcessPoolExecutor(workers)
+            else:
+                raise KeyError('%s not an executor' % name)
+            executor = self._executors[name] = InstrumentedExecutor(
+                pool, name, max_workers=workers)
+        return executor
+
+    def shutdown_executors(self, wait=True):
+        """Shutdown all executors."""
+        for executor in self._executors.values():
+            executor.shutdown(wait=wait)
+
     def _finalize(self):
         """When called it is not possible to add more managed objects.
 
         When the `Service.main()` method starts, it will call `_finalize()`
         in order to not be able to change the environment with respect to
-        managed objects and request handlers."""
+        managed objects and request handlers.
+
+        This also compiles the content negotiation tables of all handlers, so
+        that the first requests do not have to pay for it."""
         self._finalized = True
 
+        for handler in self._handlers:
+            if hasattr(handler.handler_class, '_PROD_CONTENT_TYPES'):
+                ProviderBase.negotiation_table(handler.handler_class)
+
     def __getattr__(self, name):
         """Retrieve a managed object from `self._managed_objects`."""
         if name not in self._managed_objects:
@@ -184,6 +320,25 @@ class Environment(object):
         assert name not in self._health_checks
         self._health_checks[name] = check
 
+    def configure(self, config):
+        """Copy the settings of the parsed `config` to the environment, see
+        :data:`CONFIG_ATTRIBUTES`."""
+        for (option, attribute) in CONFIG_ATTRIBUTES:
+            setattr(self, attribute, getattr(config, option))
+        self.phase_timing = config.phase_timing or config.server_timing
+        self.response_cache.max_size = config.response_cache_size
+
+    @property
+    def response_validation(self):
+        """The validation policy for provided models of handlers without
+        a `validation` policy in their `@provides` decorator."""
+        return self._response_validation
+
+    @response_validation.setter
+    def response_validation(self, policy):
+        self.validation_policy = parse_validation_policy(policy)
+        self._response_validation = policy
+
     @property
     def health_checks(self):
         """Simple property access for health checks."""
@@ -224,9 +379,15 @@ class Environment(object):
             self._app = Application(self, config,
                                     **self.tornado_settings)
 
-            # add the stats handler
-            self._app.add_handlers('.*', [('/_system/stats(.*)',
-                                          ScalesSupercellHandler)])
+            # add the stats handlers
+            self._app.add_handlers('.*', [
+                ('/_system/stats(.*)', ScalesSupercellHandler),
+                ('/_system/metrics', PrometheusMetricsHandler),
+                ('/_system/profile', ProfileHandler)])
+            stats_container('_internal')['acceptparsing'] = \
+                accept_cache_stats
+            stats_container('_internal')['response_cache'] = \
+                self.response_cache.stats
 
             # add the default health check
             self._app.add_handlers('.*', [('/_system/check',
@@ -259,6 +420,102 @@ class Environment(object):
         `Expires` header for GET and HEAD requests."""
         return self._expires_infos.get(handler, None)
 
+    def get_stats_path(self, handler):
+        """Return the path the stats of a certain handler are recorded with.
+
+        This is the `name` or the `path` of the first :func:`add_handler`
+        call for the handler."""
+        return self._stats_paths.get(handler, None)
+
+    def get_request_metrics(self, handler):
+        """Return the :class:`RequestMetrics` of a certain handler.
+
+        Request metrics are only collected if `collect_request_metrics` is
+        set and only for handlers added with :func:`add_handler`. They are
+        available in the **requests** stats of the handler."""
+        metrics = self._request_metrics.get(handler, None)
+        if metrics is None and self.collect_request_metrics:
+            path = self._stats_paths.get(handler, None)
+            if path is None:
+                return None
+            metrics = self._request_metrics[handler] = RequestMetrics()
+            stats_container(path)['requests'] = metrics
+        return metrics
+
+    def record_sampled_validation(self, handler, failed):
+        """Record a sampled validation of a model provided by a certain
+        handler.
+
+        The number of sampled models and of the validation failures caught
+        by sampling are available in the **validation** stats of the
+        handler."""
+        counters = self._validation_stats.get(handler, None)
+        if counters is None:
+            counters = self._validation_stats[handler] = \
+                {'sampled': 0, 'failures': 0}
+            path = self._stats_paths.get(handler, None)
+            if path is not None:
+                stats_container(path)['validation'] = counters
+        counters['sampled'] += 1
+        if failed:
+            counters['failures'] += 1
+
+    def record_phases(self, handler, phases):
+        """Record the duration of the request phases of a certain handler.
+
+        Phase timing is enabled with `phase_timing`, the histograms are
+        available in the **phases** stats of the handler. With
+        `server_timing` the phases are also returned in the `Server-Timing`
+        header."""
+        histograms = self._phase_histograms.get(handler, None)
+        if histograms is None:
+            path = self._stats_paths.get(handler, None)
+            if path is None:
+                return
+            histograms = self._phase_histograms[handler] = {}
+            stats_container(path)['phases'] = histograms
+        for (phase, seconds) in phases:
+            histogram = histograms.get(phase, None)
+            if histogram is None:
+                histogram = histograms[phase] = LatencyHistogram()
+            histogram.record(seconds)
+
+    def offload_serialization(self, handler):
+        """Return `True` if the responses of a certain handler should be
+        serialized in the `serialization_executor`.
+
+        This is the case if the average size of its recent responses is at
+        least `offload_serialization_size` bytes. The first response of a
+        handler is always serialized on the IOLoop."""
+        if not self.offload_serialization_size:
+            return False
+        size = self._response_sizes.get(handler, None)
+        return size is not None and size >= self.offload_serialization_size
+
+    def record_response_size(self, handler, size):
+        """Record the size of a serialized response of a certain handler
+        for :func:`offload_serialization`."""
+        if not self.offload_serialization_size:
+            return
+        average = self._response_sizes.get(handler, None)
+        if average is None:
+            self._response_sizes[handler] = size
+        else:
+            self._response_sizes[handler] = average + (size - average) / 8
+
+    def get_cache_header(self, handler):
+        """Return the precomputed `Cache-Control` header for a certain
+        handler."""
+        return self._cache_headers.get(handler, None)
+
+    def get_expires_header(self, handler):
+        """Return the current value of the `Expires` header for a certain
+        handler."""
+        seconds = self._expires_seconds.get(handler, None)
+        if seconds is None:
+            return None
+        return compute_expires_header(seconds)
+
     @property
     def config_name(self):
         """Determine the configuration file name for the machine this
@@ -279,7 +536,12 @@ class Environment(object):
 
 class ScalesSupercellHandler(RequestHandler):
     """Simple handler that returns the available **supercell** stats metrics
-    as `json`."""
+    as `json`.
+
+    When the stats of several worker processes are exported to the
+    *stats_dir*, the stats of all workers are merged. The stats of the
+    process answering the request are available with the `local` query
+    argument."""
 
     @async
     def get(self, path):
@@ -289,7 +551,13 @@ class ScalesSupercellHandler(RequestHandler):
         parts = path.split('/')
         if not parts[0]:
             parts = parts[1:]
-        statDict = util.lookup(scales.getStats(), parts)
+
+        stats_dir = self.environment.stats_dir
+        if stats_dir and self.get_argument('local', None) is None:
+            statDict = summarize_stats(
+                util.lookup(aggregated_stats(stats_dir), parts))
+        else:
+            statDict = util.lookup(scales.getStats(), parts)
 
         serialized = json.dumps(statDict, cls=scales.StatContainerEncoder)
         self.set_header('Content-Type', 'application/json')
@@ -0,0 +1,174 @@
+# vim: set fileencoding=utf-8 :
+#
+# Copyright (c) 2013 Daniel Truemper <truemped at googlemail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+"""Run blocking or CPU bound code without blocking the IOLoop.
+
+The :class:`~supercell.environment.Environment` manages named executors. The
+**default** executor is a thread pool with *executor_workers* threads, the
+**process** executor a process pool with *process_executor_workers*
+processes. Both are created when they are used first. Other executors can be
+added with :func:`~supercell.environment.Environment.add_executor`.
+
+Methods of request handlers decorated with :func:`run_in_executor` are run in
+an executor and return a `Future`::
+
+    class MyHandler(s.RequestHandler):
+
+        @s.run_in_executor
+        def _query(self, doc_id):
+            return blocking_driver.get(doc_id)
+
+        @s.async
+        def get(self, doc_id):
+            doc = yield self._query(doc_id)
+            raise s.Return(MyModel(doc))
+
+Functions can also be submitted directly. As the arguments of the
+**process** executor are pickled, only module level functions can be run in
+it::
+
+    result = yield self.environment.get_executor('process').submit(
+        build_report, data)
+
+For every executor the number of `pending` calls, the number of calls that
+are `queued` for a free worker, the number of `completed` and `failed` calls
+and the `wait` and `run` time histograms are available in the
+**/_system/stats/_internal/executor/<name>** stats. The stats belong to the
+executor instance, an executor created later with the same name replaces them.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+
+from functools import wraps
+import time
+
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+from supercell.histogram import LatencyHistogram
+from supercell.stats import stats_container
+
+
+__all__ = ['InstrumentedExecutor', 'run_in_executor']
+
+
+DEFAULT_EXECUTOR = 'default'
+
+
+PROCESS_EXECUTOR = 'process'
+
+
+STATS_PATH = '_internal/executor/%s'
+
+
+def _timed_call(fn, args, kwargs):
+    """Call `fn` and return the start and end time with the result."""
+    started = time.time()
+    result = fn(*args, **kwargs)
+    return (started, time.time(), result)
+
+
+class InstrumentedExecutor(object):
+    """Wrap a :mod:`concurrent.futures` executor and record its stats.
+
+    :func:`submit` returns a tornado `Future` that is resolved on the IOLoop
+    of the caller, so it can be yielded in coroutines and callbacks added to
+    it are not run in the worker threads.
+    """
+
+    def __init__(self, executor, name, max_workers=None):
+        self.executor = executor
+        self.name = name
+        self.max_workers = max_workers or \
+            getattr(executor, '_max_workers', None) or 1
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_histogram = LatencyHistogram()
+        self.run_histogram = LatencyHistogram()
+
+        container = stats_container(STATS_PATH % name)
+        container['max_workers'] = self.max_workers
+        container['pending'] = lambda: self.pending
+        container['queued'] = self.queued
+        container['completed'] = lambda: self.completed
+        container['failed'] = lambda: self.failed
+        container['latency'] = {'wait': self.wait_histogram,
+                                'run': self.run_histogram}
+
+    def queued(self):
+        """Return the number of calls waiting for a free worker."""
+        return max(0, self.pending - self.max_workers)
+
+    def submit(self, fn, *args, **kwargs):
+        """Run `fn(*args, **kwargs)` in the executor.
+
+        :return: A `Future` resolving to the result of `fn`
+        """
+        future = Future()
+        submitted = time.time()
+        cfuture = self.executor.submit(_timed_call, fn, args, kwargs)
+        self.pending += 1
+
+        def done(cfuture):
+            self.pending -= 1
+            try:
+                (started, finished, result) = cfuture.result()
+            except Exception as e:
+                self.failed += 1
+                future.set_exception(e)
+                return
+            self.completed += 1
+            self.wait_histogram.record(started - submitted)
+            self.run_histogram.record(finished - started)
+            future.set_result(result)
+
+        IOLoop.current().add_future(cfuture, done)
+        return future
+
+    def shutdown(self, wait=True):
+        """Shutdown the executor."""
+        self.executor.shutdown(wait=wait)
+
+
+def run_in_executor(fn=None, executor=DEFAULT_EXECUTOR):
+    """Decorator running a method in an executor of the environment.
+
+    The decorated method returns a `Future` resolving to its result. The
+    executor is looked up by name using the `environment` of the instance::
+
+        class MyHandler(s.RequestHandler):
+
+            @s.run_in_executor(executor='database')
+            def _query(self, doc_id):
+                return blocking_driver.get(doc_id)
+
+    As the instance is passed to the method, this cannot be used with the
+    **process** executor.
+    """
+    if fn is None:
+        return lambda fn: run_in_executor(fn, executor=executor)
+
+    assert executor != PROCESS_EXECUTOR, 'Methods cannot be run in the ' + \
+        'process executor, submit a module level function instead'
+
+    @wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        return self.environment.get_executor(executor).submit(
+            fn, self, *args, **kwargs)
+
+    return wrapper
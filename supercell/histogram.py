@@ -0,0 +1,187 @@
+# vim: set fileencoding=utf-8 :
+#
+# Copyright (c) 2013 Daniel Truemper <truemped at googlemail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+"""Fixed size log-linear latency histograms.
+
+Latencies are recorded in microseconds into buckets similar to HdrHistogram:
+each power of two is split into 64 linear sub buckets, so every recorded value
+is known with a relative error of less than 1.6%. All buckets are allocated
+upfront, recording a value is O(1) and histograms of several processes can
+be merged exactly.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+
+import math
+
+
+__all__ = ['LatencyHistogram', 'bucket_upper_bound']
+
+
+SUB_BUCKET_BITS = 7
+_SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+_HALF_SUB_BUCKET_BITS = SUB_BUCKET_BITS - 1
+
+PERCENTILES = (('p50', 50.0), ('p90', 90.0), ('p99', 99.0),
+               ('p999', 99.9))
+"""The percentiles reported by :func:`LatencyHistogram.summary`."""
+
+
+def _bucket_index(value):
+    """Return the bucket of a value in microseconds."""
+    if value < _SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return (shift << _HALF_SUB_BUCKET_BITS) + (value >> shift)
+
+
+def _highest_equivalent_value(index):
+    """Return the largest value in microseconds stored in bucket `index`."""
+    if index < _SUB_BUCKETS:
+        return index
+    shift = (index >> _HALF_SUB_BUCKET_BITS) - 1
+    sub_bucket = index - (shift << _HALF_SUB_BUCKET_BITS)
+    return ((sub_bucket + 1) << shift) - 1
+
+
+def bucket_upper_bound(seconds):
+    """Return the upper edge in seconds of the bucket containing `seconds`.
+
+    Cumulative counts are only exact at bucket edges, so bounds such as the
+    `le` labels of exported histograms are rounded up to the next edge, by
+    less than 1.6% of the bound."""
+    return _highest_equivalent_value(_bucket_index(int(seconds * 1000000))) \
+        / 1000000.0
+
+
+class LatencyHistogram(object):
+    """Histogram of latencies up to `max_seconds`.
+
+    Larger values are recorded as `max_seconds`. Calling the histogram
+    returns the :func:`summary`, which is how it is serialized by the
+    `greplin.scales` stats handler.
+    """
+
+    def __init__(self, max_seconds=3600):
+        self.max_value = int(max_seconds * 1000000)
+        self.counts = [0] * (_bucket_index(self.max_value) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = self.max_value
+        self.max = 0
+
+    def record(self, seconds):
+        """Record a latency in seconds."""
+        value = int(seconds * 1000000)
+        if value < 0:
+            value = 0
+        elif value > self.max_value:
+            value = self.max_value
+        self.counts[_bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def percentiles(self, percentiles):
+        """Return the values in seconds for a sorted list of
+        `percentiles`."""
+        if not self.count:
+            return [0.0] * len(percentiles)
+
+        ranks = [max(1, int(math.ceil(p * self.count / 100.0)))
+                 for p in percentiles]
+        result = []
+        seen = 0
+        for (index, count) in enumerate(self.counts):
+            if not count:
+                continue
+            seen += count
+            while len(result) < len(ranks) and seen >= ranks[len(result)]:
+                value = min(max(_highest_equivalent_value(index), self.min),
+                            self.max)
+                result.append(value / 1000000.0)
+            if len(result) == len(ranks):
+                break
+        return result
+
+    def cumulative_counts(self, bounds):
+        """Return the number of values less than or equal to the
+        :func:`bucket_upper_bound` of each of the sorted `bounds` in seconds.
+
+        A bucket containing a bound is counted completely, the counts are
+        exact for the bounds rounded up to the bucket edges."""
+        limits = [_bucket_index(int(bound * 1000000)) for bound in bounds]
+        result = [0] * len(limits)
+        position = 0
+        seen = 0
+        for (index, count) in enumerate(self.counts):
+            if not count:
+                continue
+            while position < len(limits) and index > limits[position]:
+                result[position] = seen
+                position += 1
+            if position == len(limits):
+                break
+            seen += count
+        for i in range(position, len(limits)):
+            result[i] = seen
+        return result
+
+    def summary(self):
+        """Return the number of recorded values, the minimum, maximum and
+        mean and the :data:`PERCENTILES` in seconds."""
+        result = {'count': self.count}
+        if self.count:
+            result['min'] = self.min / 1000000.0
+            result['max'] = self.max / 1000000.0
+            result['mean'] = self.total / self.count / 1000000.0
+            values = self.percentiles([p for (_, p) in PERCENTILES])
+            for ((name, _), value) in zip(PERCENTILES, values):
+                result[name] = value
+        return result
+
+    __call__ = summary
+
+    def snapshot(self):
+        """Return a JSON compatible copy of the histogram that can be merged
+        using :func:`merge`."""
+        return {'histogram': [[index, count] for (index, count)
+                              in enumerate(self.counts) if count],
+                'max_value': self.max_value, 'count': self.count,
+                'total': self.total, 'min': self.min, 'max': self.max}
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Create a histogram from a :func:`snapshot`."""
+        histogram = cls(snapshot['max_value'] / 1000000.0)
+        histogram.merge(snapshot)
+        return histogram
+
+    def merge(self, snapshot):
+        """Add the values of a :func:`snapshot` to this histogram."""
+        counts = self.counts
+        last = len(counts) - 1
+        for (index, count) in snapshot['histogram']:
+            counts[min(index, last)] += count
+        if snapshot['count']:
+            self.count += snapshot['count']
+            self.total += snapshot['total']
+            self.min = min(self.min, snapshot['min'])
+            self.max = max(self.max, min(snapshot['max'], self.max_value))
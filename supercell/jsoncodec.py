@@ -0,0 +1,128 @@
+# vim: set fileencoding=utf-8 :
+#
+# Copyright (c) 2013 Daniel Truemper <truemped at googlemail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+"""The JSON codec used by the default providers and consumers.
+
+By default the standard library :mod:`json` module is used. Faster libraries
+can be enabled with the *json_backend* configuration setting::
+
+    $ python myservice.py --json_backend=orjson
+
+Available backends are **json**, **ujson**, **rapidjson** and **orjson**.
+**auto** will pick the fastest one that is installed. If the configured
+library cannot be imported, the standard library is used.
+
+:func:`dumps` always returns `bytes` that can be written to the handler
+directly and :func:`loads` accepts the raw request body.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+
+import json
+import logging
+import sys
+
+
+__all__ = ['dumps', 'loads', 'use_backend']
+
+
+_BYTES_INPUT = sys.version_info[0] == 2 or sys.version_info >= (3, 6)
+
+
+def _json():
+    def dumps(obj):
+        return json.dumps(obj).encode('utf8')
+
+    if _BYTES_INPUT:
+        loads = json.loads
+    else:
+        def loads(data):
+            if isinstance(data, bytes):
+                data = data.decode('utf8')
+            return json.loads(data)
+
+    return (dumps, loads)
+
+
+def _ujson():
+    import ujson
+
+    def dumps(obj):
+        return ujson.dumps(obj).encode('utf8')
+
+    return (dumps, ujson.loads)
+
+
+def _rapidjson():
+    import rapidjson
+
+    def dumps(obj):
+        return rapidjson.dumps(obj).encode('utf8')
+
+    return (dumps, rapidjson.loads)
+
+
+def _orjson():
+    import orjson
+    return (orjson.dumps, orjson.loads)
+
+
+BACKENDS = {
+    'json': _json,
+    'ujson': _ujson,
+    'rapidjson': _rapidjson,
+    'orjson': _orjson,
+}
+"""Factories for the available JSON backends."""
+
+
+_AUTO_ORDER = ['orjson', 'rapidjson', 'ujson', 'json']
+
+
+backend = 'json'
+"""The name of the backend in use."""
+
+
+(dumps, loads) = _json()
+
+
+def use_backend(name):
+    """Switch the JSON backend used by :func:`dumps` and :func:`loads`.
+
+    :param name: One of the :data:`BACKENDS` or **auto**
+    :type name: str
+    :return: The name of the backend that is actually used
+    """
+    global backend, dumps, loads
+
+    if name == 'auto':
+        candidates = _AUTO_ORDER
+    elif name in BACKENDS:
+        candidates = [name, 'json']
+    else:
+        raise ValueError('Unknown JSON backend "%s"' % name)
+
+    for candidate in candidates:
+        try:
+            (dumps, loads) = BACKENDS[candidate]()
+        except ImportError:
+            if name != 'auto':
+                logging.getLogger('supercell').warning(
+                    'JSON backend "%s" not installed, using "json"', name)
+            continue
+        backend = candidate
+        return backend
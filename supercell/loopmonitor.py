@@ -0,0 +1,93 @@
+# vim: set fileencoding=utf-8 :
+#
+# Copyright (c) 2013 Daniel Truemper <truemped at googlemail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+"""Detect a blocked `IOLoop`.
+
+All requests of a **supercell** process are handled by one `IOLoop`, so a
+single blocking call stalls every request. The :class:`LoopMonitor` is
+started by the :class:`~supercell.service.Service` if one of these options is
+set:
+
+*loop_lag_interval*
+    Every `loop_lag_interval` seconds a timeout is scheduled and the delay
+    until it is actually run is recorded in the
+    **/_system/stats/_internal/ioloop/latency/lag** histogram.
+
+*blocking_threshold*
+    If a callback blocks the `IOLoop` for more than `blocking_threshold`
+    seconds, its stack is logged and the **blocked** counter in
+    **/_system/stats/_internal/ioloop** is incremented. This uses the
+    `SIGALRM` signal.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+
+import logging
+import traceback
+
+from supercell.stats import latency_histogram, stats_container
+
+
+__all__ = ['LoopMonitor']
+
+
+STATS_PATH = '_internal/ioloop'
+
+
+class LoopMonitor(object):
+    """Measure the lag of the `io_loop` and report blocking callbacks."""
+
+    def __init__(self, io_loop, lag_interval=None, blocking_threshold=None):
+        self.io_loop = io_loop
+        self.lag_interval = lag_interval
+        self.blocking_threshold = blocking_threshold
+        self.blocked = 0
+        self._deadline = None
+        self._timeout = None
+
+    def start(self):
+        """Start monitoring."""
+        if self.lag_interval:
+            self.histogram = latency_histogram(STATS_PATH, 'lag')
+            self._schedule()
+        if self.blocking_threshold:
+            stats_container(STATS_PATH)['blocked'] = lambda: self.blocked
+            self.io_loop.set_blocking_signal_threshold(
+                self.blocking_threshold, self._on_blocked)
+
+    def stop(self):
+        """Stop monitoring."""
+        if self._timeout is not None:
+            self.io_loop.remove_timeout(self._timeout)
+            self._timeout = None
+        if self.blocking_threshold:
+            self.io_loop.set_blocking_signal_threshold(None, None)
+
+    def _schedule(self):
+        self._deadline = self.io_loop.time() + self.lag_interval
+        self._timeout = self.io_loop.add_timeout(self._deadline,
+                                                 self._measure)
+
+    def _measure(self):
+        self.histogram.record(self.io_loop.time() - self._deadline)
+        self._schedule()
+
+    def _on_blocked(self, signum, frame):
+        self.blocked += 1
+        logging.getLogger('supercell').warning(
+            'IOLoop blocked for more than %s seconds in\n%s',
+            self.blocking_threshold, ''.join(traceback.format_stack(frame)))
@@ -41,6 +41,9 @@ class MediaType(object):
     TextHtml = 'text/html'
     """Content type for `text/html`"""
 
+    ApplicationNdJson = 'application/x-ndjson'
+    """Content type for newline delimited json `application/x-ndjson`"""
+
 
 ReturnInformationT = namedtuple('ReturnInformation', ['code', 'message'])
 
@@ -0,0 +1,301 @@
+# vim: set fileencoding=utf-8 :
+#
+# Copyright (c) 2013 Daniel Truemper <truemped at googlemail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+"""Expose the **supercell** stats in the Prometheus text format.
+
+The stats that are available in **/_system/stats** are also rendered as
+Prometheus metrics in **/_system/metrics**::
+
+    $ curl 'http://127.0.0.1/_system/metrics'
+    # TYPE supercell_latency_seconds histogram
+    supercell_latency_seconds_bucket{route="docs",method="get",le="0.001007"} 3
+    ...
+    # TYPE supercell_calls_total counter
+    supercell_calls_total{route="docs",method="get"} 42
+
+The `route` label is the stats path of the handler, the `method` label the
+name of the decorated method. Latencies recorded with the `latency` decorator
+are exported as histograms, meters of the `metered` decorator as counters and
+all other numeric stats as the `supercell_stat` gauge with the stats `name` as
+label.
+
+The :class:`~supercell.stats.RequestMetrics` collected with
+`--request_metrics` are exported as `supercell_requests_total` with `route`,
+`method` and `status` labels, `supercell_requests_in_flight`,
+`supercell_request_duration_seconds` and `supercell_request_bytes_total` and
+`supercell_response_bytes_total`.
+
+The request phases recorded with `--phase_timing` are exported as the
+`supercell_phase_seconds` histogram with `route` and `phase` labels.
+
+Metrics that carry their own labels can be added to a stats container as a
+:class:`LabeledMetrics` instance.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+
+from collections import namedtuple
+import numbers
+
+from greplin import scales
+from tornado.gen import coroutine
+
+from supercell._compat import UserDict
+from supercell.histogram import LatencyHistogram, bucket_upper_bound
+from supercell.requesthandler import RequestHandler
+from supercell.stats import aggregated_stats, is_histogram_snapshot
+
+
+__all__ = ['LabeledMetrics', 'PrometheusMetricsHandler', 'render_metrics']
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+"""Upper bounds of the exported latency histogram buckets in seconds. The
+`le` labels are rounded up to the edges of the
+:class:`~supercell.histogram.LatencyHistogram` buckets, e.g. **0.05** is
+exported as **0.050175**, so the bucket counts are exact."""
+
+
+_BUCKET_LABELS = tuple(',le="%s"' % bucket_upper_bound(bound)
+                       for bound in LATENCY_BUCKETS) + (',le="+Inf"',)
+
+
+LabeledMetrics = namedtuple('LabeledMetrics', ['name', 'type', 'help',
+                                               'samples'])
+"""A metric family with explicit labels.
+
+`type` is one of *counter*, *gauge* or *histogram* and `samples` a callable
+returning a list of `(labels, value)` tuples, where `labels` is a tuple of
+`(label, value)` pairs. Values of histograms are :class:`LatencyHistogram`
+instances or their snapshots.
+"""
+
+
+_LABELS_CACHE = {}
+_HISTOGRAM_CACHE = {}
+_MAX_CACHE_SIZE = 10000
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n',
+                                                                   '\\n')
+
+
+def _labels(labels):
+    """Render a tuple of `(label, value)` pairs, the result is cached."""
+    rendered = _LABELS_CACHE.get(labels, None)
+    if rendered is None:
+        rendered = ','.join('%s="%s"' % (name, _escape('%s' % value))
+                            for (name, value) in labels)
+        if len(_LABELS_CACHE) >= _MAX_CACHE_SIZE:
+            _LABELS_CACHE.clear()
+        _LABELS_CACHE[labels] = rendered
+    return rendered
+
+
+def _format(value):
+    if isinstance(value, numbers.Integral):
+        return '%d' % value
+    return repr(float(value))
+
+
+def _number(value):
+    return (isinstance(value, numbers.Number) and
+            not isinstance(value, bool))
+
+
+def _is_histogram(value):
+    return (isinstance(value, LatencyHistogram) or
+            is_histogram_snapshot(value))
+
+
+def _meter(value):
+    if isinstance(value, UserDict):
+        value = value.data
+    if isinstance(value, dict) and value.get('unit') == 'per second':
+        return value.get('count', 0)
+    return None
+
+
+class _Families(object):
+    """Samples grouped by metric family, as the text format requires."""
+
+    def __init__(self):
+        self.families = {}
+        self.order = []
+
+    def family(self, name, metric_type, help_text):
+        family = self.families.get(name, None)
+        if family is None:
+            family = self.families[name] = [
+                '# HELP %s %s' % (name, help_text),
+                '# TYPE %s %s' % (name, metric_type)]
+            self.order.append(name)
+        return family
+
+    def histogram(self, name, help_text, labels, histogram):
+        """Add the lines of a :class:`LatencyHistogram` or its snapshot.
+        They are only rendered again if values have been recorded since the
+        last time."""
+        family = self.family(name, 'histogram', help_text)
+        key = (name, labels)
+        if isinstance(histogram, LatencyHistogram):
+            version = (histogram.count, histogram.total)
+        else:
+            version = (histogram['count'], histogram['total'])
+        cached = _HISTOGRAM_CACHE.get(key, None)
+        if cached is not None and cached[0] == version:
+            family.extend(cached[1])
+            return
+
+        if not isinstance(histogram, LatencyHistogram):
+            histogram = LatencyHistogram.from_snapshot(histogram)
+        label_str = _labels(labels)
+        prefix = '%s_bucket{%s' % (name, label_str)
+        counts = histogram.cumulative_counts(LATENCY_BUCKETS)
+        counts.append(histogram.count)
+        lines = ['%s%s} %d' % (prefix, bucket, count)
+                 for (bucket, count) in zip(_BUCKET_LABELS, counts)]
+        lines.append('%s_sum{%s} %s' % (name, label_str,
+                                        _format(histogram.total / 1000000.0)))
+        lines.append('%s_count{%s} %d' % (name, label_str, histogram.count))
+        if len(_HISTOGRAM_CACHE) >= _MAX_CACHE_SIZE:
+            _HISTOGRAM_CACHE.clear()
+        _HISTOGRAM_CACHE[key] = (version, lines)
+        family.extend(lines)
+
+    def sample(self, name, metric_type, help_text, labels, value):
+        family = self.family(name, metric_type, help_text)
+        if labels:
+            family.append('%s{%s} %s' % (name, _labels(labels),
+                                         _format(value)))
+        else:
+            family.append('%s %s' % (name, _format(value)))
+
+    def lines(self):
+        for name in self.order:
+            for line in self.families[name]:
+                yield line
+
+
+def _walk(families, path, tree):
+    for key in sorted(tree):
+        value = tree[key]
+        if isinstance(value, LabeledMetrics):
+            _labeled(families, value)
+            continue
+        if callable(value) and not isinstance(value, LatencyHistogram):
+            value = value()
+        if isinstance(value, UserDict):
+            value = value.data
+
+        if key == 'requests' and isinstance(value, dict) and \
+                'in_flight' in value:
+            _request_metrics(families, path, value)
+            continue
+
+        if key == 'phases' and isinstance(value, dict):
+            for phase in sorted(value):
+                if _is_histogram(value[phase]):
+                    families.histogram(
+                        'supercell_phase_seconds', 'Duration of the phases',
+                        (('route', path), ('phase', phase)), value[phase])
+            continue
+
+        if key == 'latency' and isinstance(value, dict):
+            for name in sorted(value):
+                if _is_histogram(value[name]):
+                    families.histogram(
+                        'supercell_latency_seconds',
+                        'Latency of the decorated methods',
+                        (('route', path), ('method', name)), value[name])
+            continue
+
+        count = _meter(value)
+        if count is not None:
+            families.sample('supercell_calls_total', 'counter',
+                            'Calls of the metered methods',
+                            (('route', path), ('method', key)), count)
+        elif isinstance(value, dict):
+            _walk(families, '%s/%s' % (path, key) if path else key, value)
+        elif _number(value):
+            families.sample('supercell_stat', 'gauge',
+                            'Other supercell stats',
+                            (('route', path), ('name', key)), value)
+
+
+def _request_metrics(families, path, value):
+    route = (('route', path),)
+    for method in sorted(value['status']):
+        for (status, count) in sorted(value['status'][method].items()):
+            families.sample('supercell_requests_total', 'counter',
+                            'Finished requests',
+                            route + (('method', method), ('status', status)),
+                            count)
+    families.sample('supercell_requests_in_flight', 'gauge',
+                    'Requests in flight', route, value['in_flight'])
+    for method in sorted(value['latency']):
+        families.histogram('supercell_request_duration_seconds',
+                           'Request duration', route + (('method', method),),
+                           value['latency'][method])
+    families.sample('supercell_request_bytes_total', 'counter',
+                    'Request body bytes', route, value['request_bytes'])
+    families.sample('supercell_response_bytes_total', 'counter',
+                    'Response body bytes', route, value['response_bytes'])
+
+
+def _labeled(families, metrics):
+    for (labels, value) in metrics.samples():
+        if metrics.type == 'histogram':
+            if _is_histogram(value):
+                families.histogram(metrics.name, metrics.help, labels, value)
+        else:
+            families.sample(metrics.name, metrics.type, metrics.help,
+                            labels, value)
+
+
+def render_metrics(tree):
+    """Render the stats `tree` in the Prometheus text format and return the
+    list of lines."""
+    families = _Families()
+    _walk(families, '', tree)
+    return list(families.lines())
+
+
+class PrometheusMetricsHandler(RequestHandler):
+    """Return the **supercell** stats in the Prometheus text format.
+
+    As with the **/_system/stats** the stats of all workers are merged, the
+    `local` query argument returns the stats of the answering process.
+    """
+
+    @coroutine
+    def get(self):
+        stats_dir = self.environment.stats_dir
+        if stats_dir and self.get_argument('local', None) is None:
+            tree = aggregated_stats(stats_dir)
+        else:
+            tree = scales.getStats()
+
+        lines = render_metrics(tree)
+        lines.append('')
+        self.set_header('Content-Type', CONTENT_TYPE)
+        self.finish('\n'.join(lines))
@@ -20,21 +20,30 @@ from __future__ import (absolute_import, division, print_function,
 
 from abc import ABCMeta, abstractmethod
 from functools import wraps
+import weakref
 
 from schematics.models import Model
+from tornado.concurrent import is_future
 from tornado.gen import coroutine, Return
 
 from supercell._compat import with_metaclass
 from supercell.mediatypes import ReturnInformationT
 
 
+_CHAINS = weakref.WeakKeyDictionary()
+"""The middlewares and the handler method of the chains compiled by
+:func:`compile_chain`. Unlike function attributes this is not copied by
+`functools.wraps` to decorators wrapping a chain."""
+
+
 class Middleware(with_metaclass(ABCMeta, object)):
     """Base class for middleware implementations.
 
     Each request handler is assigned a list of `Middleware` implementations.
     Before a handler is called, each middleware is executed using the
     `Middleware.before` method. When the underlying handler is finished, the
-    `Middleware.after` method may manipulate the result.
+    `Middleware.after` method may manipulate the result. Both methods may be
+    coroutines or plain methods.
     """
 
     def __init__(self, *args, **kwargs):
@@ -45,31 +54,95 @@ class Middleware(with_metaclass(ABCMeta, object)):
         """Call the `before()` method and then the decorated method. If this
         returns a `Future`, add the `after()` method as a `done` callback.
         Otherwise execute it immediately.
+
+        Stacked middlewares are compiled into a single chain, see
+        :func:`compile_chain`.
         """
+        compiled = _CHAINS.get(fn, None)
+        if compiled is None:
+            return compile_chain([self], fn)
+        (middlewares, handler) = compiled
+        return compile_chain([self] + middlewares, handler)
 
-        @coroutine
-        @wraps(fn)
-        def before(other, *args, **kwargs):
-            before_result = yield self.before(other, args, kwargs)
+    @abstractmethod
+    def before(self, handler, args, kwargs):
+        """Method executed before the underlying request handler is called."""
 
-            if isinstance(before_result, (ReturnInformationT, Model)):
-                raise Return(before_result)
+    @abstractmethod
+    def after(self, handler, args, kwargs, result):
+        """Method executed after the unterlying request handler ist called."""
 
-            result = yield fn(other, *args, **kwargs)
 
-            after_result = yield self.after(other, args, kwargs, result)
+def _call(fn, *args, **kwargs):
+    """Call `fn` and return its result or the value of a raised `Return`."""
+    try:
+        return fn(*args, **kwargs)
+    except Return as e:
+        return e.value
 
-            if isinstance(after_result, (ReturnInformationT, Model)):
-                raise Return(after_result)
 
-            raise Return(result)
+def _is_result(value):
+    """Return `True` if a middleware replaces the result with `value`."""
+    return isinstance(value, (ReturnInformationT, Model))
 
-        return before
 
-    @abstractmethod
-    def before(self, handler, args, kwargs):
-        """Method executed before the underlying request handler is called."""
+def compile_chain(middlewares, fn):
+    """Compile the `middlewares` wrapping the handler method `fn` into a
+    single coroutine.
 
-    @abstractmethod
-    def after(self, handler, args, kwargs, result):
-        """Method executed after the unterlying request handler ist called."""
+    The `before()` methods are called from the outermost to the innermost
+    middleware, then `fn` and the `after()` methods in reverse order. If a
+    `before()` method returns a result, neither `fn` nor the inner
+    middlewares are called. Results that are not futures or already resolved
+    futures are used right away, so only pending futures suspend the chain.
+
+    Only chains wrapping each other directly are merged, other decorators
+    between two middlewares stay in place.
+
+    :param middlewares: The :class:`Middleware` instances, outermost first
+    :param fn: The handler method
+    """
+
+    @coroutine
+    @wraps(fn)
+    def chain(other, *args, **kwargs):
+        result = None
+        called = len(middlewares)
+        for (i, middleware) in enumerate(middlewares):
+            before_result = _call(middleware.before, other, args, kwargs)
+            if is_future(before_result):
+                before_result = before_result.result() \
+                    if before_result.done() else (yield before_result)
+            if _is_result(before_result):
+                result = before_result
+                called = i
+                break
+        else:
+            result = _call(fn, other, *args, **kwargs)
+            if is_future(result):
+                result = result.result() if result.done() else (yield result)
+
+        for middleware in reversed(middlewares[:called]):
+            after_result = _call(middleware.after, other, args, kwargs,
+                                 result)
+            if is_future(after_result):
+                after_result = after_result.result() \
+                    if after_result.done() else (yield after_result)
+            if _is_result(after_result):
+                result = after_result
+
+        raise Return(result)
+
+    _CHAINS[chain] = (middlewares, fn)
+    return chain
+
+
+def has_middlewares(fn):
+    """Return `True` if the handler method `fn` is wrapped by a middleware,
+    also behind decorators setting `__wrapped__`."""
+    fn = getattr(fn, '__func__', fn)
+    while fn is not None:
+        if fn in _CHAINS:
+            return True
+        fn = getattr(fn, '__wrapped__', None)
+    return False
@@ -0,0 +1,146 @@
+# vim: set fileencoding=utf-8 :
+#
+# Copyright (c) 2013 Daniel Truemper <truemped at googlemail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+"""Statistical profiler for running **supercell** processes.
+
+If the service is started with `--profiling`, the **/_system/profile**
+handler samples the stack of the `IOLoop` thread for some seconds and
+returns the collapsed stacks, that can be turned into a flame graph with
+e.g. `flamegraph.pl`::
+
+    $ curl 'http://127.0.0.1/_system/profile?seconds=10' > stacks.txt
+    $ flamegraph.pl stacks.txt > profile.svg
+
+The sampler uses the `ITIMER_PROF` timer, i.e. samples are only taken
+while the process is using CPU time. The overhead is a signal handler
+walking the stack every `interval` milliseconds (5 by default).
+"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+
+import signal
+
+from tornado import gen
+from tornado.web import HTTPError
+
+from supercell.requesthandler import RequestHandler
+
+
+__all__ = ['Sampler', 'ProfileHandler']
+
+
+MAX_PROFILE_SECONDS = 300
+"""Maximum duration of one profile."""
+
+
+def _frame_name(code):
+    return '%s (%s:%d)' % (code.co_name, code.co_filename,
+                           code.co_firstlineno)
+
+
+class Sampler(object):
+    """Sample the stack of the main thread every `interval` seconds of CPU
+    time.
+
+    Only one sampler can be running in a process, as it uses the `SIGPROF`
+    signal.
+    """
+
+    running = None
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+
+    def start(self):
+        """Start sampling."""
+        assert Sampler.running is None, 'Another sampler is running'
+        Sampler.running = self
+        self._previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        """Stop sampling."""
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._previous or signal.SIG_DFL)
+        Sampler.running = None
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        stack = tuple(stack)
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        self.samples += 1
+
+    def collapsed(self):
+        """Return the sampled stacks in the collapsed format, one line per
+        distinct stack with the frames from the root to the leaf separated
+        by semicolons, followed by the number of samples."""
+        names = {}
+        lines = []
+        for (stack, count) in self.stacks.items():
+            frames = []
+            for code in reversed(stack):
+                name = names.get(code, None)
+                if name is None:
+                    name = names[code] = _frame_name(code)
+                frames.append(name)
+            lines.append('%s %d' % (';'.join(frames), count))
+        lines.sort()
+        return lines
+
+
+class ProfileHandler(RequestHandler):
+    """Profile the process for `seconds` (10 by default) and return the
+    collapsed stacks.
+
+    The handler returns **404** unless *profiling* is enabled in the
+    configuration and **409** if a profile is already running. When running
+    several workers, only the worker answering the request is profiled.
+    """
+
+    @gen.coroutine
+    def get(self):
+        if not getattr(self.config, 'profiling', False):
+            raise HTTPError(404)
+        if not hasattr(signal, 'setitimer'):
+            raise HTTPError(501, reason='Profiling is not supported')
+        if Sampler.running is not None:
+            raise HTTPError(409, reason='Already profiling')
+
+        try:
+            seconds = float(self.get_argument('seconds', 10))
+            interval = float(self.get_argument('interval', 5)) / 1000
+        except ValueError:
+            raise HTTPError(400)
+        if not 0 < seconds <= MAX_PROFILE_SECONDS or interval <= 0:
+            raise HTTPError(400)
+
+        sampler = Sampler(interval)
+        sampler.start()
+        try:
+            yield gen.sleep(seconds)
+        finally:
+            sampler.stop()
+
+        lines = sampler.collapsed()
+        lines.append('')
+        self.set_header('Content-Type', 'text/plain; charset=utf-8')
+        self.finish('\n'.join(lines))
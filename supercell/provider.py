@@ -19,13 +19,69 @@ from __future__ import (absolute_import, division, print_function,
                         with_statement)
 
 from collections import defaultdict
+import random
 
-from supercell._compat import with_metaclass
-from supercell.mediatypes import ContentType, MediaType
-from supercell.acceptparsing import parse_accept_header
+from schematics.exceptions import ModelValidationError
+from tornado.concurrent import Future, is_future
+from tornado.gen import coroutine
 
+from supercell import jsoncodec
+from supercell._compat import with_metaclass, iteritems
+from supercell._lru import LRUCache
+from supercell.compiledmodel import compile_model
+from supercell.mediatypes import ContentType, ContentTypeT, MediaType
+from supercell.acceptparsing import cached_parse_accept_header
 
-__all__ = ['NoProviderFound', 'ProviderBase', 'JsonProvider']
+
+__all__ = ['NoProviderFound', 'ProviderBase', 'JsonProvider',
+           'NdJsonProvider']
+
+
+NEGOTIATION_CACHE_SIZE = 64
+"""Number of distinct `Accept` headers remembered per handler class."""
+
+
+_NO_PROVIDER = object()
+
+
+VALIDATION_POLICIES = ('always', 'never', 'debug')
+"""The named validation policies. A number between 0 and 1 validates this
+fraction of the provided models."""
+
+
+def parse_validation_policy(policy):
+    """Parse a validation `policy` into the fractions of models that are
+    validated without and with the **debug** setting.
+
+    :param policy: One of the :data:`VALIDATION_POLICIES` or a number
+                   between 0 and 1
+    :rtype: tuple of two floats
+    :raises: :exc:`ValueError` for unknown policies
+    """
+    if policy == 'always' or policy is True:
+        return (1.0, 1.0)
+    if policy == 'never' or policy is False:
+        return (0.0, 0.0)
+    if policy == 'debug':
+        return (0.0, 1.0)
+    try:
+        rate = float(policy)
+    except (TypeError, ValueError):
+        rate = -1.0
+    if not 0.0 <= rate <= 1.0:
+        raise ValueError('Unknown validation policy "%s"' % policy)
+    return (rate, rate)
+
+
+def validation_rate(policy, debug=False):
+    """Return the fraction of models that are validated with `policy`.
+
+    :param policy: One of the :data:`VALIDATION_POLICIES` or a number
+                   between 0 and 1
+    :param debug: If **True**, the **debug** policy validates all models
+    :rtype: float
+    """
+    return parse_validation_policy(policy)[1 if debug else 0]
 
 
 class NoProviderFound(Exception):
@@ -34,6 +90,32 @@ class NoProviderFound(Exception):
     pass
 
 
+def encode_json(obj):
+    """Encode `obj` with the configured JSON backend.
+
+    Like tornado we escape `</` so the output can be embedded in HTML.
+    """
+    return jsoncodec.dumps(obj).replace(b'</', b'<\\/')
+
+
+def _encode_model(model):
+    return encode_json(compile_model(model.__class__).to_primitive(model))
+
+
+def _encode_model_line(model):
+    return _encode_model(model) + b'\n'
+
+
+def _validate_and_encode(model):
+    compiled = compile_model(model.__class__)
+    compiled.validate(model)
+    return encode_json(compiled.to_primitive(model))
+
+
+def _validate_and_encode_line(model):
+    return _validate_and_encode(model) + b'\n'
+
+
 class ProviderMeta(type):
     """Meta class for all content type providers.
 
@@ -44,6 +126,10 @@ class ProviderMeta(type):
 
     KNOWN_CONTENT_TYPES = defaultdict(list)
 
+    GENERATION = 0
+    """Incremented whenever a provider or a `@provides` content type is
+    added, so that compiled negotiation tables can detect they are stale."""
+
     def __new__(cls, name, bases, dct):
         provider_class = type.__new__(cls, name, bases, dct)
 
@@ -51,9 +137,74 @@ class ProviderMeta(type):
             ct = provider_class.CONTENT_TYPE
             ProviderMeta.KNOWN_CONTENT_TYPES[ct.content_type].append(
                 (ct, provider_class))
+            ProviderMeta.GENERATION += 1
+
+        return provider_class
+
+
+def _known_provider(content_type):
+    """Return the provider registered for exactly this `content_type` or
+    `None` if there is none or the registration is ambiguous."""
+    known_types = [t for t in
+                   ProviderMeta.KNOWN_CONTENT_TYPES[content_type.content_type]
+                   if t[0] == content_type]
+    if len(known_types) == 1:
+        return known_types[0][1]
+    return None
+
+
+class NegotiationTable(object):
+    """Precompiled content negotiation for a single handler class.
+
+    The table maps every :class:`ContentTypeT` the handler provides directly
+    to its provider class. Results for complete `Accept` headers are kept in
+    a small LRU cache, so the common case of a few distinct clients resolves
+    with a single dictionary lookup.
+    """
+
+    def __init__(self, prod_content_types):
+        self.generation = ProviderMeta.GENERATION
+        self.providers = {}
+        self.default = None
+        self._cache = LRUCache(NEGOTIATION_CACHE_SIZE)
+
+        for (ctype, content_types) in iteritems(prod_content_types):
+            if ctype == 'default':
+                self.default = _known_provider(content_types)
+                continue
+            for content_type in content_types:
+                provider_class = _known_provider(content_type)
+                if provider_class is not None:
+                    self.providers[content_type] = provider_class
+
+    def resolve(self, accept_header):
+        """Return the provider class for the `accept_header`.
 
+        :raises: :exc:`NoProviderFound`
+        """
+        provider_class = self._cache.get(accept_header)
+        if provider_class is None:
+            provider_class = self._negotiate(accept_header)
+            self._cache[accept_header] = provider_class
+
+        if provider_class is _NO_PROVIDER:
+            raise NoProviderFound()
         return provider_class
 
+    def _negotiate(self, accept_header):
+        """Walk the accepted media ranges ordered by their quality."""
+        providers = self.providers
+        for (ctype, params, q) in cached_parse_accept_header(accept_header):
+            c = ContentTypeT(ctype, params.get('vendor', None),
+                             params.get('version', None))
+            if c in providers:
+                return providers[c]
+
+        if self.default is not None:
+            return self.default
+
+        return _NO_PROVIDER
+
 
 class ProviderBase(with_metaclass(ProviderMeta, object)):
     """Base class for content type providers.
@@ -89,46 +240,170 @@ class ProviderBase(with_metaclass(ProviderMeta, object)):
         if not hasattr(handler, '_PROD_CONTENT_TYPES'):
             raise NoProviderFound()
 
-        accept = parse_accept_header(accept_header)
-
-        if len(accept) > 0:
-            for (ctype, params, q) in accept:
-                if ctype not in handler._PROD_CONTENT_TYPES:
-                    continue
-
-                c = ContentType(ctype, vendor=params.get('vendor', None),
-                                version=params.get('version', None))
-                if c not in handler._PROD_CONTENT_TYPES[ctype]:
-                    continue
+        table = ProviderBase.negotiation_table(handler)
+        return table.resolve(accept_header)
 
-                known_types = [t for t in
-                               ProviderMeta.KNOWN_CONTENT_TYPES[ctype]
-                               if t[0] == c]
-
-                if len(known_types) == 1:
-                    return known_types[0][1]
-
-        if 'default' in handler._PROD_CONTENT_TYPES:
-            content_type = handler._PROD_CONTENT_TYPES['default']
-            ctype = content_type.content_type
-            default_type = [t for t in
-                            ProviderMeta.KNOWN_CONTENT_TYPES[ctype]
-                            if t[0] == content_type]
+    @staticmethod
+    def negotiation_table(handler):
+        """Return the compiled :class:`NegotiationTable` for a handler.
 
-            if len(default_type) == 1:
-                return default_type[0][1]
+        The table is built on first use and stored with the handler class. It
+        is rebuilt only if providers or content types have been added since.
 
-        raise NoProviderFound()
+        :param handler: supercell request handler class or instance
+        """
+        handler_class = handler if isinstance(handler, type) else \
+            handler.__class__
+        table = handler_class.__dict__.get('_PROD_NEGOTIATION', None)
+        if table is None or table.generation != ProviderMeta.GENERATION:
+            table = NegotiationTable(handler_class._PROD_CONTENT_TYPES)
+            handler_class._PROD_NEGOTIATION = table
+        return table
+
+    STREAM_CHUNK_SIZE = 64 * 1024
+    """Number of bytes buffered by :func:`stream` before flushing them to
+    the client."""
+
+    def should_validate(self, model, handler):
+        """Return `True` if `model` has to be validated before it is
+        provided.
+
+        This depends on the `validation` policy of the `@provides` decorator
+        of the handler for the content type of this provider or the
+        environment's `response_validation` policy. With a sampling policy
+        the sampled models are validated right away: failures are counted in
+        the **validation** stats of the handler and logged, but the model is
+        still provided.
+        """
+        policies = getattr(handler, '_PROD_VALIDATION', None)
+        policy = policies.get(self.CONTENT_TYPE, None) if policies else None
+        if policy is None:
+            policy = handler.environment.validation_policy
+        rate = policy[1 if handler.settings.get('debug', False) else 0]
+        if rate >= 1.0:
+            return True
+        if rate > 0.0 and random.random() < rate:
+            failed = False
+            try:
+                compile_model(model.__class__).validate(model)
+            except ModelValidationError as e:
+                failed = True
+                handler.logger.warning('Invalid %s provided: %s',
+                                       model.__class__.__name__, e.messages)
+            handler.environment.record_sampled_validation(handler.__class__,
+                                                          failed)
+        return False
 
     def provide(self, model, handler):
         """This method should return the correct representation as a simple
         string (i.e. byte buffer) that will be used as return value.
 
+        The method may also return a `Future`, the response is then finished
+        once it resolves. See :func:`write_encoded`.
+
         :param model: the model to convert to a certain content type
         :type model: supercell.schematics.Model
         """
         raise NotImplementedError
 
+    def write_encoded(self, model, handler, encode):
+        """Helper for implementing :func:`provide` writing `encode(model)`
+        to the client.
+
+        If the responses of the handler are usually larger than the
+        environment's `offload_serialization_size`, `encode` is called in
+        the `serialization_executor` and a `Future` is returned that
+        resolves once the response has been written. Small responses are
+        encoded inline. If the **process** executor is used, `encode` has to
+        be a module level function and the model must be picklable.
+
+        :param model: the model to write
+        :param handler: supercell request handler
+        :param encode: function returning the bytes for a model
+        """
+        environment = handler.environment
+        if not environment.offload_serialization(handler.__class__):
+            data = encode(model)
+            environment.record_response_size(handler.__class__, len(data))
+            handler.write(data)
+            return None
+
+        future = Future()
+        encoded = environment.get_executor(
+            environment.serialization_executor).submit(encode, model)
+
+        def write(encoded):
+            try:
+                data = encoded.result()
+            except Exception as e:
+                future.set_exception(e)
+                return
+            environment.record_response_size(handler.__class__, len(data))
+            handler.write(data)
+            future.set_result(None)
+
+        encoded.add_done_callback(write)
+        return future
+
+    def provide_stream(self, models, handler):
+        """Write a sequence of models to the client incrementally.
+
+        This is called when a request handler returns a generator (or any
+        other iterator) of models instead of a single model. Items may also be
+        futures resolving to a model. The method must return a `Future` that
+        resolves once the last model has been written.
+
+        :param models: iterator of models
+        :param handler: supercell request handler
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def supports_stream(cls):
+        """Return `True` if the provider implements :func:`provide_stream`.
+        """
+        provide_stream = getattr(cls.provide_stream, '__func__',
+                                 cls.provide_stream)
+        return provide_stream is not _BASE_PROVIDE_STREAM
+
+    @coroutine
+    def stream(self, models, handler, encode, prefix=b'', separator=b'',
+               suffix=b''):
+        """Helper for implementing :func:`provide_stream`.
+
+        Every model is validated and converted to bytes using `encode`. The
+        output is collected until :data:`STREAM_CHUNK_SIZE` bytes are buffered
+        and then flushed. Waiting for the flush to complete applies the
+        backpressure of the client connection to the iterator.
+        """
+        chunk_size = self.STREAM_CHUNK_SIZE
+        buf = [prefix]
+        size = len(prefix)
+        first = True
+        for model in models:
+            if is_future(model):
+                model = yield model
+            if self.should_validate(model, handler):
+                compile_model(model.__class__).validate(model)
+            data = encode(model)
+            if first:
+                first = False
+            else:
+                buf.append(separator)
+            buf.append(data)
+            size += len(data) + len(separator)
+            if size >= chunk_size:
+                handler.write(b''.join(buf))
+                buf = []
+                size = 0
+                yield handler.flush()
+        buf.append(suffix)
+        handler.write(b''.join(buf))
+
+
+_BASE_PROVIDE_STREAM = getattr(ProviderBase.provide_stream, '__func__',
+                               ProviderBase.provide_stream)
+
 
 class JsonProvider(ProviderBase):
     """Default `application/json` provider."""
@@ -136,12 +411,45 @@ class JsonProvider(ProviderBase):
     CONTENT_TYPE = ContentType(MediaType.ApplicationJson)
 
     def provide(self, model, handler):
-        """Simply return the json via `json.dumps`.
+        """Simply return the json via :func:`supercell.jsoncodec.dumps`.
 
         .. seealso:: :py:mod:`supercell.api.provider.ProviderBase.provide`
         """
-        model.validate()
-        handler.write(model.to_primitive())
+        handler.set_header('Content-Type', 'application/json; charset=UTF-8')
+        if self.should_validate(model, handler):
+            return self.write_encoded(model, handler, _validate_and_encode)
+        return self.write_encoded(model, handler, _encode_model)
+
+    def provide_stream(self, models, handler):
+        """Stream the models as a json array.
+
+        .. seealso:: :py:mod:`supercell.api.provider.ProviderBase.stream`
+        """
+        handler.set_header('Content-Type', 'application/json; charset=UTF-8')
+        return self.stream(models, handler, _encode_model, prefix=b'[',
+                           separator=b',', suffix=b']')
+
+
+class NdJsonProvider(ProviderBase):
+    """Newline delimited `application/x-ndjson` provider.
+
+    A single model is written as one line, a stream of models as one line
+    per model."""
+
+    CONTENT_TYPE = ContentType(MediaType.ApplicationNdJson)
+
+    def provide(self, model, handler):
+        """Write the model as a single json line."""
+        handler.set_header('Content-Type', MediaType.ApplicationNdJson)
+        if self.should_validate(model, handler):
+            return self.write_encoded(model, handler,
+                                      _validate_and_encode_line)
+        return self.write_encoded(model, handler, _encode_model_line)
+
+    def provide_stream(self, models, handler):
+        """Stream the models with one json document per line."""
+        handler.set_header('Content-Type', MediaType.ApplicationNdJson)
+        return self.stream(models, handler, _encode_model_line)
 
 
 class TornadoTemplateProvider(ProviderBase):
@@ -153,5 +461,8 @@ class TornadoTemplateProvider(ProviderBase):
         """Render a template with the given model into HTML.
 
         By default we will use the tornado built in template language."""
-        model.validate()
-        handler.render(handler.get_template(model), **model.to_primitive())
+        compiled = compile_model(model.__class__)
+        if self.should_validate(model, handler):
+            compiled.validate(model)
+        handler.render(handler.get_template(model),
+                       **compiled.to_primitive(model))
@@ -19,9 +19,60 @@
 from __future__ import (absolute_import, division, print_function,
                         with_statement)
 
+from collections import namedtuple
+
 from schematics.exceptions import ConversionError, ValidationError
+from schematics.types import BaseType
+from schematics.types.compound import ListType
 
 import supercell.api as s
+from supercell._lru import LRUCache
+
+
+QUERY_CACHE_SIZE = 128
+"""Default number of parsed query strings cached by each
+:class:`QueryParams`."""
+
+
+Range = namedtuple('Range', ['offset', 'limit'])
+"""A pagination range parsed by :class:`RangeType`. The `limit` is `None`
+for open ranges without a `max_limit`."""
+
+
+class RangeType(BaseType):
+    """Query parameter type for pagination ranges.
+
+    A range `first-last` such as `?items=0-49` is converted to a
+    :class:`Range` with `offset` 0 and `limit` 50. The last item may be
+    omitted, `?items=50-` then has the limit `max_limit`. Ranges larger than
+    `max_limit` are rejected.
+    """
+
+    def __init__(self, max_limit=None, **kwargs):
+        super(RangeType, self).__init__(**kwargs)
+        self.max_limit = max_limit
+
+    def to_native(self, value, context=None):
+        if isinstance(value, Range):
+            return value
+        try:
+            (first, last) = value.split('-', 1)
+            first = int(first)
+            last = int(last) if last else None
+        except (AttributeError, ValueError):
+            raise ConversionError('Value %r is not a range.' % value)
+        if first < 0 or (last is not None and last < first):
+            raise ConversionError('Value %r is not a valid range.' % value)
+        limit = self.max_limit if last is None else last - first + 1
+        if self.max_limit is not None and limit > self.max_limit:
+            raise ConversionError('Range %r is larger than %d items.' %
+                                  (value, self.max_limit))
+        return Range(first, limit)
+
+    def to_primitive(self, value, context=None):
+        if value.limit is None:
+            return '%d-' % value.offset
+        return '%d-%d' % (value.offset, value.offset + value.limit - 1)
 
 
 class QueryParams(s.Middleware):
@@ -52,6 +103,16 @@ class QueryParams(s.Middleware):
 
     If the parameter is missing, a HTTP 400 error is raised.
 
+    Parameters defined as `ListType` may be repeated or contain comma
+    separated values, `?id=1,2&id=3` is converted to `[1, 2, 3]` for
+    `ListType(IntType())`. Other parameters use the last value. For
+    pagination the :class:`RangeType` converts `?items=0-49` into a
+    :class:`Range`.
+
+    The query string is parsed once per request and the parsed parameters of
+    the last `cache_size` query strings are cached. Each request gets its own
+    copy of the parameters and of their lists.
+
     By default the dictionary containing the typed query parameters is added
     to the `kwargs` of the method with the key *query*. In order to change
     that, simply change the key in the definition::
@@ -64,27 +125,53 @@ class QueryParams(s.Middleware):
         ...
     """
 
-    def __init__(self, params, kwargs_name='query'):
+    def __init__(self, params, kwargs_name='query',
+                 cache_size=QUERY_CACHE_SIZE):
         super(QueryParams, self).__init__()
         self.params = params
         self.kwargs_name = kwargs_name
+        self._parsers = [(name, typedef.to_native, typedef.required,
+                          isinstance(typedef, ListType))
+                         for (name, typedef) in params]
+        self._cache = LRUCache(cache_size)
 
     @s.coroutine
     def before(self, handler, args, kwargs):
-        kwargs[self.kwargs_name] = q = {}
-        for (name, typedef) in self.params:
-            if handler.get_argument(name, None):
-                try:
-                    parsed = typedef(handler.get_argument(name))
-                    q[name] = parsed
-                except (ConversionError, ValidationError) as e:
-                    validation_errors = {name: e.messages}
-                    raise s.Error(additional=validation_errors)
-            elif typedef.required and not handler.get_argument(name, None):
-                raise s.Error(additional={'msg':
-                                          'Missing required argument "%s"' %
-                                          name})
+        query = handler.request.query
+        parsed = self._cache.get(query, None)
+        if parsed is None:
+            parsed = self._cache[query] = self.parse(handler)
+        kwargs[self.kwargs_name] = dict(
+            (name, list(value) if isinstance(value, list) else value)
+            for (name, value) in parsed.items())
+
+    def parse(self, handler):
+        """Convert the query arguments of the `handler`'s request in one
+        pass.
+
+        :raises: :class:`supercell.api.Error` for missing or invalid
+                 parameters
+        """
+        arguments = handler.request.query_arguments
+        q = {}
+        for (name, convert, required, multi) in self._parsers:
+            values = [handler.decode_argument(value, name=name).strip()
+                      for value in arguments.get(name, ())]
+            if multi:
+                values = [item.strip() for value in values
+                          for item in value.split(',')]
+            values = [value for value in values if value]
+            if not values:
+                if required:
+                    raise s.Error(additional={
+                        'msg': 'Missing required argument "%s"' % name})
+                continue
+            try:
+                q[name] = convert(values if multi else values[-1])
+            except (ConversionError, ValidationError) as e:
+                validation_errors = {name: e.messages}
+                raise s.Error(additional=validation_errors)
+        return q
 
-    @s.coroutine
     def after(self, handler, args, kwargs, result):
         pass
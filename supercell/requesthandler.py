@@ -18,8 +18,6 @@
 from __future__ import (absolute_import, division, print_function,
                         with_statement)
 
-from datetime import datetime
-import json
 import logging
 import time
 
@@ -27,14 +25,20 @@ from schematics.models import Model
 from tornado import gen, iostream
 from tornado.concurrent import is_future
 from tornado.escape import to_unicode
+from tornado.ioloop import IOLoop
 from tornado.util import bytes_type, unicode_type
 from tornado.web import (RequestHandler as rq, HTTPError,
                          _has_stream_request_body)
 
+from supercell import jsoncodec
 from supercell._compat import text_type
-from supercell.cache import compute_cache_header
+from supercell.compression import (compress, compressible,
+                                   negotiate_encoding)
+from supercell.cache import (compute_etag, compute_version_etag,
+                             server_cacheable)
 from supercell.mediatypes import MediaType, ReturnInformationT
-from supercell.consumer import ConsumerBase, NoConsumerFound
+from supercell.consumer import (ConsumerBase, LazyModel, NoConsumerFound,
+                                resolve_model)
 from supercell.provider import ProviderBase, NoProviderFound
 
 
@@ -44,6 +48,53 @@ __all__ = ['RequestHandler']
 _DEFAULT_CONTENT_TYPE = 'DEFAULT'
 
 
+_UNCACHED_HEADERS = frozenset(['Date', 'Server', 'Content-Length', 'Etag',
+                               'Cache-Control', 'Expires', 'Set-Cookie',
+                               'Transfer-Encoding'])
+
+
+def _is_model_stream(result):
+    """Generators and other iterators are streamed to the client."""
+    return hasattr(result, '__iter__') and (hasattr(result, '__next__') or
+                                            hasattr(result, 'next'))
+
+
+_PHASES = ('consume', 'handler', 'provide')
+
+
+class _PhaseTimer(object):
+    """Measure the time spent in the phases of a request.
+
+    The phases are **consume** (reading and parsing the request until the
+    handler method is called), **handler** (the handler method), **provide**
+    (validating and serializing the result) and **write** (finishing the
+    response until it has been written to the socket).
+    """
+
+    __slots__ = ('phases', '_last')
+
+    def __init__(self, start):
+        self.phases = []
+        self._last = start
+
+    def mark(self, name):
+        """End the current phase and name it `name`."""
+        now = time.time()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def next_phase(self):
+        """Return the first of the phases before **write** that has not been
+        marked yet."""
+        done = len(self.phases)
+        return _PHASES[done] if done < len(_PHASES) else _PHASES[-1]
+
+    def server_timing(self):
+        """Return the value of the `Server-Timing` header."""
+        return ', '.join('%s;dur=%.3f' % (name, seconds * 1000)
+                         for (name, seconds) in self.phases)
+
+
 def _decode_utf8_and_latin1(value):
     """Convert an string argument to a unicode string.
 
@@ -67,6 +118,13 @@ class RequestHandler(rq):
     the consuming and providing of request inputs and results.
     """
 
+    _latency_timers = None
+    _request_metrics = None
+    _response_bytes = 0
+    _phase_timer = None
+    _flushed = None
+    _compression_checked = False
+
     @property
     def environment(self):
         """Convinience method for accessing the environment."""
@@ -132,36 +190,342 @@ class RequestHandler(rq):
                 (model, consumer_class) = ConsumerBase.map_consumer(
                     headers['Content-Type'], self)
                 consumer = consumer_class()
-                kwargs['model'] = consumer.consume(self, model)
+                if getattr(self, '_CONS_STREAM', False):
+                    self._stream_parser = consumer.consume_stream(self, model)
+                    self._stream_error = None
+                elif getattr(self, '_CONS_LAZY', False):
+                    kwargs['model'] = LazyModel(
+                        model, lambda: self._consume_model(consumer, model))
+                else:
+                    kwargs['model'] = consumer.consume(self, model)
             except NoConsumerFound:
                 # TODO return available consumer types?!
                 raise HTTPError(406)
             except Exception as e:
                 raise HTTPError(400, reason=text_type(e))
 
+    def _consume_model(self, consumer, model):
+        """Consume the lazily consumed model on first access."""
+        try:
+            return consumer.consume(self, model)
+        except Exception as e:
+            raise HTTPError(400, reason=text_type(e))
+
+    def model_received(self, model):
+        """Implement this method to handle the models of a streamed request
+        body.
+
+        Requires the `consumes(..., stream=True)` decorator. The method may
+        return a `Future` in order to delay reading more of the body until it
+        is resolved.
+        """
+        raise NotImplementedError()
+
+    @gen.coroutine
+    def data_received(self, chunk):
+        """Feed the chunk of a streamed request body to the consumer and
+        pass the parsed models to :func:`model_received`.
+
+        Errors are remembered and reported once the body is complete, as a
+        response cannot be sent while the request is still being read.
+        """
+        parser = getattr(self, '_stream_parser', None)
+        if parser is None or self._stream_error is not None:
+            return
+        try:
+            for model in parser.feed(chunk):
+                result = self.model_received(model)
+                if is_future(result):
+                    yield result
+        except Exception as e:
+            self._stream_error = e
+
+    @gen.coroutine
+    def _finish_stream_consumer(self):
+        """Consume the remainder of a streamed request body."""
+        parser = getattr(self, '_stream_parser', None)
+        if parser is None:
+            return
+        try:
+            if self._stream_error is None:
+                for model in parser.close():
+                    result = self.model_received(model)
+                    if is_future(result):
+                        yield result
+        except Exception as e:
+            self._stream_error = e
+
+        if self._stream_error is not None:
+            raise HTTPError(400, reason=text_type(self._stream_error))
+
     def _add_cache_headers(self):
         """Maybe add cache headers on GET and HEAD requests."""
-        verb = self.request.method.lower()
-        if verb in ['get', 'head']:
+        verb = self.request.method
+        if verb == 'GET' or verb == 'HEAD':
             # check if there is caching information stored with the handler
-            cache_config = self.environment.get_cache_info(self.__class__)
-            if cache_config:
-                self.set_header('Cache-Control',
-                                compute_cache_header(cache_config))
+            environment = self.environment
+            cache_header = environment.get_cache_header(self.__class__)
+            if cache_header:
+                self.set_header('Cache-Control', cache_header)
+
+            expires_header = environment.get_expires_header(self.__class__)
+            if expires_header:
+                self.set_header('Expires', expires_header)
+
+    def etag_version(self, *args, **kwargs):
+        """Return the current version of the requested resource.
+
+        Only used if the handler was added with `CacheConfig(etag=True)`. The
+        version is called with the same arguments as the handler method and
+        may be a `Future`. If it is not `None` it is used to compute the
+        `Etag` and a matching `If-None-Match` header is answered with
+        `304 Not Modified` without calling the handler method.
+        """
+        return None
 
-            expires = self.environment.get_expires_info(self.__class__)
-            if expires:
-                self.set_header('Expires', datetime.now() + expires)
+    @gen.coroutine
+    def _check_etag_version(self):
+        """Answer conditional GET and HEAD requests using the
+        :func:`etag_version` of the handler."""
+        verb = self.request.method
+        if verb != 'GET' and verb != 'HEAD':
+            return
+        cache_config = self.environment.get_cache_info(self.__class__)
+        if not cache_config or not cache_config.etag:
+            return
+        version = self.etag_version(*self.path_args, **self.path_kwargs)
+        if is_future(version):
+            version = yield version
+        if version is None:
+            return
+        try:
+            provider_class = ProviderBase.map_provider(
+                self.request.headers.get('Accept', ''), self,
+                allow_default=True)
+        except NoProviderFound:
+            return
+
+        if self.environment.compression:
+            # the `Etag` depends on the accepted content coding
+            self.add_header('Vary', 'Accept-Encoding')
+        self.set_header('Etag', compute_version_etag(
+            version, provider_class.CONTENT_TYPE.content_type,
+            self._accepted_encoding()))
+        if self.check_etag_header():
+            self.set_status(304)
+            self.finish()
+
+    def compute_etag(self):
+        """Use a strong `Etag` of the body for handlers added with
+        `CacheConfig(etag=True)`."""
+        cache_config = self.environment.get_cache_info(self.__class__)
+        if cache_config and cache_config.etag:
+            return compute_etag(self._write_buffer)
+        return super(RequestHandler, self).compute_etag()
+
+    def _serve_cached_response(self):
+        """Answer GET and HEAD requests from the server side response cache
+        if the handler is configured to use it.
+
+        On a cache miss the key is remembered, so that :func:`finish` can
+        store the response."""
+        verb = self.request.method
+        if verb != 'GET' and verb != 'HEAD':
+            return
+        cache_config = self.environment.get_cache_info(self.__class__)
+        if not server_cacheable(cache_config):
+            return
+        try:
+            provider_class = ProviderBase.map_provider(
+                self.request.headers.get('Accept', ''), self,
+                allow_default=True)
+        except NoProviderFound:
+            return
+
+        key = (self.__class__, self.request.uri, provider_class,
+               self._headers.get('Etag'), self._accepted_encoding())
+        cached = self.environment.response_cache.get(key)
+        if cached is None:
+            self._response_cache_key = key
+            self._response_cache_max_age = \
+                cache_config.max_age.total_seconds()
+            return
+
+        seen = set()
+        for (name, value) in cached.headers:
+            if name in seen:
+                self.add_header(name, value)
+            else:
+                self.set_header(name, value)
+                seen.add(name)
+        self.finish(cached.body)
+
+    def flush(self, include_footers=False, callback=None):
+        """Responses that are flushed before they are finished are not
+        stored in the response cache."""
+        if not include_footers:
+            self._response_cache_key = None
+        if self._request_metrics is not None:
+            for chunk in self._write_buffer:
+                self._response_bytes += len(chunk)
+        self._flushed = super(RequestHandler, self).flush(
+            include_footers=include_footers, callback=callback)
+        return self._flushed
+
+    def _accepted_encoding(self):
+        """Return the content coding accepted by the client if compression
+        is enabled."""
+        if not self.environment.compression:
+            return None
+        return negotiate_encoding(
+            self.request.headers.get('Accept-Encoding', ''))
+
+    def _compression_encoding(self):
+        """Return the content coding and the size of the response body if
+        it should be compressed.
+
+        Compressible responses get a `Vary: Accept-Encoding` header, even if
+        the client does not accept any of the encodings."""
+        if self._compression_checked:
+            return (None, 0)
+        self._compression_checked = True
+        if (self._headers_written or 'Content-Encoding' in self._headers or
+                not compressible(
+                    to_unicode(self._headers.get('Content-Type', '')))):
+            return (None, 0)
+        size = sum(len(chunk) for chunk in self._write_buffer)
+        if size < self.environment.compression_min_size:
+            return (None, 0)
+        vary = ','.join(to_unicode(value)
+                        for value in self._headers.get_list('Vary'))
+        if 'accept-encoding' not in [name.strip().lower()
+                                     for name in vary.split(',')]:
+            # responses served from the response cache already have it
+            self.add_header('Vary', 'Accept-Encoding')
+        return (self._accepted_encoding(), size)
+
+    def _compress_response(self, offload=False):
+        """Compress the response body if the client accepts it.
+
+        With `offload` bodies larger than the `compression_offload_size` of
+        the environment are compressed in its default executor and a
+        `Future` is returned."""
+        (encoding, size) = self._compression_encoding()
+        if encoding is None:
+            return None
+        environment = self.environment
+        level = environment.brotli_quality if encoding == 'br' else \
+            environment.gzip_level
+        body = b''.join(self._write_buffer)
+        if (offload and environment.compression_offload_size and
+                size >= environment.compression_offload_size):
+            return self._compress_in_executor(body, encoding, level)
+        self._set_compressed_body(compress(body, encoding, level), encoding)
+        return None
+
+    @gen.coroutine
+    def _compress_in_executor(self, body, encoding, level):
+        """Compress the response body in the default executor."""
+        compressed = yield self.environment.get_executor().submit(
+            compress, body, encoding, level)
+        self._set_compressed_body(compressed, encoding)
+
+    def _set_compressed_body(self, body, encoding):
+        self._write_buffer = [body]
+        self.set_header('Content-Encoding', encoding)
+
+    def _finish_response(self):
+        """Finish the response. If it has to be compressed in an executor,
+        a `Future` is returned that resolves once it is finished."""
+        if self._finished:
+            return None
+        if self.environment.compression:
+            compressing = self._compress_response(offload=True)
+            if compressing is not None:
+                return self._finish_provided(compressing)
+        self.finish()
+        return None
+
+    def finish(self, chunk=None):
+        """Compress the response and store successful responses in the
+        response cache, if :func:`_serve_cached_response` asked for it."""
+        if self.environment.compression and not self._finished:
+            if chunk is not None:
+                self.write(chunk)
+                chunk = None
+            self._compress_response()
+        key = getattr(self, '_response_cache_key', None)
+        if (key is not None and self._status_code == 200 and
+                not self._finished and not hasattr(self, '_new_cookie')):
+            if chunk is not None:
+                self.write(chunk)
+                chunk = None
+            headers = [(name, value) for (name, value)
+                       in self._headers.get_all()
+                       if name not in _UNCACHED_HEADERS]
+            self.environment.response_cache.set(
+                key, headers, b''.join(self._write_buffer),
+                self._response_cache_max_age)
+        if self._status_code >= 400 and not self._headers_written:
+            # the version `Etag` set in `prepare()` is not valid for errors
+            self.clear_header('Etag')
+        timer = self._phase_timer
+        if timer is not None:
+            timer.mark(timer.next_phase())
+            if (self.environment.server_timing and
+                    not self._headers_written):
+                self.set_header('Server-Timing', timer.server_timing())
+        result = super(RequestHandler, self).finish(chunk)
+        if timer is not None:
+            self._phase_timer = None
+            flushed = self._flushed
+            if is_future(flushed) and not flushed.done():
+                IOLoop.current().add_future(
+                    flushed, lambda _: self._record_write_phase(timer))
+            else:
+                self._record_write_phase(timer)
+        if self._latency_timers:
+            self._record_latencies()
+        if self._request_metrics is not None:
+            self._request_metrics.finished(
+                self.request.method, self._status_code,
+                self.request.request_time(), self._response_bytes)
+            self._request_metrics = None
+        return result
+
+    def _record_write_phase(self, timer):
+        """Record the phases once the response has been written."""
+        timer.mark('write')
+        self.environment.record_phases(self.__class__, timer.phases)
+
+    def on_connection_close(self):
+        """Update the request metrics if the client went away."""
+        if self._request_metrics is not None:
+            self._request_metrics.aborted()
+            self._request_metrics = None
+        super(RequestHandler, self).on_connection_close()
+
+    def _record_latencies(self):
+        """Record the latencies measured by the `latency` decorator."""
+        now = time.time()
+        for (histogram, start) in self._latency_timers:
+            histogram.record(now - start)
+        self._latency_timers = None
 
     @gen.coroutine
     def prepare(self):
-        """Check for a consumer and optionally add the cache headers.
+        """Check for a consumer and optionally add the cache headers. If the
+        `etag_version` has not changed or the response is available in the
+        server side cache, it is sent right away.
 
         note:: when overriding the `prepare()` method, don't forget to call
                the super method.
         """
         self._check_consumer()
         self._add_cache_headers()
+        yield self._check_etag_version()
+        if not self._finished:
+            self._serve_cached_response()
 
     @gen.coroutine
     def _execute(self, transforms, *args, **kwargs):
@@ -173,6 +537,13 @@ class RequestHandler(rq):
         verb = self.request.method.lower()
         headers = self.request.headers
         self._transforms = transforms
+        environment = self.environment
+        metrics = environment.get_request_metrics(self.__class__)
+        if metrics is not None:
+            self._request_metrics = metrics
+            metrics.started(self.request)
+        if environment.phase_timing:
+            self._phase_timer = _PhaseTimer(self.request._start_time)
         try:
             if self.request.method not in self.SUPPORTED_METHODS:
                 raise HTTPError(405)
@@ -206,13 +577,20 @@ class RequestHandler(rq):
                     yield self.request.body
                 except iostream.StreamClosedError:
                     return
+                yield self._finish_stream_consumer()
 
+            if self._phase_timer is not None:
+                self._phase_timer.mark('consume')
             method = getattr(self, self.request.method.lower())
             result = method(*self.path_args, **self.path_kwargs)
             if is_future(result):
                 result = yield result
+            if self._phase_timer is not None and not self._finished:
+                self._phase_timer.mark('handler')
             if result is not None:
-                self._provide_result(verb, headers, result)
+                result = self._provide_result(verb, headers, result)
+                if is_future(result):
+                    yield result
             if self._auto_finish and not self._finished:
                 self.finish()
         except Exception as e:
@@ -226,7 +604,11 @@ class RequestHandler(rq):
 
     def _provide_result(self, verb, headers, result):
         """Find the correct provider for the result and call it with the final
-        result."""
+        result.
+
+        If the result is a generator of models, it is streamed to the client
+        and a `Future` is returned that resolves once the stream has been
+        written."""
 
         if isinstance(result, ReturnInformationT):
             self.set_header('Content-Type', MediaType.ApplicationJson)
@@ -234,23 +616,47 @@ class RequestHandler(rq):
             if result.message and 'additional' in result.message:
                 self.logger.info(result.message['additional'])
             if result.code != 204:
-                self.write(json.dumps(result.message))
+                self.write(jsoncodec.dumps(result.message))
 
-        elif not isinstance(result, Model):
+        elif isinstance(result, Model):
+            provider = self._get_provider(headers)
+            provided = provider.provide(resolve_model(result), self)
+            if is_future(provided):
+                return self._finish_provided(provided)
+
+        elif _is_model_stream(result):
+            provider = self._get_provider(headers)
+            if not provider.supports_stream():
+                raise HTTPError(406)
+            return self._provide_stream(provider, result)
+
+        else:
             # raise an error when something else than a model has been returned
             self.logger.error('Returning a non-model is not supported')
             raise HTTPError(500)
 
-        else:
-            try:
-                provider_class = ProviderBase.map_provider(
-                    headers.get('Accept', ''), self, allow_default=True)
-            except NoProviderFound:
-                raise HTTPError(406)
+        return self._finish_response()
 
-            provider = provider_class()
-            if isinstance(result, Model):
-                provider.provide(result, self)
+    def _get_provider(self, headers):
+        """Return a provider instance matching the `Accept` header."""
+        try:
+            provider_class = ProviderBase.map_provider(
+                headers.get('Accept', ''), self, allow_default=True)
+        except NoProviderFound:
+            raise HTTPError(406)
+        return provider_class()
 
+    @gen.coroutine
+    def _provide_stream(self, provider, models):
+        """Stream the `models` using the `provider`."""
+        yield provider.provide_stream(models, self)
         if not self._finished:
             self.finish()
+
+    @gen.coroutine
+    def _finish_provided(self, provided):
+        """Finish the request once the provider has written the result."""
+        yield provided
+        finishing = self._finish_response()
+        if finishing is not None:
+            yield finishing
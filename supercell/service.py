@@ -23,21 +23,30 @@ files as well as the command line. In the final step the
 from __future__ import (absolute_import, division, print_function,
                         with_statement)
 
+import errno
 import logging
 from logging import Formatter, StreamHandler
 import os
+import random
+import shutil
 import signal
 import socket
 import sys
+import tempfile
 import time
 
 import tornado.options
 from tornado.httpserver import HTTPServer
-from tornado.ioloop import IOLoop
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.netutil import bind_sockets
 from tornado.options import define
 
+from supercell.acceptparsing import set_accept_cache_size
 from supercell.environment import Environment
+from supercell.jsoncodec import use_backend
 from supercell.logging import SupercellLoggingHandler
+from supercell.loopmonitor import LoopMonitor
+from supercell.stats import export_stats, restart_meter_ticker
 
 
 define('logfile', default='root-%(pid)s.log',
@@ -66,6 +75,111 @@ define('max_grace_seconds', default=3,
 define('debug', default=False, help='If set, Tornado is started in debug mode')
 
 
+define('workers', default=1,
+       help='Number of worker processes sharing the listening socket')
+
+
+define('reuse_port', default=False,
+       help='If set, each worker binds its own socket with SO_REUSEPORT ' +
+       'and the kernel distributes the connections')
+
+
+define('stats_dir', default=None,
+       help='Directory the workers export their stats to, in order to ' +
+       'aggregate them in /_system/stats. A temporary directory is used ' +
+       'if not set and running with more than one worker')
+
+
+define('stats_export_interval', default=5,
+       help='Seconds between two stats exports of a worker')
+
+
+define('accept_cache_size', default=256,
+       help='Number of distinct Accept and Content-Type headers to cache ' +
+       'the parsed values for')
+
+
+define('json_backend', default='json',
+       help='JSON library used by the default providers and consumers: ' +
+       'json, ujson, rapidjson, orjson or auto')
+
+
+define('response_cache_size', default=64 * 1024 * 1024,
+       help='Maximum size in bytes of the server side response cache')
+
+
+define('request_metrics', default=False,
+       help='Collect request counts, status codes, latencies and sizes ' +
+       'for every handler')
+
+
+define('phase_timing', default=False,
+       help='Record the time spent in the consume, handler, provide and ' +
+       'write phases of every request')
+
+
+define('server_timing', default=False,
+       help='Return the request phase timings in the Server-Timing header')
+
+
+define('profiling', default=False,
+       help='Enable the sampling profiler in /_system/profile')
+
+
+define('loop_lag_interval', default=0.0,
+       help='If set, measure the IOLoop lag every this amount of seconds')
+
+
+define('blocking_threshold', default=0.0,
+       help='If set, log the stack of callbacks blocking the IOLoop for ' +
+       'more than this amount of seconds')
+
+
+define('executor_workers', default=8,
+       help='Number of threads of the default executor running blocking ' +
+       'code off the IOLoop')
+
+
+define('process_executor_workers', default=0,
+       help='Number of processes of the process executor. Defaults to the ' +
+       'number of CPUs')
+
+
+define('offload_serialization_size', default=0,
+       help='If set, responses of handlers whose responses are on average ' +
+       'larger than this amount of bytes are serialized in the ' +
+       'serialization_executor')
+
+
+define('serialization_executor', default='default',
+       help='Executor used for serializing large responses: default or ' +
+       'process')
+
+
+define('compression', default=False,
+       help='Compress responses with brotli or gzip')
+
+
+define('compression_min_size', default=1024,
+       help='Minimum size in bytes of compressed responses')
+
+
+define('compression_offload_size', default=256 * 1024,
+       help='Responses larger than this amount of bytes are compressed in ' +
+       'the default executor')
+
+
+define('gzip_level', default=6, help='The gzip compression level (1-9)')
+
+
+define('brotli_quality', default=4, help='The brotli quality (0-11)')
+
+
+define('response_validation', default='always',
+       help='Validation of provided models: always, never, debug (only ' +
+       'with --debug) or the fraction of models to validate')
+
+
 define('show_config_file_order', default=False,
        help='Show the order of config files to be parsed')
 
@@ -78,10 +192,42 @@ define('show_config', default=False,
        help='Show the effective configuration')
 
 
+MAX_WORKER_RESTARTS = 100
+"""Maximum number of crashed worker processes that are restarted."""
+
+
+def bind_reuse_port_sockets(port, address=None, backlog=128):
+    """Create listening sockets with `SO_REUSEPORT`, so that every worker
+    process can bind its own socket to the same port."""
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        raise ValueError('SO_REUSEPORT is not supported on this platform')
+
+    sockets = []
+    if address == '':
+        address = None
+    for res in set(socket.getaddrinfo(address, port, socket.AF_UNSPEC,
+                                      socket.SOCK_STREAM, 0,
+                                      socket.AI_PASSIVE)):
+        (af, socktype, proto, _, sockaddr) = res
+        sock = socket.socket(af, socktype, proto)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        if af == socket.AF_INET6 and hasattr(socket, 'IPPROTO_IPV6'):
+            sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
+        sock.setblocking(0)
+        sock.bind(sockaddr)
+        sock.listen(backlog)
+        sockets.append(sock)
+    return sockets
+
+
 class Service(object):
     """Main service implementation managing the
     :class:`tornado.web.Application` and taking care of configuration."""
 
+    worker_id = None
+    """The number of the worker process when started with `--workers`."""
+
     def main(self, with_signals=True):
         """Main method starting a **supercell** process.
 
@@ -95,6 +241,18 @@ class Service(object):
         (http://circus.readthedocs.org/). There you would bind the socket from
         circus and start the worker processes by binding to the file
         descriptor.
+
+        Without an external supervisor, `--workers=N` pre-forks `N` worker
+        processes sharing the listening socket. The parent process only
+        supervises the workers, see :func:`Service.supervise_workers()`.
+        With `--reuse_port` each worker binds its own socket using
+        `SO_REUSEPORT` instead.
+
+        .. note::
+            The application and the managed objects are created before the
+            workers are forked. Managed objects holding connections or
+            threads should therefore create them lazily, and the `IOLoop`
+            must not be created before the workers are forked.
         """
         app = self.get_app()
 
@@ -104,6 +262,18 @@ class Service(object):
             sock = socket.fromfd(int(self.config.socketfd), socket.AF_INET,
                                  socket.SOCK_STREAM)
             self.server.add_socket(sock)
+        elif self.config.workers > 1:
+            sockets = None
+            if not self.config.reuse_port:
+                sockets = bind_sockets(self.config.port,
+                                       address=self.config.address)
+            self.worker_id = self.supervise_workers(self.config.workers)
+            if sockets is None:
+                sockets = bind_reuse_port_sockets(self.config.port,
+                                                  address=self.config.address)
+            self.server.add_sockets(sockets)
+            if self.environment.stats_dir:
+                self.start_stats_export()
         else:
             self.server.bind(self.config.port, address=self.config.address)
             self.server.start(1)
@@ -114,9 +284,126 @@ class Service(object):
             signal.signal(signal.SIGTERM, sig_handler)
             signal.signal(signal.SIGINT, sig_handler)
 
+        if self.config.loop_lag_interval or self.config.blocking_threshold:
+            self.loop_monitor = LoopMonitor(
+                IOLoop.instance(), self.config.loop_lag_interval,
+                self.config.blocking_threshold)
+            self.loop_monitor.start()
+
         self.slog.info('Starting supercell')
         IOLoop.instance().start()
 
+    def supervise_workers(self, num_workers):
+        """Fork `num_workers` worker processes and supervise them.
+
+        In the workers this method returns the number of the worker. The
+        parent process never returns: crashed workers are restarted and
+        `SIGTERM` and `SIGINT` are forwarded to all workers, which will then
+        :func:`shutdown()` gracefully. Once all workers have exited, the
+        parent exits, too.
+
+        Without a *stats_dir* the workers export their stats to a temporary
+        directory of the service, which the parent removes when it exits.
+
+        As with :func:`tornado.process.fork_processes`, the `IOLoop` must not
+        have been created yet, as it would be shared by all workers.
+        """
+        if IOLoop.initialized():
+            raise RuntimeError('Cannot fork workers: the IOLoop instance ' +
+                               'has already been initialized')
+        children = {}
+        stopping = []
+
+        if not self.environment.stats_dir:
+            self._temp_stats_dir = tempfile.mkdtemp(prefix='supercell-stats-')
+            self.environment.stats_dir = self._temp_stats_dir
+
+        def start_worker(worker_id):
+            pid = os.fork()
+            if pid == 0:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                random.seed()
+                restart_meter_ticker()
+                return worker_id
+            children[pid] = worker_id
+            return None
+
+        for worker_id in range(num_workers):
+            if start_worker(worker_id) is not None:
+                return worker_id
+        self.slog.info('Started %s workers', num_workers)
+
+        def forward_signal(sig, frame):
+            stopping.append(sig)
+            for pid in list(children):
+                try:
+                    os.kill(pid, sig)
+                except OSError:
+                    pass
+        signal.signal(signal.SIGTERM, forward_signal)
+        signal.signal(signal.SIGINT, forward_signal)
+
+        restarts = 0
+        while children:
+            try:
+                (pid, status) = os.wait()
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if pid not in children:
+                continue
+            worker_id = children.pop(pid)
+            if stopping:
+                continue
+            if os.WIFSIGNALED(status):
+                self.slog.warning('Worker %s (pid %s) killed by signal %s',
+                                  worker_id, pid, os.WTERMSIG(status))
+            elif os.WEXITSTATUS(status) != 0:
+                self.slog.warning('Worker %s (pid %s) exited with status %s',
+                                  worker_id, pid, os.WEXITSTATUS(status))
+            else:
+                self.slog.info('Worker %s (pid %s) exited', worker_id, pid)
+                continue
+
+            restarts += 1
+            if restarts > MAX_WORKER_RESTARTS:
+                self._remove_temp_stats_dir()
+                raise RuntimeError('Too many worker restarts, giving up')
+            if start_worker(worker_id) is not None:
+                return worker_id
+
+        self.slog.info('All workers stopped')
+        self._remove_temp_stats_dir()
+        sys.exit(0)
+
+    def _remove_temp_stats_dir(self):
+        """Remove the temporary stats directory of the workers, if
+        :func:`supervise_workers()` created one."""
+        temp_stats_dir = getattr(self, '_temp_stats_dir', None)
+        if temp_stats_dir:
+            shutil.rmtree(temp_stats_dir, ignore_errors=True)
+            self.environment.stats_dir = None
+            self._temp_stats_dir = None
+
+    def start_stats_export(self):
+        """Periodically export the stats of this worker to the *stats_dir*,
+        so that **/_system/stats** can merge the stats of all workers."""
+        filename = os.path.join(self.environment.stats_dir,
+                                'worker-%s.json' % self.worker_id)
+
+        def export():
+            try:
+                export_stats(filename)
+            except (IOError, OSError):
+                self.slog.exception('Exporting the stats failed')
+
+        export()
+        self._stats_export = PeriodicCallback(
+            export, self.config.stats_export_interval * 1000)
+        self._stats_export.start()
+
     def shutdown(self):
         """Gaceful shutdown of the server.
 
@@ -137,6 +424,7 @@ class Service(object):
                 io_loop.add_timeout(now + 1, stop_loop)
             else:
                 io_loop.stop()
+                self.environment.shutdown_executors(wait=False)
                 self.slog.info('Shutdown')
         stop_loop()
 
@@ -175,6 +463,10 @@ class Service(object):
         # initialize logging
         self.initialize_logging()
 
+        set_accept_cache_size(self.config.accept_cache_size)
+        use_backend(self.config.json_backend)
+        self.environment.configure(self.config)
+
         # add handlers, health checks, managed objects to the environment
         self.run()
 
@@ -19,16 +19,323 @@ from __future__ import (absolute_import, division, print_function,
                         with_statement)
 
 from functools import wraps
+import json
+import logging
+import math
+import numbers
+import os
 import time
 
 from greplin import scales
-from greplin.scales.meter import MeterStat
+from greplin.scales import meter
+from greplin.scales.meter import MeterStatDict
+from greplin.scales.timer import RepeatTimer
 
 from tornado.concurrent import Future
 
+from supercell.histogram import LatencyHistogram
 from supercell.requesthandler import RequestHandler
 
 
+class _StatsNode(object):
+    """Anchor object for a `greplin.scales` stats container."""
+    pass
+
+
+_STATS_CONTAINERS = {}
+
+
+MAX_STATS_PATHS = 1000
+"""Maximum number of distinct stats paths. The stats of any further path are
+recorded in :data:`OVERFLOW_STATS_PATH`."""
+
+
+OVERFLOW_STATS_PATH = '_overflow'
+
+
+def stats_container(path):
+    """Return the `greplin.scales` stats container for `path`.
+
+    Values added to the container are returned by the **/_system/stats**
+    handler. Callables are called when the stats are serialized, which makes
+    them a cheap way to expose counters that are maintained elsewhere.
+
+    In order to keep the memory bounded, at most :data:`MAX_STATS_PATHS`
+    containers are created.
+    """
+    entry = _STATS_CONTAINERS.get(path, None)
+    if entry is None:
+        if len(_STATS_CONTAINERS) >= MAX_STATS_PATHS:
+            if OVERFLOW_STATS_PATH not in _STATS_CONTAINERS:
+                logging.getLogger('supercell').warning(
+                    'More than %s stats paths, recording new ones in "%s"',
+                    MAX_STATS_PATHS, OVERFLOW_STATS_PATH)
+            path = OVERFLOW_STATS_PATH
+            entry = _STATS_CONTAINERS.get(path, None)
+    if entry is None:
+        # scales keys the containers by the id() of the object, so the node
+        # must be kept alive
+        node = _StatsNode()
+        entry = _STATS_CONTAINERS[path] = (node, scales.init(node, path))
+    return entry[1]
+
+
+class RequestMetrics(object):
+    """Request metrics of a handler, collected for every handler if the
+    environment has been configured with `collect_request_metrics`.
+
+    Calling the instance returns the number of requests per HTTP method and
+    status class, the number of requests in flight, the latencies per HTTP
+    method and the number of request and response body bytes.
+    """
+
+    def __init__(self):
+        self.in_flight = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.status = {}
+        self.latency = {}
+
+    def started(self, request):
+        """Count a new request."""
+        self.in_flight += 1
+        length = request.headers.get('Content-Length', None)
+        if length:
+            try:
+                self.request_bytes += int(length)
+            except ValueError:
+                pass
+
+    def finished(self, method, status_code, seconds, response_bytes):
+        """Count a finished request."""
+        self.in_flight -= 1
+        self.response_bytes += response_bytes
+        counts = self.status.get(method, None)
+        if counts is None:
+            counts = self.status[method] = [0, 0, 0, 0, 0]
+            self.latency[method] = LatencyHistogram()
+        counts[min(max(status_code // 100, 1), 5) - 1] += 1
+        self.latency[method].record(seconds)
+
+    def aborted(self):
+        """Count a request whose connection was closed before it was
+        finished."""
+        self.in_flight -= 1
+
+    def __call__(self):
+        status = dict((method, dict(('%dxx' % (i + 1), count)
+                                    for (i, count) in enumerate(counts)
+                                    if count))
+                      for (method, counts) in self.status.items())
+        return {'in_flight': self.in_flight,
+                'request_bytes': self.request_bytes,
+                'response_bytes': self.response_bytes,
+                'status': status, 'latency': dict(self.latency)}
+
+
+def route_stats_path(route):
+    """Return the stats path of a handler added to the environment with the
+    URL pattern `route`."""
+    return route.lstrip('^').rstrip('$').strip('/')
+
+
+def _handler_stats_path(handler):
+    """Return the stats path of a request handler. Handlers that have not
+    been added to the environment use the request path."""
+    path = handler.environment.get_stats_path(handler.__class__)
+    if path is None:
+        path = handler.request.path
+    return path
+
+
+def _object_stats_path(obj):
+    return '/'.join(['_internal', obj.__module__, obj.__class__.__name__])
+
+
+def latency_histogram(path, name):
+    """Return the :class:`LatencyHistogram` called `name` in the
+    **latency** stats of `path`."""
+    container = stats_container(path)
+    histograms = container.get('latency', None)
+    if histograms is None:
+        histograms = container['latency'] = {}
+    histogram = histograms.get(name, None)
+    if histogram is None:
+        histogram = histograms[name] = LatencyHistogram()
+    return histogram
+
+
+def stats_meter(path, name):
+    """Return the `greplin.scales` meter called `name` in the stats of
+    `path`."""
+    container = stats_container(path)
+    stats_meter = container.get(name, None)
+    if stats_meter is None:
+        stats_meter = container[name] = MeterStatDict()
+    return stats_meter
+
+
+class _SnapshotEncoder(scales.StatContainerEncoder):
+    """Encode the latency histograms including their buckets, so that they
+    can be merged."""
+
+    def default(self, obj):
+        if isinstance(obj, LatencyHistogram):
+            return obj.snapshot()
+        return super(_SnapshotEncoder, self).default(obj)
+
+
+def get_stats():
+    """Return a JSON compatible copy of all `greplin.scales` stats of this
+    process.
+
+    Latency histograms are returned as :func:`LatencyHistogram.snapshot`,
+    use :func:`summarize_stats` before returning them to clients."""
+    return json.loads(json.dumps(scales.getStats(), cls=_SnapshotEncoder))
+
+
+def export_stats(filename):
+    """Write a snapshot of the stats of this process to `filename`.
+
+    The file is replaced atomically, so readers never see a partial
+    snapshot."""
+    snapshot = {'pid': os.getpid(), 'time': time.time(),
+                'stats': get_stats()}
+    tmp = '%s.%s.tmp' % (filename, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(snapshot, f)
+    os.rename(tmp, filename)
+
+
+def read_stats_snapshots(dirname, exclude_pid=None):
+    """Read the stats snapshots written by :func:`export_stats` to
+    `dirname`, except the one of the process `exclude_pid`."""
+    snapshots = []
+    try:
+        names = sorted(os.listdir(dirname))
+    except OSError:
+        return snapshots
+    for name in names:
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(dirname, name)) as f:
+                snapshot = json.load(f)
+        except (IOError, OSError, ValueError):
+            continue
+        if snapshot.get('pid') != exclude_pid:
+            snapshots.append(snapshot['stats'])
+    return snapshots
+
+
+def aggregated_stats(stats_dir):
+    """Return the merged stats of this process and the snapshots of the
+    other workers in `stats_dir`."""
+    trees = read_stats_snapshots(stats_dir, exclude_pid=os.getpid())
+    trees.insert(0, get_stats())
+    return merge_stats(trees)
+
+
+def _is_percentile(key):
+    return key == 'median' or key.endswith('percentile')
+
+
+def _pooled_stddev(pairs):
+    """Return the standard deviation of the values of all processes from
+    the `stddev`, `mean` and `count` of each process."""
+    stats = [(t.get('count', 0), t.get('mean', None), v) for (t, v) in pairs]
+    if any(mean is None for (_, mean, _) in stats):
+        return None
+    total = sum(count for (count, _, _) in stats)
+    if not total:
+        return None
+    mean = sum(count * m for (count, m, _) in stats) / total
+    square = sum(count * (stddev * stddev + m * m)
+                 for (count, m, stddev) in stats) / total
+    return math.sqrt(max(0.0, square - mean * mean))
+
+
+def is_histogram_snapshot(value):
+    return isinstance(value, dict) and 'histogram' in value
+
+
+def merge_stats(trees):
+    """Merge the stats `trees` of several processes.
+
+    Latency histogram snapshots are merged exactly. Counters and rates are
+    summed up, `min` and `max` values (including limits like `maxsize`) keep
+    the extreme values, means are averaged weighted by the `count` of each
+    process and standard deviations are pooled. Percentiles (and medians)
+    other than those of the latency histograms cannot be computed from the
+    percentiles of each process and are left out, use the `latency`
+    decorator for percentiles across all workers. Other values are taken
+    from the first tree.
+    """
+    result = {}
+    for tree in trees:
+        for key in tree:
+            if key in result:
+                continue
+            pairs = [(t, t[key]) for t in trees if key in t]
+            first = pairs[0][1]
+            if is_histogram_snapshot(first):
+                histogram = LatencyHistogram.from_snapshot(first)
+                for (_, value) in pairs[1:]:
+                    if is_histogram_snapshot(value):
+                        histogram.merge(value)
+                result[key] = histogram.snapshot()
+            elif isinstance(first, dict):
+                result[key] = merge_stats([v for (_, v) in pairs
+                                           if isinstance(v, dict)])
+            elif (isinstance(first, numbers.Number) and
+                    not isinstance(first, bool)):
+                values = [v for (_, v) in pairs
+                          if isinstance(v, numbers.Number)]
+                if _is_percentile(key):
+                    continue
+                elif key.startswith('min'):
+                    result[key] = min(values)
+                elif key.startswith('max'):
+                    result[key] = max(values)
+                elif key == 'stddev':
+                    stddev = _pooled_stddev(pairs)
+                    if stddev is not None:
+                        result[key] = stddev
+                elif key == 'mean':
+                    weights = [t.get('count', 1) for (t, _) in pairs]
+                    total = sum(weights)
+                    if total:
+                        result[key] = sum(w * v for (w, v)
+                                          in zip(weights, values)) / total
+                    else:
+                        result[key] = sum(values) / len(values)
+                else:
+                    result[key] = sum(values)
+            else:
+                result[key] = first
+    return result
+
+
+def summarize_stats(tree):
+    """Replace the latency histogram snapshots in the result of
+    :func:`get_stats` or :func:`merge_stats` with their summary."""
+    if is_histogram_snapshot(tree):
+        return LatencyHistogram.from_snapshot(tree).summary()
+    if isinstance(tree, dict):
+        return dict((key, summarize_stats(value))
+                    for (key, value) in tree.items())
+    return tree
+
+
+def restart_meter_ticker():
+    """Restart the thread updating the `greplin.scales` meters.
+
+    Threads do not survive :func:`os.fork()`, so this has to be called in
+    forked worker processes."""
+    meter.TICKER_THREAD = RepeatTimer(5, lambda: [t() for t in
+                                                  meter.TICKERS])
+
+
 def latency(fn):
     """Measure execution latency of a certain request method.
 
@@ -40,42 +347,40 @@ def latency(fn):
         def get(self, *args, **kwargs):
             ...
 
-    The latency is recorded along the request path, i.e. if the request handler
-    is defined like this::
+    The latency is recorded along the route of the handler, i.e. if the
+    request handler is defined like this::
 
         env.add_handler('/test/this', LatencyExample)
 
     the latency of GET/POST/PUT etc methods are stored with the path. In order
     to access the stats you may call **/_system/stats/test/this** or
-    **/_system/stats/test**, e.g.
+    **/_system/stats/test**, e.g. If the handler has been added with a `name`,
+    the name is used instead of the route. Routes with parameters like
+    `/users/(\\d+)` are recorded once for all matching requests.
+
+    The latencies are recorded in a :class:`LatencyHistogram` reporting the
+    `count`, `min`, `max`, `mean` and the `p50`, `p90`, `p99` and `p999`
+    percentiles in seconds. For request handlers the latency is measured
+    until the request is finished.
     """
 
     @wraps(fn)
     def wrapper(self, *args, **kwargs):
 
-        if not hasattr(self.__class__, '_stats_latency'):
-            self.__class__._stats_latency = scales.NamedPmfDictStat('latency')
-
         if isinstance(self, RequestHandler):
-            original_on_finish = self.on_finish
-
-            def latency_on_finish(*args, **kwargs):
-                latency = time.time() - start
-                self._stats_latency[fn.__name__].addValue(latency)
-                original_on_finish(*args, **kwargs)
-
-            self.on_finish = latency_on_finish
-
-            scales.init(self, self.request.path)
-            start = time.time()
+            histogram = latency_histogram(_handler_stats_path(self),
+                                          fn.__name__)
+            if self._latency_timers is None:
+                self._latency_timers = []
+            self._latency_timers.append((histogram, time.time()))
             return fn(self, *args, **kwargs)
         else:
+            histogram = latency_histogram(_object_stats_path(self),
+                                          fn.__name__)
+
             def done_callback(*args, **kwargs):
-                latency = time.time() - start
-                self._stats_latency[fn.__name__].addValue(latency)
+                histogram.record(time.time() - start)
 
-            scales.init(self, '/'.join(['_internal', self.__module__,
-                                        self.__class__.__name__]))
             start = time.time()
             result = fn(self, *args, **kwargs)
             if isinstance(result, Future):
@@ -99,24 +404,18 @@ def metered(fn):
             ...
 
     As with the :func:`latency` stats, the :func:`metered` stats are recorded
-    along the request path, i.e. you can get the stats values using the
-    **/_system/stats/** route.
+    along the route of the handler, i.e. you can get the stats values using
+    the **/_system/stats/** route.
     """
 
     @wraps(fn)
     def wrapper(self, *args, **kwargs):
 
-        attr_name = '_stats_metered_%s' % fn.__name__
-
-        if not hasattr(self.__class__, '_stats_metered'):
-            setattr(self.__class__, attr_name, MeterStat(fn.__name__))
-
         if isinstance(self, RequestHandler):
-            scales.init(self, self.request.path)
+            path = _handler_stats_path(self)
         else:
-            scales.init(self, '/'.join(['_internal', self.__module__,
-                                        self.__class__.__name__]))
-        getattr(self, attr_name).mark()
+            path = _object_stats_path(self)
+        stats_meter(path, fn.__name__).mark()
 
         return fn(self, *args, **kwargs)
 
@@ -4,7 +4,9 @@
 #
 from unittest import TestCase
 
-from supercell.acceptparsing import parse_accept_header
+from supercell.acceptparsing import (parse_accept_header,
+                                     cached_parse_accept_header,
+                                     accept_cache_stats)
 
 
 class TestParseAcceptHeader(TestCase):
@@ -53,3 +55,30 @@ class TestParseAcceptHeader(TestCase):
         accept = 'text/*,image/*;application/*;*/*;'
         should = [('', {}, 1.0)]
         self.assertEquals(parse_accept_header(accept), should)
+
+
+class TestCachedParseAcceptHeader(TestCase):
+
+    def test_cached_result_equals_uncached(self):
+        accept = ("text/html,application/xhtml+xml,application/xml;" +
+                  "q=0.9,*/*;q=0.8,application/vnd.ficture.lightt-v1.1+json")
+        self.assertEqual(tuple(parse_accept_header(accept)),
+                         cached_parse_accept_header(accept))
+
+    def test_cached_result_is_shared(self):
+        accept = "application/vnd.supercell.cached-v1.0+json"
+        before = accept_cache_stats()
+        first = cached_parse_accept_header(accept)
+        second = cached_parse_accept_header(accept)
+        after = accept_cache_stats()
+
+        self.assertIs(first, second)
+        self.assertEqual(before['misses'] + 1, after['misses'])
+        self.assertEqual(before['hits'] + 1, after['hits'])
+
+    def test_cached_params_are_immutable(self):
+        (_, params, _) = cached_parse_accept_header(
+            "application/vnd.supercell.frozen+json")[0]
+        self.assertEqual('supercell.frozen', params.get('vendor'))
+        with self.assertRaises(TypeError):
+            params['vendor'] = 'other'
@@ -17,6 +17,11 @@
 #
 from datetime import datetime, timedelta
 import json
+import sys
+if sys.version_info > (2, 7):
+    from unittest import TestCase
+else:
+    from unittest2 import TestCase
 
 from schematics.models import Model
 from schematics.types import StringType
@@ -27,6 +32,9 @@ from tornado.testing import AsyncHTTPTestCase
 
 import supercell.api as s
 from supercell.api import (RequestHandler, provides, CacheConfig)
+from supercell.cache import (ResponseCache, compute_cache_header,
+                             compute_etag, compute_expires_header,
+                             compute_version_etag)
 from supercell.environment import Environment
 
 
@@ -151,3 +159,235 @@ class TestCacheDecorator(AsyncHTTPTestCase):
         self.assertEqual('{"doc_id": "test123", "message": "A test"}',
                          json.dumps(json.loads(response.body.decode('utf8')),
                                     sort_keys=True))
+
+
+@provides(s.MediaType.ApplicationJson, default=True)
+@provides(s.MediaType.ApplicationNdJson)
+class ServerCachedHandler(RequestHandler):
+
+    calls = 0
+
+    @s.async
+    def get(self, *args, **kwargs):
+        ServerCachedHandler.calls += 1
+        self.set_header('X-Calls', ServerCachedHandler.calls)
+        raise s.Return(SimpleMessage({"doc_id": 'test123',
+                                      "message": self.get_argument('m', '')}))
+
+
+class NoStoreHandler(ServerCachedHandler):
+    pass
+
+
+class Deny(s.Middleware):
+
+    def before(self, handler, args, kwargs):
+        handler.send_error(403)
+
+    def after(self, handler, args, kwargs, result):
+        pass
+
+
+@provides(s.MediaType.ApplicationJson, default=True)
+class MiddlewareHandler(RequestHandler):
+
+    @Deny()
+    @s.async
+    def get(self, *args, **kwargs):
+        raise s.Return(SimpleMessage({"doc_id": 'test123',
+                                      "message": 'secret'}))
+
+
+class TestResponseCache(AsyncHTTPTestCase):
+
+    def get_new_ioloop(self):
+        return IOLoop.instance()
+
+    def get_app(self):
+        ServerCachedHandler.calls = 0
+        self.env = env = Environment()
+        env.add_handler(r'/cached', ServerCachedHandler,
+                        cache=CacheConfig(timedelta(minutes=10),
+                                          server_cache=True))
+        env.add_handler(r'/nostore', NoStoreHandler,
+                        cache=CacheConfig(timedelta(minutes=10),
+                                          no_store=True, server_cache=True))
+        return env.get_application()
+
+    def test_second_request_is_cached(self):
+        response = self.fetch('/cached?m=hello')
+        self.assertEqual(200, response.code)
+        cached = self.fetch('/cached?m=hello')
+        self.assertEqual(200, cached.code)
+
+        self.assertEqual(1, ServerCachedHandler.calls)
+        self.assertEqual(response.body, cached.body)
+        self.assertEqual('1', cached.headers['X-Calls'])
+        self.assertEqual(response.headers['Content-Type'],
+                         cached.headers['Content-Type'])
+        self.assertEqual('max-age=600, must-revalidate',
+                         cached.headers['Cache-Control'])
+        self.assertEqual(1, self.env.response_cache.hits)
+
+    def test_cache_key(self):
+        self.fetch('/cached?m=a')
+        self.fetch('/cached?m=b')
+        ndjson = self.fetch('/cached?m=a', headers={
+            'Accept': s.MediaType.ApplicationNdJson})
+        self.assertEqual(3, ServerCachedHandler.calls)
+        self.assertEqual(s.MediaType.ApplicationNdJson,
+                         ndjson.headers['Content-Type'])
+
+    def test_no_store(self):
+        self.fetch('/nostore')
+        self.fetch('/nostore')
+        self.assertEqual(2, ServerCachedHandler.calls)
+
+    def test_stats(self):
+        self.fetch('/cached')
+        self.fetch('/cached')
+        response = self.fetch('/_system/stats/_internal/response_cache')
+        result = json.loads(response.body.decode('utf8'))
+        self.assertEqual(1, result['hits'])
+        self.assertEqual(1, result['misses'])
+
+    def test_no_server_cache_with_middlewares(self):
+        env = Environment()
+        env.add_handler(r'/uncached', MiddlewareHandler,
+                        cache=CacheConfig(timedelta(minutes=10)))
+        self.assertRaises(ValueError, env.add_handler, r'/cached',
+                          MiddlewareHandler,
+                          cache=CacheConfig(timedelta(minutes=10),
+                                            server_cache=True))
+
+
+@provides(s.MediaType.ApplicationJson, default=True)
+class EtagHandler(RequestHandler):
+
+    calls = 0
+
+    @s.async
+    def get(self, *args, **kwargs):
+        EtagHandler.calls += 1
+        raise s.Return(SimpleMessage({"doc_id": 'test123',
+                                      "message": 'A test'}))
+
+
+class VersionedHandler(EtagHandler):
+
+    version = 1
+
+    @s.async
+    def etag_version(self, *args, **kwargs):
+        raise s.Return(VersionedHandler.version)
+
+
+class FailingVersionedHandler(VersionedHandler):
+
+    @s.async
+    def get(self, *args, **kwargs):
+        raise s.Error(503)
+
+
+class TestEtag(AsyncHTTPTestCase):
+
+    def get_new_ioloop(self):
+        return IOLoop.instance()
+
+    def get_app(self):
+        EtagHandler.calls = 0
+        VersionedHandler.version = 1
+        env = Environment()
+        env.add_handler(r'/etag', EtagHandler,
+                        cache=CacheConfig(timedelta(minutes=1), etag=True))
+        env.add_handler(r'/versioned', VersionedHandler,
+                        cache=CacheConfig(timedelta(minutes=1), etag=True))
+        env.add_handler(r'/failing', FailingVersionedHandler,
+                        cache=CacheConfig(timedelta(minutes=1), etag=True))
+        return env.get_application()
+
+    def test_no_version_etag_for_errors(self):
+        response = self.fetch('/failing')
+        self.assertEqual(503, response.code)
+        self.assertNotIn('Etag', response.headers)
+
+    def test_body_etag(self):
+        response = self.fetch('/etag')
+        self.assertEqual(200, response.code)
+        etag = response.headers['Etag']
+        self.assertEqual(compute_etag([response.body]), etag)
+
+        response = self.fetch('/etag', headers={'If-None-Match': etag})
+        self.assertEqual(304, response.code)
+        self.assertEqual(b'', response.body)
+        self.assertEqual(2, EtagHandler.calls)
+
+    def test_version_etag(self):
+        response = self.fetch('/versioned')
+        self.assertEqual(200, response.code)
+        etag = response.headers['Etag']
+        self.assertEqual(
+            compute_version_etag(1, s.MediaType.ApplicationJson), etag)
+
+        response = self.fetch('/versioned', headers={'If-None-Match': etag})
+        self.assertEqual(304, response.code)
+        self.assertEqual(etag, response.headers['Etag'])
+        self.assertEqual(1, EtagHandler.calls)
+
+        VersionedHandler.version = 2
+        response = self.fetch('/versioned', headers={'If-None-Match': etag})
+        self.assertEqual(200, response.code)
+        self.assertNotEqual(etag, response.headers['Etag'])
+        self.assertEqual(2, EtagHandler.calls)
+
+
+class TestResponseCacheEviction(TestCase):
+
+    def test_size_bounded_lru(self):
+        cache = ResponseCache(max_size=10)
+        cache.set('a', [], b'12345', 60)
+        cache.set('b', [], b'12345', 60)
+        self.assertIsNotNone(cache.get('a'))
+        cache.set('c', [], b'12345', 60)
+
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertEqual(1, cache.evictions)
+        self.assertEqual(10, cache.size)
+
+    def test_expiry(self):
+        cache = ResponseCache()
+        cache.set('a', [], b'12345', -1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(0, cache.size)
+
+    def test_too_large(self):
+        cache = ResponseCache(max_size=4)
+        cache.set('a', [], b'12345', 60)
+        self.assertEqual(0, len(cache))
+
+
+class TestCacheHeaders(TestCase):
+
+    def test_long_max_age(self):
+        config = CacheConfig(timedelta(days=2), s_max_age=timedelta(days=1))
+        self.assertEqual('max-age=172800, s-max-age=86400, must-revalidate',
+                         compute_cache_header(config))
+
+    def test_expires_header(self):
+        header = compute_expires_header(3600)
+        self.assertIs(header, compute_expires_header(3600))
+        ts = datetime.strptime(header, '%a, %d %b %Y %H:%M:%S %Z')
+        self.assertTrue(ts > datetime.utcnow() + timedelta(minutes=59))
+        self.assertTrue(ts < datetime.utcnow() + timedelta(minutes=61))
+
+    def test_precomputed_in_environment(self):
+        env = Environment()
+        env.add_handler('/', MyHandler,
+                        cache=CacheConfig(timedelta(minutes=10)),
+                        expires=timedelta(minutes=15))
+        self.assertEqual('max-age=600, must-revalidate',
+                         env.get_cache_header(MyHandler))
+        self.assertIsNotNone(env.get_expires_header(MyHandler))
+        self.assertIsNone(env.get_expires_header(MyPrivateCaching))
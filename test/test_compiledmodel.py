@@ -0,0 +1,160 @@
+# vim: set fileencoding=utf-8 :
+#
+# Copyright (c) 2013 Daniel Truemper <truemped at googlemail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+
+import copy
+import sys
+if sys.version_info > (2, 7):
+    from unittest import TestCase
+else:
+    from unittest2 import TestCase
+
+from schematics.models import Model
+from schematics.types import (BooleanType, DateTimeType, FloatType, IntType,
+                              StringType)
+from schematics.types.compound import DictType, ListType, ModelType
+
+from supercell.compiledmodel import (compile_model, CompiledModel,
+                                     SchematicsModel)
+
+
+class Tag(Model):
+    name = StringType(required=True, max_length=5)
+    weight = FloatType(default=1.0)
+
+
+class Author(Model):
+    name = StringType(required=True)
+    email = StringType(serialized_name='mail')
+    age = IntType(min_value=0)
+    nick = StringType(serialize_when_none=False)
+
+
+class Document(Model):
+    doc_id = StringType(required=True, deserialize_from=['id', 'docId'])
+    title = StringType(choices=['a', 'b'])
+    count = IntType(default=3)
+    flag = BooleanType()
+    author = ModelType(Author)
+    tags = ListType(ModelType(Tag), min_size=1)
+    labels = ListType(StringType())
+    scores = DictType(IntType)
+    created = DateTimeType()
+    main_tag = ModelType(Tag, required=True)
+
+
+class Quiet(Model):
+
+    class Options:
+        serialize_when_none = False
+
+    a = StringType()
+    b = ModelType(Tag)
+    c = ListType(ModelType(Tag))
+
+
+class Validated(Model):
+    a = StringType()
+
+    def validate_a(self, data, value):
+        return value
+
+
+INPUTS = [
+    {}, None, [], 'x',
+    {'doc_id': 'x'},
+    {'id': 'x', 'docId': 'y', 'doc_id': 'z'},
+    {'id': 'x', 'rogue': 1},
+    {'doc_id': 'x', 'title': 'c', 'count': 'abc'},
+    {'doc_id': 'x', 'count': '5', 'flag': 'true',
+     'author': {'name': 'n', 'mail': 'm', 'age': -1}},
+    {'doc_id': 'x', 'author': {'name': 'n', 'rogue': 1}},
+    {'doc_id': 'x', 'author': 'bad'},
+    {'doc_id': 'x',
+     'tags': [{'name': 'longname'}, {'weight': 2}, {'name': 'ok'}]},
+    {'doc_id': 'x', 'tags': []},
+    {'doc_id': 'x', 'tags': [], 'main_tag': {'name': 'a'}},
+    {'doc_id': 'x', 'tags': [{}], 'main_tag': {'name': 'a'}},
+    {'doc_id': 'x', 'tags': None, 'labels': 'single', 'scores': {'a': '1'}},
+    {'doc_id': 'x', 'tags': [None]},
+    {'doc_id': 'x', 'created': '2015-01-01T00:00:00',
+     'main_tag': {'name': 'a'}},
+    {'doc_id': 'x', 'created': 'nope', 'main_tag': {}},
+    {'doc_id': 'x', 'main_tag': {'name': 'a'}, 'tags': [{'name': 'a'}],
+     'author': {}},
+    {'a': None, 'b': {}, 'c': []},
+    {'b': {'name': 'x'}, 'c': [{'name': 'y'}]},
+]
+
+
+def _result(fn):
+    try:
+        return ('ok', fn())
+    except Exception as e:
+        return (type(e).__name__, getattr(e, 'messages', str(e)))
+
+
+def _dump(value):
+    if isinstance(value, Model):
+        return (type(value).__name__, _dump(value._initial),
+                _dump(value._data))
+    if isinstance(value, list):
+        return [_dump(item) for item in value]
+    if isinstance(value, dict):
+        return dict((k, _dump(v)) for (k, v) in value.items())
+    return value
+
+
+class TestCompiledModel(TestCase):
+
+    def assertSameResult(self, expected, result, msg):
+        self.assertEqual((expected[0], _dump(expected[1])),
+                         (result[0], _dump(result[1])), msg)
+
+    def test_same_as_schematics(self):
+        for model_class in (Document, Author, Tag, Quiet):
+            compiled = compile_model(model_class)
+            self.assertIsInstance(compiled, CompiledModel)
+
+            for raw in INPUTS:
+                msg = '%s(%r)' % (model_class.__name__, raw)
+                expected = _result(lambda: model_class(copy.deepcopy(raw)))
+                result = _result(lambda: compiled.convert(copy.deepcopy(raw)))
+                self.assertSameResult(expected, result, msg)
+                if expected[0] != 'ok':
+                    continue
+
+                (expected_model, model) = (expected[1], result[1])
+                self.assertSameResult(
+                    _result(lambda: expected_model.validate()),
+                    _result(lambda: compiled.validate(model)), msg)
+                self.assertEqual(_dump(expected_model), _dump(model), msg)
+                self.assertSameResult(
+                    _result(lambda: expected_model.to_primitive()),
+                    _result(lambda: compiled.to_primitive(model)), msg)
+
+    def test_compile_once(self):
+        self.assertIs(compile_model(Document), compile_model(Document))
+
+    def test_fallback(self):
+        compiled = compile_model(Validated)
+        self.assertIsInstance(compiled, SchematicsModel)
+        model = compiled.convert({'a': 'b'})
+        compiled.validate(model)
+        self.assertEqual({'a': 'b'}, compiled.to_primitive(model))
@@ -0,0 +1,194 @@
+# vim: set fileencoding=utf-8 :
+#
+# Copyright (c) 2013 Daniel Truemper <truemped at googlemail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+
+from datetime import timedelta
+import json
+import sys
+import zlib
+if sys.version_info > (2, 7):
+    from unittest import TestCase
+else:
+    from unittest2 import TestCase
+
+from schematics.models import Model
+from schematics.types import StringType
+
+import mock
+from tornado.ioloop import IOLoop
+from tornado.testing import AsyncHTTPTestCase
+
+import supercell.api as s
+from supercell.compression import compressible, negotiate_encoding
+import supercell.compression
+from supercell.environment import Environment
+
+
+class Message(Model):
+    message = StringType()
+
+
+@s.provides(s.MediaType.ApplicationJson, default=True)
+class MessageHandler(s.RequestHandler):
+
+    @s.async
+    def get(self):
+        size = int(self.get_argument('size'))
+        raise s.Return(Message({'message': 'x' * size}))
+
+
+class CachedMessageHandler(MessageHandler):
+    pass
+
+
+class VersionedMessageHandler(MessageHandler):
+
+    def etag_version(self, *args, **kwargs):
+        return 1
+
+
+def gunzip(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+class TestCompression(AsyncHTTPTestCase):
+
+    def get_new_ioloop(self):
+        return IOLoop.instance()
+
+    def get_app(self):
+        self.env = env = Environment()
+        env.compression = True
+        env.compression_min_size = 100
+        env.compression_offload_size = 10000
+        env.add_handler('/message', MessageHandler)
+        env.add_handler('/cached', CachedMessageHandler,
+                        cache=s.CacheConfig(timedelta(minutes=1),
+                                            server_cache=True))
+        env.add_handler('/versioned', VersionedMessageHandler,
+                        cache=s.CacheConfig(timedelta(minutes=1), etag=True))
+        return env.get_application()
+
+    def tearDown(self):
+        self.env.shutdown_executors()
+        super(TestCompression, self).tearDown()
+
+    def fetch_encoded(self, path, accept_encoding='gzip'):
+        return self.fetch(path, decompress_response=False,
+                          headers={'Accept-Encoding': accept_encoding})
+
+    def test_compress_large_responses(self):
+        response = self.fetch_encoded('/message?size=1000')
+        self.assertEqual(200, response.code)
+        self.assertEqual('gzip', response.headers['Content-Encoding'])
+        self.assertEqual('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual('x' * 1000, json.loads(
+            gunzip(response.body).decode('utf8'))['message'])
+        self.assertEqual(len(response.body),
+                         int(response.headers['Content-Length']))
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.fetch_encoded('/message?size=10')
+        self.assertEqual(200, response.code)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertNotIn('Vary', response.headers)
+
+    def test_not_accepted(self):
+        response = self.fetch_encoded('/message?size=1000', 'identity')
+        self.assertEqual(200, response.code)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(1000, len(json.loads(
+            response.body.decode('utf8'))['message']))
+
+    def test_compress_in_executor(self):
+        response = self.fetch_encoded('/message?size=20000')
+        self.assertEqual(200, response.code)
+        self.assertEqual('gzip', response.headers['Content-Encoding'])
+        self.assertEqual(20000, len(json.loads(
+            gunzip(response.body).decode('utf8'))['message']))
+        self.assertEqual(1, self.env.get_executor().completed)
+
+    def test_version_etag_per_content_coding(self):
+        gzipped = self.fetch_encoded('/versioned?size=1000')
+        self.assertEqual('gzip', gzipped.headers['Content-Encoding'])
+        identity = self.fetch_encoded('/versioned?size=1000', 'identity')
+        self.assertNotIn('Content-Encoding', identity.headers)
+        self.assertNotEqual(gzipped.headers['Etag'], identity.headers['Etag'])
+
+        response = self.fetch('/versioned?size=1000',
+                              decompress_response=False,
+                              headers={'Accept-Encoding': 'gzip',
+                                       'If-None-Match':
+                                       gzipped.headers['Etag']})
+        self.assertEqual(304, response.code)
+        self.assertEqual(['Accept-Encoding'],
+                         response.headers.get_list('Vary'))
+
+        response = self.fetch('/versioned?size=1000',
+                              decompress_response=False,
+                              headers={'Accept-Encoding': 'identity',
+                                       'If-None-Match':
+                                       gzipped.headers['Etag']})
+        self.assertEqual(200, response.code)
+
+    def test_cached_variants(self):
+        cache = self.env.response_cache
+        for _ in range(2):
+            response = self.fetch_encoded('/cached?size=1000')
+            self.assertEqual('gzip', response.headers['Content-Encoding'])
+            self.assertEqual(1000, len(json.loads(
+                gunzip(response.body).decode('utf8'))['message']))
+        self.assertEqual(1, cache.hits)
+
+        response = self.fetch_encoded('/cached?size=1000', 'identity')
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(1000, len(json.loads(
+            response.body.decode('utf8'))['message']))
+        self.assertEqual(2, len(cache))
+
+        response = self.fetch_encoded('/cached?size=1000', 'identity')
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(['Accept-Encoding'],
+                         response.headers.get_list('Vary'))
+        self.assertEqual(2, cache.hits)
+
+
+class TestNegotiateEncoding(TestCase):
+
+    def test_negotiate_encoding(self):
+        self.assertEqual('gzip', negotiate_encoding('gzip, deflate'))
+        self.assertEqual('gzip', negotiate_encoding('*'))
+        self.assertEqual(None, negotiate_encoding('gzip;q=0'))
+        self.assertEqual(None, negotiate_encoding('identity'))
+        self.assertEqual(None, negotiate_encoding(''))
+
+    def test_prefer_brotli(self):
+        with mock.patch.object(supercell.compression, 'ENCODINGS',
+                               ('br', 'gzip')):
+            self.assertEqual('br', supercell.compression
+                             ._parse_accept_encoding('gzip, br'))
+            self.assertEqual('gzip', supercell.compression
+                             ._parse_accept_encoding('gzip, br;q=0.5'))
+
+    def test_compressible(self):
+        self.assertTrue(compressible('application/json; charset=UTF-8'))
+        self.assertTrue(compressible('text/html'))
+        self.assertTrue(compressible('application/vnd.api+json'))
+        self.assertFalse(compressible('image/png'))
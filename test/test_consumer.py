@@ -24,10 +24,14 @@ if sys.version_info > (2, 7):
 else:
     from unittest2 import TestCase
 
+from schematics.models import Model
+from schematics.types import BaseType
+
 from supercell.api import consumes, RequestHandler
 from supercell.mediatypes import ContentType, MediaType
 from supercell.consumer import (ConsumerBase, JsonConsumer,
-                                         NoConsumerFound)
+                                NoConsumerFound, JsonArrayParser,
+                                NdJsonParser, LazyModel, resolve_model)
 
 
 class MoreDetailedJsonConsumer(JsonConsumer):
@@ -101,3 +105,94 @@ class TestBasicConsumer(TestCase):
         with self.assertRaises(NoConsumerFound):
             ConsumerBase.map_consumer(MediaType.ApplicationJson,
                                       handler=MyHandler)
+
+
+class Doc(Model):
+    a = BaseType()
+
+
+def _values(models):
+    return [m.a for m in models]
+
+
+class TestStreamParsers(TestCase):
+
+    def test_json_array_parser_byte_by_byte(self):
+        body = u'[ {"a": 1}, {"a": "é"} ,{"a": [1, {"b": "]"}]}\n]'
+        parser = JsonArrayParser(Doc)
+        models = []
+        for b in bytearray(body.encode('utf8')):
+            models.extend(parser.feed(bytes(bytearray([b]))))
+        models.extend(parser.close())
+        self.assertEqual([1, u'é', [1, {'b': ']'}]], _values(models))
+
+    def test_json_array_parser_empty_array(self):
+        parser = JsonArrayParser(Doc)
+        self.assertEqual([], parser.feed(b' [ '))
+        self.assertEqual([], parser.feed(b']'))
+        self.assertEqual([], parser.close())
+
+    def test_json_array_parser_errors(self):
+        with self.assertRaises(ValueError):
+            JsonArrayParser(Doc).feed(b'{"a": 1}')
+
+        with self.assertRaises(ValueError):
+            JsonArrayParser(Doc).feed(b'[{"a": 1} {"a": 2}]')
+
+        parser = JsonArrayParser(Doc)
+        parser.feed(b'[{"a": 1}, {"a"')
+        with self.assertRaises(ValueError):
+            parser.close()
+
+    def test_json_array_parser_invalid_item_in_stream(self):
+        parser = JsonArrayParser(Doc)
+        self.assertEqual([1], _values(parser.feed(b'[{"a": 1}, {"a": tru')))
+        with self.assertRaises(ValueError):
+            parser.feed(b'x}, {"a": 3}')
+
+    def test_json_array_parser_strings(self):
+        body = u'[{"a": "\\"}]{["}, {"a": "\\\\"}, {"a": 2}]'
+        parser = JsonArrayParser(Doc)
+        models = []
+        for b in bytearray(body.encode('utf8')):
+            models.extend(parser.feed(bytes(bytearray([b]))))
+        models.extend(parser.close())
+        self.assertEqual([u'"}]{[', u'\\', 2], _values(models))
+
+    def test_ndjson_parser(self):
+        parser = NdJsonParser(Doc)
+        self.assertEqual([], parser.feed(b'{"a": '))
+        self.assertEqual([1, 2], _values(parser.feed(b'1}\n\n{"a": 2}\n{"a"')))
+        self.assertEqual([], parser.feed(b': 3}'))
+        self.assertEqual([3], _values(parser.close()))
+
+    def test_ndjson_parser_long_line_in_small_chunks(self):
+        parser = NdJsonParser(Doc)
+        line = b'{"a":' + b' ' * 10000 + b'1}\n{"a": 2}'
+        models = []
+        for i in range(len(line)):
+            models.extend(parser.feed(line[i:i + 1]))
+        self.assertEqual([1], _values(models))
+        self.assertEqual([2], _values(parser.close()))
+        self.assertEqual([], parser.close())
+
+    def test_lazy_model(self):
+        calls = []
+
+        def consume():
+            calls.append(1)
+            return Doc({'a': 1})
+
+        model = LazyModel(Doc, consume)
+        self.assertEqual([], calls)
+        self.assertTrue(isinstance(model, Doc))
+        self.assertIs(Doc, model.__class__)
+        self.assertEqual([], calls)
+
+        self.assertEqual(1, model.a)
+        model.a = 2
+        self.assertEqual(2, model['a'])
+        self.assertEqual([1], calls)
+        self.assertIsInstance(resolve_model(model), Doc)
+        self.assertEqual(Doc({'a': 2}), model)
+        self.assertEqual([1], calls)
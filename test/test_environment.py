@@ -26,7 +26,7 @@ else:
 
 from tornado.web import Application, RequestHandler
 
-from supercell.environment import Environment
+from supercell.environment import CONFIG_ATTRIBUTES, Environment
 
 
 class EnvironmentTest(TestCase):
@@ -86,3 +86,32 @@ class EnvironmentTest(TestCase):
 
         with self.assertRaises(AssertionError):
             env.add_managed_object('another_managed', object())
+
+    def test_configure(self):
+
+        class Config(object):
+            pass
+
+        config = Config()
+        for (option, _) in CONFIG_ATTRIBUTES:
+            setattr(config, option, None)
+        config.compression = True
+        config.gzip_level = 9
+        config.request_metrics = True
+        config.executor_workers = 2
+        config.offload_serialization_size = 4096
+        config.response_validation = 'debug'
+        config.phase_timing = False
+        config.server_timing = True
+        config.response_cache_size = 1024
+
+        env = Environment()
+        env.configure(config)
+        self.assertTrue(env.compression)
+        self.assertEqual(9, env.gzip_level)
+        self.assertTrue(env.collect_request_metrics)
+        self.assertEqual(2, env.executor_workers)
+        self.assertEqual(4096, env.offload_serialization_size)
+        self.assertEqual((0.0, 1.0), env.validation_policy)
+        self.assertTrue(env.phase_timing)
+        self.assertEqual(1024, env.response_cache.max_size)
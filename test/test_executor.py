@@ -0,0 +1,165 @@
+# vim: set fileencoding=utf-8 :
+#
+# Copyright (c) 2013 Daniel Truemper <truemped at googlemail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import threading
+
+from schematics.models import Model
+from schematics.types import IntType, StringType
+
+from tornado.ioloop import IOLoop
+from tornado.testing import AsyncHTTPTestCase, gen_test
+
+import supercell.api as s
+from supercell.environment import Environment
+
+
+class ThreadMessage(Model):
+    thread = StringType()
+
+
+def square(value):
+    return value * value
+
+
+@s.provides(s.MediaType.ApplicationJson, default=True)
+class ExecutorHandler(s.RequestHandler):
+
+    @s.run_in_executor
+    def _thread_name(self):
+        return threading.current_thread().name
+
+    @s.run_in_executor(executor='custom')
+    def _fail(self):
+        raise ValueError('failed')
+
+    @s.async
+    def get(self):
+        if self.get_argument('fail', None):
+            try:
+                yield self._fail()
+            except ValueError:
+                raise s.Error(409)
+        name = yield self._thread_name()
+        raise s.Return(ThreadMessage({'thread': name}))
+
+
+class LargeMessage(Model):
+    message = StringType()
+    size = IntType(required=True)
+
+
+@s.provides(s.MediaType.ApplicationJson, default=True)
+class LargeHandler(s.RequestHandler):
+
+    @s.async
+    def get(self):
+        size = int(self.get_argument('size'))
+        raise s.Return(LargeMessage({'message': 'x' * size,
+                                     'size': size or None}))
+
+
+class TestRunInExecutor(AsyncHTTPTestCase):
+
+    def get_new_ioloop(self):
+        return IOLoop.instance()
+
+    def get_app(self):
+        self.env = env = Environment()
+        env.add_executor('custom', ThreadPoolExecutor(1))
+        env.add_handler('/executor', ExecutorHandler)
+        return env.get_application()
+
+    def tearDown(self):
+        self.env.shutdown_executors()
+        super(TestRunInExecutor, self).tearDown()
+
+    def test_run_in_executor(self):
+        response = self.fetch('/executor')
+        self.assertEqual(200, response.code)
+        thread = json.loads(response.body.decode('utf8'))['thread']
+        self.assertNotEqual(threading.current_thread().name, thread)
+
+        response = self.fetch('/_system/stats/_internal/executor/default')
+        result = json.loads(response.body.decode('utf8'))
+        self.assertEqual(8, result['max_workers'])
+        self.assertEqual(0, result['pending'])
+        self.assertEqual(0, result['queued'])
+        self.assertEqual(1, result['completed'])
+        self.assertEqual(result['completed'],
+                         result['latency']['wait']['count'])
+        self.assertEqual(result['completed'],
+                         result['latency']['run']['count'])
+
+    def test_exceptions(self):
+        response = self.fetch('/executor?fail=1')
+        self.assertEqual(409, response.code)
+        self.assertEqual(1, self.env.get_executor('custom').failed)
+
+    def test_unknown_executor(self):
+        self.assertRaises(KeyError, self.env.get_executor, 'unknown')
+
+    @gen_test
+    def test_process_executor(self):
+        self.env.process_executor_workers = 1
+        executor = self.env.get_executor('process')
+        result = yield executor.submit(square, 3)
+        self.assertEqual(9, result)
+        self.assertEqual(1, executor.max_workers)
+
+
+class TestOffloadSerialization(AsyncHTTPTestCase):
+
+    def get_new_ioloop(self):
+        return IOLoop.instance()
+
+    def get_app(self):
+        self.env = env = Environment()
+        env.offload_serialization_size = 1000
+        env.serialization_executor = 'serialization'
+        env.add_executor('serialization', ThreadPoolExecutor(1))
+        env.add_handler('/large', LargeHandler)
+        return env.get_application()
+
+    def tearDown(self):
+        self.env.shutdown_executors()
+        super(TestOffloadSerialization, self).tearDown()
+
+    def test_offload_large_responses(self):
+        executor = self.env.get_executor('serialization')
+
+        response = self.fetch('/large?size=2000')
+        self.assertEqual(200, response.code)
+        self.assertEqual(0, executor.completed)
+
+        response = self.fetch('/large?size=2000')
+        self.assertEqual(200, response.code)
+        self.assertEqual(1, executor.completed)
+        self.assertEqual(2000, json.loads(
+            response.body.decode('utf8'))['size'])
+        self.assertEqual('application/json; charset=UTF-8',
+                         response.headers['Content-Type'])
+
+        response = self.fetch('/large?size=0')
+        self.assertEqual(500, response.code)
+        self.assertEqual(1, executor.failed)
+
+        self.assertFalse(self.env.offload_serialization(ExecutorHandler))
@@ -0,0 +1,101 @@
+# vim: set fileencoding=utf-8 :
+#
+# Copyright (c) 2013 Daniel Truemper <truemped at googlemail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+
+import random
+import sys
+if sys.version_info > (2, 7):
+    from unittest import TestCase
+else:
+    from unittest2 import TestCase
+
+from supercell.histogram import (LatencyHistogram, _bucket_index,
+                                 _highest_equivalent_value,
+                                 bucket_upper_bound)
+
+
+class TestLatencyHistogram(TestCase):
+
+    def test_buckets_are_contiguous(self):
+        previous = -1
+        for index in range(_bucket_index(10 ** 9)):
+            value = _highest_equivalent_value(index)
+            self.assertEqual(index, _bucket_index(value))
+            self.assertEqual(index, _bucket_index(previous + 1))
+            previous = value
+
+    def test_empty(self):
+        self.assertEqual({'count': 0}, LatencyHistogram().summary())
+
+    def test_percentiles(self):
+        values = [random.uniform(0.0001, 2.0) for _ in range(10000)]
+        histogram = LatencyHistogram()
+        for value in values:
+            histogram.record(value)
+
+        values.sort()
+        summary = histogram()
+        self.assertEqual(10000, summary['count'])
+        self.assertAlmostEqual(values[0], summary['min'], places=5)
+        self.assertAlmostEqual(values[-1], summary['max'], places=5)
+        self.assertAlmostEqual(sum(values) / len(values), summary['mean'],
+                               places=5)
+        for (name, rank) in [('p50', 4999), ('p90', 8999), ('p99', 9899),
+                             ('p999', 9989)]:
+            self.assertTrue(abs(values[rank] - summary[name]) <=
+                            values[rank] / 64, name)
+
+    def test_values_are_clamped(self):
+        histogram = LatencyHistogram(max_seconds=1)
+        histogram.record(10)
+        histogram.record(-1)
+        summary = histogram.summary()
+        self.assertEqual(1.0, summary['max'])
+        self.assertEqual(0.0, summary['min'])
+
+    def test_merge_is_exact(self):
+        first = LatencyHistogram()
+        second = LatencyHistogram()
+        combined = LatencyHistogram()
+        for i in range(1000):
+            value = i / 1000.0
+            (first if i % 3 else second).record(value)
+            combined.record(value)
+
+        merged = LatencyHistogram.from_snapshot(first.snapshot())
+        merged.merge(second.snapshot())
+        self.assertEqual(combined.summary(), merged.summary())
+        self.assertEqual(combined.counts, merged.counts)
+
+    def test_cumulative_counts_are_exact_at_bucket_edges(self):
+        histogram = LatencyHistogram()
+        values = []
+        for _ in range(10000):
+            seconds = random.random() / 5
+            histogram.record(seconds)
+            values.append(int(seconds * 1000000))
+
+        bounds = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1]
+        edges = [bucket_upper_bound(bound) for bound in bounds]
+        for (bound, edge) in zip(bounds, edges):
+            self.assertTrue(bound <= edge < bound * 1.016)
+        self.assertEqual(
+            [sum(1 for value in values if value <= round(edge * 1000000))
+             for edge in edges],
+            histogram.cumulative_counts(bounds))
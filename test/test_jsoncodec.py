@@ -0,0 +1,58 @@
+# vim: set fileencoding=utf-8 :
+#
+# Copyright (c) 2013 Daniel Truemper <truemped at googlemail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+
+import sys
+if sys.version_info > (2, 7):
+    from unittest import TestCase
+else:
+    from unittest2 import TestCase
+
+import mock
+
+from supercell import jsoncodec
+
+
+class TestJsonCodec(TestCase):
+
+    def tearDown(self):
+        jsoncodec.use_backend('json')
+
+    def test_default_backend(self):
+        self.assertEqual('json', jsoncodec.use_backend('json'))
+        self.assertEqual(b'{"a": 1}', jsoncodec.dumps({'a': 1}))
+        self.assertEqual({'a': 1}, jsoncodec.loads(b'{"a": 1}'))
+
+    def test_auto_backend(self):
+        name = jsoncodec.use_backend('auto')
+        self.assertTrue(name in jsoncodec.BACKENDS)
+        data = {'a': [1, 2.5, None, True], 'b': u'é'}
+        self.assertEqual(data, jsoncodec.loads(jsoncodec.dumps(data)))
+        self.assertTrue(isinstance(jsoncodec.dumps(data), bytes))
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            jsoncodec.use_backend('xml')
+
+    def test_missing_backend_falls_back(self):
+        def missing():
+            raise ImportError()
+
+        with mock.patch.dict(jsoncodec.BACKENDS, {'ujson': missing}):
+            self.assertEqual('json', jsoncodec.use_backend('ujson'))
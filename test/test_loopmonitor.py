@@ -0,0 +1,55 @@
+# vim: set fileencoding=utf-8 :
+#
+# Copyright (c) 2013 Daniel Truemper <truemped at googlemail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+
+import time
+
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from supercell.loopmonitor import LoopMonitor
+
+
+class TestLoopMonitor(AsyncTestCase):
+
+    @gen_test
+    def test_lag_and_blocking(self):
+        monitor = LoopMonitor(self.io_loop, lag_interval=0.01,
+                              blocking_threshold=0.05)
+        monitor.start()
+        try:
+            self.io_loop.add_callback(time.sleep, 0.15)
+            yield gen.sleep(0.3)
+        finally:
+            monitor.stop()
+
+        summary = monitor.histogram.summary()
+        self.assertTrue(summary['count'] > 1)
+        self.assertTrue(summary['max'] >= 0.1)
+        self.assertEqual(1, monitor.blocked)
+
+    @gen_test
+    def test_stop(self):
+        monitor = LoopMonitor(self.io_loop, lag_interval=0.01)
+        monitor.start()
+        yield gen.sleep(0.05)
+        monitor.stop()
+        count = monitor.histogram.count
+        yield gen.sleep(0.05)
+        self.assertEqual(count, monitor.histogram.count)
@@ -0,0 +1,170 @@
+# vim: set fileencoding=utf-8 :
+#
+# Copyright (c) 2013 Daniel Truemper <truemped at googlemail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+
+import json
+import sys
+if sys.version_info > (2, 7):
+    from unittest import TestCase
+else:
+    from unittest2 import TestCase
+
+from schematics.models import Model
+from schematics.types import StringType
+
+from tornado.ioloop import IOLoop
+from tornado.testing import AsyncHTTPTestCase
+
+import supercell.api as s
+from supercell.environment import Environment
+from supercell.histogram import LatencyHistogram
+from supercell.metrics import LabeledMetrics, render_metrics
+
+
+class SimpleMessage(Model):
+    doc_id = StringType()
+
+
+@s.provides(s.MediaType.ApplicationJson, default=True)
+class MetricsHandler(s.RequestHandler):
+
+    @s.latency
+    @s.metered
+    @s.async
+    def get(self, doc_id):
+        raise s.Return(SimpleMessage({"doc_id": doc_id}))
+
+
+class TestPrometheusMetricsHandler(AsyncHTTPTestCase):
+
+    def get_new_ioloop(self):
+        return IOLoop.instance()
+
+    def get_app(self):
+        env = Environment()
+        env.add_handler(r'/metricstest/(\d+)', MetricsHandler)
+        return env.get_application()
+
+    def test_metrics(self):
+        self.fetch('/metricstest/1')
+        self.fetch('/metricstest/2')
+
+        response = self.fetch('/_system/metrics')
+        self.assertEqual(200, response.code)
+        self.assertEqual('text/plain; version=0.0.4; charset=utf-8',
+                         response.headers['Content-Type'])
+        lines = response.body.decode('utf8').split('\n')
+
+        labels = 'route="metricstest/(\\\\d+)",method="get"'
+        self.assertTrue('supercell_calls_total{%s} 2' % labels in lines)
+        self.assertTrue('supercell_latency_seconds_count{%s} 2' % labels
+                        in lines)
+        self.assertTrue(
+            'supercell_latency_seconds_bucket{%s,le="+Inf"} 2' % labels
+            in lines)
+        self.assertTrue('supercell_stat{route="_internal/acceptparsing",'
+                        'name="maxsize"} 256' in lines)
+
+
+@s.provides(s.MediaType.ApplicationJson, default=True)
+class AutoMetricsHandler(s.RequestHandler):
+
+    @s.async
+    def get(self, doc_id):
+        if doc_id == 'error':
+            raise s.Error(reason='Failed')
+        raise s.Return(SimpleMessage({"doc_id": doc_id}))
+
+
+class TestRequestMetrics(AsyncHTTPTestCase):
+
+    def get_new_ioloop(self):
+        return IOLoop.instance()
+
+    def get_app(self):
+        self.env = env = Environment()
+        env.collect_request_metrics = True
+        env.add_handler(r'/autometrics/(\w+)', AutoMetricsHandler)
+        return env.get_application()
+
+    def test_request_metrics(self):
+        ok = self.fetch('/autometrics/1')
+        self.fetch('/autometrics/2')
+        self.fetch('/autometrics/error')
+
+        response = self.fetch('/_system/stats/autometrics/(%5Cw+)/requests')
+        self.assertEqual(200, response.code)
+        result = json.loads(response.body.decode('utf8'))
+        self.assertEqual(0, result['in_flight'])
+        self.assertEqual({'GET': {'2xx': 2, '5xx': 1}}, result['status'])
+        self.assertEqual(3, result['latency']['GET']['count'])
+        self.assertTrue(result['response_bytes'] >= 2 * len(ok.body))
+
+        response = self.fetch('/_system/metrics')
+        lines = response.body.decode('utf8').split('\n')
+        route = 'route="autometrics/(\\\\w+)"'
+        self.assertTrue('supercell_requests_total{%s,method="GET",'
+                        'status="2xx"} 2' % route in lines)
+        self.assertTrue('supercell_requests_in_flight{%s} 0' % route
+                        in lines)
+        self.assertTrue('supercell_request_duration_seconds_count{%s,'
+                        'method="GET"} 3' % route in lines)
+
+    def test_disabled_by_default(self):
+        env = Environment()
+        env.add_handler(r'/autometrics/(\w+)', AutoMetricsHandler)
+        self.assertIsNone(env.get_request_metrics(AutoMetricsHandler))
+        self.assertIsNone(self.env.get_request_metrics(MetricsHandler))
+
+
+class TestRenderMetrics(TestCase):
+
+    def test_families_are_grouped(self):
+        first = LatencyHistogram()
+        first.record(0.003)
+        first.record(20)
+        tree = {'a': {'latency': {'get': first}},
+                'b': {'latency': {'get': first.snapshot()},
+                      'size': 3, 'name': 'ignored'}}
+        lines = render_metrics(tree)
+
+        types = [line for line in lines if line.startswith('# TYPE')]
+        self.assertEqual(['# TYPE supercell_latency_seconds histogram',
+                          '# TYPE supercell_stat gauge'], types)
+        self.assertTrue('supercell_latency_seconds_bucket{route="a",'
+                        'method="get",le="0.002527"} 0' in lines)
+        self.assertTrue('supercell_latency_seconds_bucket{route="a",'
+                        'method="get",le="0.005055"} 1' in lines)
+        self.assertTrue('supercell_latency_seconds_bucket{route="b",'
+                        'method="get",le="10.092543"} 1' in lines)
+        self.assertTrue('supercell_latency_seconds_bucket{route="b",'
+                        'method="get",le="+Inf"} 2' in lines)
+        self.assertTrue('supercell_stat{route="b",name="size"} 3' in lines)
+
+        self.assertEqual(lines, render_metrics(tree))
+
+    def test_labeled_metrics(self):
+        metrics = LabeledMetrics(
+            'test_requests_total', 'counter', 'Requests',
+            lambda: [((('route', 'a"b'), ('status', '2xx')), 7)])
+        lines = render_metrics({'x': {'requests': metrics}})
+        self.assertEqual(['# HELP test_requests_total Requests',
+                          '# TYPE test_requests_total counter',
+                          'test_requests_total{route="a\\"b",status="2xx"} 7'],
+                         lines)
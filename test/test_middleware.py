@@ -18,17 +18,19 @@
 from __future__ import (absolute_import, division, print_function,
                         with_statement)
 
+from functools import wraps
 import json
 
 from tornado.ioloop import IOLoop
-from tornado.testing import AsyncHTTPTestCase
+from tornado.testing import AsyncHTTPTestCase, AsyncTestCase, gen_test
 
 from schematics.models import Model
 from schematics.types import StringType
 from schematics.types import IntType
 
 import supercell.api as s
-from supercell.middleware import Middleware
+from supercell.mediatypes import ReturnInformation
+from supercell.middleware import Middleware, _CHAINS
 
 
 class SimpleMessage(Model):
@@ -154,3 +156,99 @@ class TestDummyHeaderMiddleware(AsyncHTTPTestCase):
         assert '{"doc_id": "no way", "message": "forget about it!"}' == \
             json.dumps(json.loads(response.body.decode('utf8')),
                        sort_keys=True)
+
+
+class Record(Middleware):
+
+    def __init__(self, name, stop=False):
+        self.name = name
+        self.stop = stop
+
+    def before(self, handler, args, kwargs):
+        handler.calls.append('before ' + self.name)
+        if self.stop:
+            return ReturnInformation(403)
+
+    @s.coroutine
+    def after(self, handler, args, kwargs, result):
+        handler.calls.append('after ' + self.name)
+
+
+class RecordingHandler(object):
+
+    def __init__(self):
+        self.calls = []
+
+    @Record('outer')
+    @Record('middle')
+    @Record('inner')
+    @s.coroutine
+    def get(self):
+        self.calls.append('get')
+        raise s.Return(SimpleMessage({'doc_id': 'get'}))
+
+    @Record('outer')
+    @Record('middle', stop=True)
+    @Record('inner')
+    def post(self):
+        self.calls.append('post')
+
+
+def traced(fn):
+
+    @wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        self.calls.append('traced')
+        return fn(self, *args, **kwargs)
+
+    return wrapper
+
+
+class DecoratedHandler(RecordingHandler):
+
+    @Record('outer')
+    @traced
+    @Record('inner')
+    @s.coroutine
+    def get(self):
+        self.calls.append('get')
+
+
+class TestMiddlewareChain(AsyncTestCase):
+
+    def get_new_ioloop(self):
+        return IOLoop.instance()
+
+    def test_stacked_middlewares_are_compiled(self):
+        (middlewares, _) = _CHAINS[RecordingHandler.__dict__['get']]
+        self.assertEqual(['outer', 'middle', 'inner'],
+                         [m.name for m in middlewares])
+        self.assertEqual('get', RecordingHandler.get.__name__)
+
+        # synchronous middlewares never suspend the chain
+        future = RecordingHandler().get()
+        self.assertTrue(future.done())
+
+    @gen_test
+    def test_order(self):
+        handler = RecordingHandler()
+        result = yield handler.get()
+        self.assertEqual('get', result.doc_id)
+        self.assertEqual(['before outer', 'before middle', 'before inner',
+                          'get', 'after inner', 'after middle',
+                          'after outer'], handler.calls)
+
+    @gen_test
+    def test_short_circuit(self):
+        handler = RecordingHandler()
+        result = yield handler.post()
+        self.assertEqual(403, result.code)
+        self.assertEqual(['before outer', 'before middle', 'after outer'],
+                         handler.calls)
+
+    @gen_test
+    def test_decorator_between_middlewares(self):
+        handler = DecoratedHandler()
+        yield handler.get()
+        self.assertEqual(['before outer', 'traced', 'before inner', 'get',
+                          'after inner', 'after outer'], handler.calls)
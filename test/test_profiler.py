@@ -0,0 +1,99 @@
+# vim: set fileencoding=utf-8 :
+#
+# Copyright (c) 2013 Daniel Truemper <truemped at googlemail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+
+import sys
+import time
+if sys.version_info > (2, 7):
+    from unittest import TestCase
+else:
+    from unittest2 import TestCase
+
+from tornado.ioloop import IOLoop
+from tornado.testing import AsyncHTTPTestCase
+
+from supercell.environment import Environment
+from supercell.profiler import Sampler
+
+
+class ProfilingConfig(object):
+    profiling = True
+
+
+def burn_cpu(seconds):
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        sum(range(1000))
+
+
+class TestSampler(TestCase):
+
+    def test_sample_stacks(self):
+        sampler = Sampler(interval=0.001)
+        sampler.start()
+        try:
+            burn_cpu(0.2)
+        finally:
+            sampler.stop()
+
+        self.assertIsNone(Sampler.running)
+        self.assertTrue(sampler.samples > 0)
+        lines = sampler.collapsed()
+        self.assertTrue(any('test_sample_stacks' in line and
+                            'burn_cpu' in line for line in lines))
+        for line in lines:
+            (stack, count) = line.rsplit(' ', 1)
+            self.assertTrue(int(count) > 0)
+
+
+class TestProfileHandler(AsyncHTTPTestCase):
+
+    def get_new_ioloop(self):
+        return IOLoop.instance()
+
+    def get_app(self):
+        env = Environment()
+        return env.get_application(ProfilingConfig())
+
+    def test_profile(self):
+        IOLoop.current().call_later(0.01, burn_cpu, 0.1)
+        response = self.fetch('/_system/profile?seconds=0.2&interval=1')
+        self.assertEqual(200, response.code)
+        self.assertEqual('text/plain; charset=utf-8',
+                         response.headers['Content-Type'])
+        self.assertTrue('burn_cpu' in response.body.decode('utf8'))
+
+    def test_invalid_arguments(self):
+        response = self.fetch('/_system/profile?seconds=abc')
+        self.assertEqual(400, response.code)
+        response = self.fetch('/_system/profile?seconds=-1')
+        self.assertEqual(400, response.code)
+
+
+class TestProfileHandlerDisabled(AsyncHTTPTestCase):
+
+    def get_new_ioloop(self):
+        return IOLoop.instance()
+
+    def get_app(self):
+        return Environment().get_application()
+
+    def test_disabled(self):
+        response = self.fetch('/_system/profile?seconds=1')
+        self.assertEqual(404, response.code)
@@ -18,16 +18,25 @@
 from __future__ import (absolute_import, division, print_function,
                         with_statement)
 
+import json
 import sys
 if sys.version_info > (2, 7):
     from unittest import TestCase
 else:
     from unittest2 import TestCase
 
+import mock
+from schematics.models import Model
+from schematics.types import StringType
+from tornado.ioloop import IOLoop
+from tornado.testing import AsyncHTTPTestCase
+
 from supercell.api import provides, RequestHandler
+from supercell.environment import Environment
 from supercell.mediatypes import ContentType, MediaType
 from supercell.provider import (ProviderBase, JsonProvider,
-                                         NoProviderFound)
+                                NoProviderFound, validation_rate)
+from supercell.stats import stats_container
 
 
 class MoreDetailedJsonProvider(JsonProvider):
@@ -85,3 +94,143 @@ class TestBasicProvider(TestCase):
         provider = ProviderBase.map_provider(
             'application/vnd.supercell-v1.0+json', handler=handler)
         self.assertIs(provider, JsonProviderWithVendorAndVersion)
+
+    def test_negotiation_table_is_cached(self):
+
+        @provides(MediaType.ApplicationJson, default=True)
+        class MyHandler(RequestHandler):
+            pass
+
+        table = ProviderBase.negotiation_table(MyHandler)
+        self.assertIs(table, ProviderBase.negotiation_table(MyHandler))
+
+        provider = ProviderBase.map_provider('text/html', handler=MyHandler)
+        self.assertIs(provider, JsonProvider)
+        provider = ProviderBase.map_provider('text/html', handler=MyHandler)
+        self.assertIs(provider, JsonProvider)
+
+    def test_negotiation_table_with_new_provider(self):
+
+        @provides(MediaType.ApplicationJson, vendor='late')
+        class MyHandler(RequestHandler):
+            pass
+
+        with self.assertRaises(NoProviderFound):
+            ProviderBase.map_provider('application/vnd.late+json',
+                                      handler=MyHandler)
+
+        class LateJsonProvider(JsonProvider):
+
+            CONTENT_TYPE = ContentType(MediaType.ApplicationJson,
+                                       vendor='late')
+
+        provider = ProviderBase.map_provider('application/vnd.late+json',
+                                             handler=MyHandler)
+        self.assertIs(provider, LateJsonProvider)
+
+
+class Partial(Model):
+    name = StringType(required=True)
+    comment = StringType()
+
+
+class PartialHandler(RequestHandler):
+
+    def get(self):
+        return Partial({'comment': 'no name'})
+
+
+@provides(MediaType.ApplicationJson, default=True)
+class AlwaysValidating(PartialHandler):
+    pass
+
+
+@provides(MediaType.ApplicationJson, default=True, validation='never')
+class NeverValidating(PartialHandler):
+    pass
+
+
+@provides(MediaType.ApplicationJson, default=True, validation='debug')
+class DebugValidating(PartialHandler):
+    pass
+
+
+@provides(MediaType.ApplicationJson, default=True, validation=0.5)
+class SampledValidating(PartialHandler):
+    pass
+
+
+class TestValidationPolicy(AsyncHTTPTestCase):
+
+    def get_new_ioloop(self):
+        return IOLoop.instance()
+
+    def get_app(self):
+        self.env = env = Environment()
+        env.add_handler('/always', AlwaysValidating)
+        env.add_handler('/never', NeverValidating)
+        env.add_handler('/debug', DebugValidating)
+        env.add_handler('/sampled', SampledValidating)
+        return env.get_application()
+
+    def test_validation_rate(self):
+        self.assertEqual(1.0, validation_rate('always'))
+        self.assertEqual(0.0, validation_rate('never'))
+        self.assertEqual(0.0, validation_rate('debug'))
+        self.assertEqual(1.0, validation_rate('debug', debug=True))
+        self.assertEqual(0.25, validation_rate('0.25'))
+        with self.assertRaises(ValueError):
+            validation_rate('sometimes')
+        with self.assertRaises(ValueError):
+            validation_rate(2)
+        self.assertEqual(
+            [(0.5, 0.5)], list(SampledValidating._PROD_VALIDATION.values()))
+        self.assertEqual(
+            [(0.0, 1.0)], list(DebugValidating._PROD_VALIDATION.values()))
+        with self.assertRaises(ValueError):
+            self.env.response_validation = 'sometimes'
+        with self.assertRaises(ValueError):
+            provides(MediaType.ApplicationJson, validation='sometimes')(
+                type('Invalid', (RequestHandler,), {}))
+
+    def test_always_validate(self):
+        response = self.fetch('/always')
+        self.assertEqual(500, response.code)
+
+    def test_never_validate(self):
+        response = self.fetch('/never')
+        self.assertEqual(200, response.code)
+        self.assertEqual({'comment': 'no name', 'name': None},
+                         json.loads(response.body.decode('utf8')))
+
+    def test_validate_in_debug_mode(self):
+        response = self.fetch('/debug')
+        self.assertEqual(200, response.code)
+
+        self._app.settings['debug'] = True
+        try:
+            response = self.fetch('/debug')
+        finally:
+            self._app.settings['debug'] = False
+        self.assertEqual(500, response.code)
+
+    def test_default_policy(self):
+        self.env.response_validation = 'never'
+        response = self.fetch('/always')
+        self.assertEqual(200, response.code)
+
+    def test_sampled_validation(self):
+        random = 'supercell.provider.random.random'
+        with mock.patch(random, return_value=0.9):
+            response = self.fetch('/sampled')
+        self.assertEqual(200, response.code)
+        self.assertNotIn(SampledValidating, self.env._validation_stats)
+
+        with mock.patch(random, return_value=0.1):
+            response = self.fetch('/sampled')
+        self.assertEqual(200, response.code)
+        self.assertEqual({'sampled': 1, 'failures': 1},
+                         self.env._validation_stats[SampledValidating])
+        path = self.env.get_stats_path(SampledValidating)
+        self.assertIs(self.env._validation_stats[SampledValidating],
+                      stats_container(path)['validation'])
@@ -23,6 +23,7 @@ import json
 from schematics.models import Model
 from schematics.types import StringType
 from schematics.types import IntType
+from schematics.types.compound import ListType
 
 from tornado.ioloop import IOLoop
 from tornado.testing import AsyncHTTPTestCase
@@ -30,7 +31,7 @@ from tornado.testing import AsyncHTTPTestCase
 import supercell.api as s
 from supercell.api import RequestHandler, provides
 from supercell.environment import Environment
-from supercell.queryparam import QueryParams
+from supercell.queryparam import QueryParams, Range, RangeType
 
 
 class SimpleMessage(Model):
@@ -121,3 +122,124 @@ class TestSimpleQueryParamWithCustomKwargsName(TestSimpleQueryParam):
         env.add_handler('/test', MyQueryparamHandlerWithCustomKwargsName)
         env.tornado_settings['debug'] = True
         return env.get_application()
+
+
+_PAGE_PARAMS = QueryParams((
+    ('ids', ListType(IntType())),
+    ('items', RangeType(max_limit=50)),
+))
+
+
+@provides(s.MediaType.ApplicationJson, default=True)
+class MyPaginatedHandler(RequestHandler):
+
+    @_PAGE_PARAMS
+    @s.async
+    def get(self, *args, **kwargs):
+        query = kwargs.get('query')
+        items = query.get('items', Range(0, 10))
+        raise s.Return(SimpleMessage({
+            "doc_id": items.offset,
+            "number": items.limit,
+            "message": ','.join(str(i) for i in query.get('ids', []))}))
+
+
+@provides(s.MediaType.ApplicationJson, default=True)
+class MutatingHandler(RequestHandler):
+
+    @QueryParams((('ids', ListType(IntType())),))
+    @s.async
+    def get(self, *args, **kwargs):
+        ids = kwargs['query']['ids']
+        ids.append(99)
+        raise s.Return(SimpleMessage({
+            "message": ','.join(str(i) for i in ids)}))
+
+
+class DefaultIdsQueryParams(QueryParams):
+
+    @s.coroutine
+    def before(self, handler, args, kwargs):
+        result = yield super(DefaultIdsQueryParams, self).before(
+            handler, args, kwargs)
+        if result is not None:
+            raise s.Return(result)
+        kwargs['query'].setdefault('ids', [0])
+
+
+@provides(s.MediaType.ApplicationJson, default=True)
+class DefaultIdsHandler(RequestHandler):
+
+    @DefaultIdsQueryParams((('ids', ListType(IntType())),))
+    @s.async
+    def get(self, *args, **kwargs):
+        raise s.Return(SimpleMessage({
+            "message": ','.join(str(i) for i in kwargs['query']['ids'])}))
+
+
+class TestListAndRangeParams(AsyncHTTPTestCase):
+
+    def get_app(self):
+        env = Environment()
+        env.add_handler('/test', MyPaginatedHandler)
+        env.add_handler('/mutate', MutatingHandler)
+        env.add_handler('/default', DefaultIdsHandler)
+        return env.get_application()
+
+    def get_new_ioloop(self):
+        return IOLoop.instance()
+
+    def get_json(self, path):
+        response = self.fetch(path)
+        return (response.code, json.loads(response.body.decode('utf8')))
+
+    def test_repeated_and_comma_separated_params(self):
+        self.assertEqual(
+            (200, {'doc_id': 0, 'number': 10, 'message': '1,2,3'}),
+            self.get_json('/test?ids=1,2&ids=3'))
+
+    def test_invalid_list_item(self):
+        (code, result) = self.get_json('/test?ids=1,two')
+        self.assertEqual(400, code)
+        self.assertEqual(["Value 'two' is not int."], result['ids'])
+
+    def test_range(self):
+        self.assertEqual(
+            (200, {'doc_id': 20, 'number': 10, 'message': ''}),
+            self.get_json('/test?items=20-29'))
+        self.assertEqual(
+            (200, {'doc_id': 20, 'number': 50, 'message': ''}),
+            self.get_json('/test?items=20-'))
+
+        for invalid in ('20', '30-20', '0-50', 'a-b'):
+            (code, result) = self.get_json('/test?items=' + invalid)
+            self.assertEqual(400, code)
+            self.assertIn('items', result)
+
+    def test_parsed_query_is_cached(self):
+        hits = _PAGE_PARAMS._cache.hits
+        self.get_json('/test?ids=4&items=0-9')
+        self.assertEqual(hits, _PAGE_PARAMS._cache.hits)
+        self.assertEqual(
+            (200, {'doc_id': 0, 'number': 10, 'message': '4'}),
+            self.get_json('/test?ids=4&items=0-9'))
+        self.assertEqual(hits + 1, _PAGE_PARAMS._cache.hits)
+
+    def test_cached_lists_are_copied(self):
+        response = self.fetch('/mutate?ids=1,2')
+        self.assertEqual(200, response.code)
+        response = self.fetch('/mutate?ids=1,2')
+        self.assertEqual('1,2,99', json.loads(
+            response.body.decode('utf8'))['message'])
+
+    def test_subclass_yields_before(self):
+        (code, result) = self.get_json('/default')
+        self.assertEqual((200, '0'), (code, result['message']))
+        (code, result) = self.get_json('/default?ids=1,2')
+        self.assertEqual((200, '1,2'), (code, result['message']))
+        (code, result) = self.get_json('/default?ids=x')
+        self.assertEqual(400, code)
+
+    def test_range_to_primitive(self):
+        self.assertEqual('0-49', RangeType().to_primitive(Range(0, 50)))
+        self.assertEqual('10-', RangeType().to_primitive(Range(10, None)))
@@ -25,12 +25,15 @@ from schematics.models import Model
 from schematics.types import StringType
 from schematics.types import IntType
 
+from tornado import gen
 from tornado.ioloop import IOLoop
 from tornado.testing import AsyncHTTPTestCase
 
 import supercell.api as s
 from supercell.api import (RequestHandler, provides, consumes)
+from supercell.consumer import LazyModel
 from supercell.environment import Environment
+from supercell.middleware import Middleware
 
 
 class SimpleMessage(Model):
@@ -243,3 +246,254 @@ class TestSimpleHtmlHandlerWithMissingTemplate(AsyncHTTPTestCase):
     def test_simple_html(self):
         response = self.fetch('/test_html/')
         self.assertEqual(500, response.code)
+
+
+@provides(s.MediaType.ApplicationJson, default=True)
+@provides(s.MediaType.ApplicationNdJson)
+@provides(s.MediaType.TextHtml)
+class StreamingHandler(s.RequestHandler):
+
+    @s.async
+    def get(self, *args, **kwargs):
+        count = int(self.get_argument('count', 3))
+        raise s.Return(self.messages(count))
+
+    def messages(self, count):
+        for i in range(count):
+            if i % 2:
+                yield self.get_message(i)
+            else:
+                yield SimpleMessage({'doc_id': 'doc%s' % i, 'number': i})
+
+    @s.coroutine
+    def get_message(self, i):
+        raise s.Return(SimpleMessage({'doc_id': 'doc%s' % i, 'number': i}))
+
+
+class TestStreamingProvider(AsyncHTTPTestCase):
+
+    def get_app(self):
+        env = Environment()
+        env.add_handler('/stream', StreamingHandler)
+        return env.get_application()
+
+    def get_new_ioloop(self):
+        return IOLoop.instance()
+
+    def test_json_array(self):
+        response = self.fetch('/stream')
+        self.assertEqual(200, response.code)
+        self.assertTrue(response.headers['Content-Type'].startswith(
+            s.MediaType.ApplicationJson))
+        self.assertEqual([{'doc_id': 'doc0', 'number': 0},
+                          {'doc_id': 'doc1', 'number': 1},
+                          {'doc_id': 'doc2', 'number': 2}],
+                         json.loads(response.body.decode('utf8')))
+
+    def test_provider_without_streaming(self):
+        response = self.fetch('/stream', headers={
+            'Accept': s.MediaType.TextHtml})
+        self.assertEqual(406, response.code)
+
+    def test_empty_json_array(self):
+        response = self.fetch('/stream?count=0')
+        self.assertEqual(200, response.code)
+        self.assertEqual(b'[]', response.body)
+
+    def test_large_json_array_is_flushed_in_chunks(self):
+        response = self.fetch('/stream?count=5000')
+        self.assertEqual(200, response.code)
+        result = json.loads(response.body.decode('utf8'))
+        self.assertEqual(5000, len(result))
+        self.assertEqual({'doc_id': 'doc4999', 'number': 4999}, result[-1])
+
+    def test_ndjson(self):
+        response = self.fetch('/stream', headers={
+            'Accept': s.MediaType.ApplicationNdJson})
+        self.assertEqual(200, response.code)
+        self.assertEqual(s.MediaType.ApplicationNdJson,
+                         response.headers['Content-Type'])
+        lines = response.body.decode('utf8').split('\n')
+        self.assertEqual('', lines[-1])
+        self.assertEqual([{'doc_id': 'doc0', 'number': 0},
+                          {'doc_id': 'doc1', 'number': 1},
+                          {'doc_id': 'doc2', 'number': 2}],
+                         [json.loads(line) for line in lines[:-1]])
+
+
+@consumes(s.MediaType.ApplicationJson, SimpleMessage, stream=True)
+@consumes(s.MediaType.ApplicationNdJson, SimpleMessage, stream=True)
+class StreamingConsumerHandler(s.RequestHandler):
+
+    def initialize(self):
+        self.received = []
+
+    @s.async
+    def model_received(self, model):
+        yield gen.moment
+        self.received.append(model.number)
+
+    @s.async
+    def post(self, *args, **kwargs):
+        raise s.OkCreated({'numbers': self.received})
+
+
+class TestStreamingConsumer(AsyncHTTPTestCase):
+
+    def get_app(self):
+        env = Environment()
+        env.add_handler('/bulk', StreamingConsumerHandler)
+        return env.get_application()
+
+    def get_new_ioloop(self):
+        return IOLoop.instance()
+
+    def post(self, content_type, body):
+        return self.fetch('/bulk', method='POST', body=body,
+                          headers={'Content-Type': content_type})
+
+    def test_json_array(self):
+        body = '[' + ','.join('{"number": %s}' % i for i in range(1000)) + ']'
+        response = self.post(s.MediaType.ApplicationJson, body)
+        self.assertEqual(201, response.code)
+        self.assertEqual(list(range(1000)), json.loads(
+            response.body.decode('utf8'))['numbers'])
+
+    def test_ndjson(self):
+        body = '{"number": 1}\n{"number": 2}\n{"number": 3}'
+        response = self.post(s.MediaType.ApplicationNdJson, body)
+        self.assertEqual(201, response.code)
+        self.assertEqual([1, 2, 3], json.loads(
+            response.body.decode('utf8'))['numbers'])
+
+    def test_invalid_item(self):
+        body = '[{"number": 1}, {"number": "one"}]'
+        response = self.post(s.MediaType.ApplicationJson, body)
+        self.assertEqual(400, response.code)
+
+    def test_incomplete_array(self):
+        response = self.post(s.MediaType.ApplicationJson, '[{"number": 1}')
+        self.assertEqual(400, response.code)
+
+
+@provides(s.MediaType.ApplicationJson, default=True)
+class PhaseTimingHandler(RequestHandler):
+
+    @s.async
+    def get(self, *args, **kwargs):
+        raise s.Return(SimpleMessage({"doc_id": 'test123'}))
+
+
+class TestPhaseTiming(AsyncHTTPTestCase):
+
+    def get_app(self):
+        env = Environment()
+        env.phase_timing = True
+        env.server_timing = True
+        env.add_handler('/phases', PhaseTimingHandler)
+        return env.get_application()
+
+    def get_new_ioloop(self):
+        return IOLoop.instance()
+
+    def test_server_timing_header(self):
+        response = self.fetch('/phases')
+        self.assertEqual(200, response.code)
+        phases = [phase.split(';')[0] for phase
+                  in response.headers['Server-Timing'].split(', ')]
+        self.assertEqual(['consume', 'handler', 'provide'], phases)
+
+        response = self.fetch('/_system/stats/phases/phases')
+        result = json.loads(response.body.decode('utf8'))
+        self.assertEqual(['consume', 'handler', 'provide', 'write'],
+                         sorted(result.keys()))
+        self.assertTrue(result['write']['count'] >= 1)
+
+
+class RejectWithoutToken(Middleware):
+
+    @s.coroutine
+    def before(self, handler, args, kwargs):
+        if handler.get_argument('token', None) is None:
+            raise s.Error(403)
+
+    @s.coroutine
+    def after(self, handler, args, kwargs, result):
+        pass
+
+
+@provides(s.MediaType.ApplicationJson, default=True)
+@consumes(s.MediaType.ApplicationJson, SimpleMessage, lazy=True)
+class LazyEchoHandler(RequestHandler):
+
+    @RejectWithoutToken()
+    @s.async
+    def post(self, *args, **kwargs):
+        model = kwargs['model']
+        assert type(model) is LazyModel
+        assert isinstance(model, SimpleMessage)
+        model.doc_id = 'lazy'
+        raise s.Return(model)
+
+
+class RequiredMessage(Model):
+    message = StringType(required=True)
+    number = IntType()
+
+
+@provides(s.MediaType.ApplicationJson, default=True)
+@consumes(s.MediaType.ApplicationJson, RequiredMessage, lazy=True)
+@consumes(s.MediaType.ApplicationNdJson, RequiredMessage, lazy=True)
+class LazyRequiredHandler(RequestHandler):
+
+    @s.async
+    def post(self, *args, **kwargs):
+        model = kwargs['model']
+        raise s.Return(SimpleMessage({'message': model.message or 'missing',
+                                      'number': model.number}))
+
+
+class TestLazyConsumer(AsyncHTTPTestCase):
+
+    def get_app(self):
+        env = Environment()
+        env.add_handler('/lazy', LazyEchoHandler)
+        env.add_handler('/required', LazyRequiredHandler)
+        return env.get_application()
+
+    def get_new_ioloop(self):
+        return IOLoop.instance()
+
+    def post(self, path, body):
+        return self.fetch(path, method='POST', body=body,
+                          headers={'Content-Type':
+                                   s.MediaType.ApplicationJson})
+
+    def test_lazy_model(self):
+        response = self.post('/lazy?token=1', '{"message": "hi"}')
+        self.assertEqual(200, response.code)
+        self.assertEqual({'doc_id': 'lazy', 'message': 'hi'},
+                         json.loads(response.body.decode('utf8')))
+
+    def test_invalid_body_on_first_access(self):
+        response = self.post('/lazy?token=1', '{"number": "one"}')
+        self.assertEqual(400, response.code)
+
+    def test_same_validation_for_all_consumers(self):
+        for content_type in (s.MediaType.ApplicationJson,
+                             s.MediaType.ApplicationNdJson):
+            response = self.fetch('/required', method='POST',
+                                  body='{"number": 1}',
+                                  headers={'Content-Type': content_type})
+            self.assertEqual(200, response.code)
+            self.assertEqual({'message': 'missing', 'number': 1},
+                             json.loads(response.body.decode('utf8')))
+
+            response = self.fetch('/required', method='POST',
+                                  body='{"number": "one"}',
+                                  headers={'Content-Type': content_type})
+            self.assertEqual(400, response.code)
+
+    def test_rejected_request_is_not_consumed(self):
+        response = self.post('/lazy', '{"number": "one"}')
+        self.assertEqual(403, response.code)
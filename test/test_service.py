@@ -18,6 +18,7 @@
 from __future__ import (absolute_import, division, print_function,
                         with_statement)
 
+import os
 import sys
 if sys.version_info > (2, 7):
     from unittest import TestCase
@@ -36,6 +37,7 @@ from supercell.testing import AsyncHTTPTestCase
 
 import supercell.api as s
 from supercell.environment import Environment
+from supercell.service import bind_reuse_port_sockets
 
 
 class SimpleModel(Model):
@@ -103,6 +105,18 @@ class ServiceTest(TestCase):
         from tornado.options import options
         self.assertEqual('filevalue', options.test)
 
+    def test_parse_float_options(self):
+        from tornado.options import options
+        try:
+            tornado.options.parse_command_line(
+                ['service', '--loop_lag_interval=0.1',
+                 '--blocking_threshold=0.5'])
+            self.assertEqual(0.1, options.loop_lag_interval)
+            self.assertEqual(0.5, options.blocking_threshold)
+        finally:
+            options.loop_lag_interval = 0.0
+            options.blocking_threshold = 0.0
+
     def test_logging_initialization(self):
         service = s.Service()
         env = service.environment
@@ -179,6 +193,80 @@ class ServiceTest(TestCase):
 
         service.config.max_grace_seconds = 3
 
+    @mock.patch('tornado.ioloop.IOLoop.instance')
+    @mock.patch('supercell.service.bind_sockets')
+    @mock.patch('supercell.service.Service.supervise_workers')
+    def test_main_with_workers(self, supervise_mock, bind_sockets_mock,
+                               ioloop_instance_mock):
+        supervise_mock.return_value = 2
+        bind_sockets_mock.return_value = [mock.MagicMock()]
+
+        service = MyService()
+        service.config.workers = 4
+        try:
+            service.main(with_signals=False)
+        finally:
+            service.config.workers = 1
+
+        supervise_mock.assert_called_once_with(4)
+        self.assertEqual(2, service.worker_id)
+        bind_sockets_mock.assert_called_once_with(8080, address='127.0.0.1')
+
+        expected = [mock.call(), mock.call().add_handler(mock.ANY, mock.ANY,
+                                                         mock.ANY),
+                    mock.call(), mock.call().start()]
+        assert expected == ioloop_instance_mock.mock_calls
+
+    @mock.patch('tornado.ioloop.IOLoop.initialized', return_value=False)
+    @mock.patch('signal.signal')
+    @mock.patch('os.wait')
+    @mock.patch('os.fork')
+    def test_supervise_workers_restarts_crashed(self, fork_mock, wait_mock,
+                                                signal_mock, initialized_mock):
+        fork_mock.side_effect = [101, 102, 103]
+        # worker 0 crashes with exit code 1 and is restarted as pid 103
+        wait_mock.side_effect = [(101, 1 << 8), (102, 0), (103, 0)]
+
+        service = MyService()
+        self.assertRaises(SystemExit, service.supervise_workers, 2)
+        self.assertEqual(3, fork_mock.call_count)
+        self.assertIsNone(service.environment.stats_dir)
+        self.assertIsNone(service.config.stats_dir)
+
+    @mock.patch('tornado.ioloop.IOLoop.initialized', return_value=False)
+    @mock.patch('signal.signal')
+    @mock.patch('os.fork')
+    def test_supervise_workers_in_worker(self, fork_mock, signal_mock,
+                                         initialized_mock):
+        fork_mock.side_effect = [101, 0]
+
+        service = MyService()
+        try:
+            self.assertEqual(1, service.supervise_workers(2))
+            self.assertTrue(os.path.isdir(service.environment.stats_dir))
+            self.assertIsNone(service.config.stats_dir)
+        finally:
+            service._remove_temp_stats_dir()
+        self.assertIsNone(service.environment.stats_dir)
+
+    @mock.patch('tornado.ioloop.IOLoop.initialized', return_value=True)
+    @mock.patch('os.fork')
+    def test_supervise_workers_with_ioloop(self, fork_mock, initialized_mock):
+        service = MyService()
+        self.assertRaises(RuntimeError, service.supervise_workers, 2)
+        self.assertFalse(fork_mock.called)
+        self.assertIsNone(service.environment.stats_dir)
+
+    @pytest.mark.skipif(not hasattr(socket, 'SO_REUSEPORT'),
+                        reason='requires SO_REUSEPORT')
+    def test_bind_reuse_port_sockets(self):
+        first = bind_reuse_port_sockets(0, address='127.0.0.1')
+        port = first[0].getsockname()[1]
+        second = bind_reuse_port_sockets(port, address='127.0.0.1')
+        self.assertEqual(port, second[0].getsockname()[1])
+        for sock in first + second:
+            sock.close()
+
 
 class ApplicationIntegrationTest(AsyncHTTPTestCase):
 
@@ -19,10 +19,19 @@ from __future__ import (absolute_import, division, print_function,
                         with_statement)
 
 import json
+import os
+import shutil
+import sys
+import tempfile
+if sys.version_info > (2, 7):
+    from unittest import TestCase
+else:
+    from unittest2 import TestCase
 
 from schematics.models import Model
 from schematics.types import StringType
 
+import mock
 from tornado import gen
 from tornado.ioloop import IOLoop
 from tornado.testing import AsyncHTTPTestCase
@@ -30,6 +39,11 @@ from tornado.testing import AsyncHTTPTestCase
 import supercell.api as s
 from supercell.environment import Environment
 from supercell.environment import ScalesSupercellHandler
+from supercell.histogram import LatencyHistogram
+from supercell.stats import (export_stats, merge_stats, read_stats_snapshots,
+                             stats_container, summarize_stats,
+                             OVERFLOW_STATS_PATH)
+import supercell.stats
 
 
 class SimpleMessage(Model):
@@ -91,12 +105,18 @@ class TestSupercellStats(AsyncHTTPTestCase):
 
         response = self.fetch('/_system/stats/teststats')
         self.assertEqual(response.code, 200)
-        expected = '{"_long_method": {"count": 1, "unit":' + \
-            ' "per second"}, "latency": {"_long_method": ' + \
-            '{"count": 1}, "get":' + \
-            ' {"count": 1}}}'
-        self.assertEqual(expected, json.dumps(json.loads(
-            response.body.decode('utf8')), sort_keys=True))
+        result = json.loads(response.body.decode('utf8'))
+        self.assertEqual({"count": 1, "unit": "per second"},
+                         result['_long_method'])
+        self.assertEqual(['_long_method', 'get'],
+                         sorted(result['latency'].keys()))
+        for name in ['_long_method', 'get']:
+            latency = result['latency'][name]
+            self.assertEqual(['count', 'max', 'mean', 'min', 'p50', 'p90',
+                              'p99', 'p999'], sorted(latency.keys()))
+            self.assertEqual(1, latency['count'])
+            self.assertTrue(0 <= latency['min'] <= latency['p50'] <=
+                            latency['max'])
 
         response = self.fetch('/teststats')
         self.assertEqual(response.code, 200)
@@ -115,3 +135,150 @@ class TestSupercellStats(AsyncHTTPTestCase):
                          ['do_something']['count'], 2)
         self.assertEqual(result['_internal']['test_stats']['MyTestObject']
                          ['latency']['do_something']['count'], 2)
+
+    def test_accept_cache_stats(self):
+        response = self.fetch('/_system/stats/_internal')
+        self.assertEqual(response.code, 200)
+        result = json.loads(response.body.decode('utf8'))
+        self.assertTrue(result['acceptparsing']['maxsize'] > 0)
+        self.assertTrue('hits' in result['acceptparsing'])
+        self.assertTrue('misses' in result['acceptparsing'])
+
+
+class TestStatsAggregation(AsyncHTTPTestCase):
+
+    def get_new_ioloop(self):
+        return IOLoop.instance()
+
+    def get_app(self):
+        self.stats_dir = tempfile.mkdtemp()
+        env = Environment()
+        env.stats_dir = self.stats_dir
+        return env.get_application()
+
+    def tearDown(self):
+        shutil.rmtree(self.stats_dir)
+        super(TestStatsAggregation, self).tearDown()
+
+    def _write_worker(self, name, pid, stats):
+        with open(os.path.join(self.stats_dir, name), 'w') as f:
+            json.dump({'pid': pid, 'time': 0, 'stats': stats}, f)
+
+    def test_aggregated_stats(self):
+        worker = {'_internal': {'other_worker': {'count': 3}}}
+        self._write_worker('worker-1.json', -1, worker)
+        self._write_worker('worker-2.json', -2, worker)
+        self._write_worker('worker-0.json', os.getpid(), worker)
+
+        response = self.fetch('/_system/stats/_internal/other_worker')
+        self.assertEqual(200, response.code)
+        self.assertEqual({'count': 6},
+                         json.loads(response.body.decode('utf8')))
+
+        response = self.fetch('/_system/stats/_internal/other_worker?local')
+        self.assertEqual(200, response.code)
+        self.assertEqual(None, json.loads(response.body.decode('utf8')))
+
+
+class TestMergeStats(TestCase):
+
+    def test_merge(self):
+        merged = merge_stats([
+            {'a': {'count': 1, 'min': 2.0, 'max': 4.0, 'mean': 3.0,
+                   '99percentile': 4.0, 'unit': 'per second', 'm1': 0.5}},
+            {'a': {'count': 3, 'min': 1.0, 'max': 3.0, 'mean': 1.0,
+                   '99percentile': 2.0, 'unit': 'per second', 'm1': 1.5},
+             'b': {'count': 2, 'size': 2, 'maxsize': 8}},
+            {'b': {'count': 1, 'size': 1, 'maxsize': 8}},
+        ])
+        self.assertEqual({'a': {'count': 4, 'min': 1.0, 'max': 4.0,
+                                'mean': 1.5, 'unit': 'per second',
+                                'm1': 2.0},
+                          'b': {'count': 3, 'size': 3, 'maxsize': 8}}, merged)
+
+    def test_merge_pooled_stddev(self):
+        merged = merge_stats([
+            {'count': 2, 'mean': 1.0, 'stddev': 0.0, 'median': 1.0},
+            {'count': 2, 'mean': 3.0, 'stddev': 0.0, 'median': 3.0},
+        ])
+        self.assertEqual({'count': 4, 'mean': 2.0, 'stddev': 1.0}, merged)
+
+    def test_merge_histograms(self):
+        first = LatencyHistogram()
+        first.record(0.1)
+        second = LatencyHistogram()
+        second.record(0.3)
+        merged = merge_stats([{'latency': {'get': first.snapshot()}},
+                              {'latency': {'get': second.snapshot()}}])
+        summary = summarize_stats(merged)['latency']['get']
+        self.assertEqual(2, summary['count'])
+        self.assertAlmostEqual(0.1, summary['min'])
+        self.assertAlmostEqual(0.3, summary['max'])
+        self.assertAlmostEqual(0.2, summary['mean'])
+
+    def test_export_and_read(self):
+        stats_dir = tempfile.mkdtemp()
+        try:
+            export_stats(os.path.join(stats_dir, 'worker-0.json'))
+            self.assertEqual(
+                [], read_stats_snapshots(stats_dir, exclude_pid=os.getpid()))
+            snapshots = read_stats_snapshots(stats_dir)
+            self.assertEqual(1, len(snapshots))
+            self.assertTrue('_internal' in snapshots[0])
+        finally:
+            shutil.rmtree(stats_dir)
+
+
+@s.provides(s.MediaType.ApplicationJson, default=True)
+class UserHandler(s.RequestHandler):
+
+    @s.latency
+    @s.metered
+    @s.async
+    def get(self, user_id):
+        raise s.Return(SimpleMessage({"doc_id": user_id}))
+
+
+class DocHandler(UserHandler):
+    pass
+
+
+class TestRouteStats(AsyncHTTPTestCase):
+
+    def get_new_ioloop(self):
+        return IOLoop.instance()
+
+    def get_app(self):
+        self.env = env = Environment()
+        env.add_handler(r'/routestats/users/(\d+)$', UserHandler)
+        env.add_handler(r'/routestats/docs/(\w+)', DocHandler,
+                        name='routestats-docs')
+        return env.get_application()
+
+    def test_stats_path(self):
+        self.assertEqual(r'routestats/users/(\d+)',
+                         self.env.get_stats_path(UserHandler))
+        self.assertEqual('routestats-docs',
+                         self.env.get_stats_path(DocHandler))
+        self.assertIsNone(self.env.get_stats_path(MyHandler))
+
+    def test_stats_are_keyed_by_route(self):
+        for user_id in range(5):
+            response = self.fetch('/routestats/users/%s' % user_id)
+            self.assertEqual(200, response.code)
+        self.fetch('/routestats/docs/a')
+
+        response = self.fetch('/_system/stats/routestats/users')
+        result = json.loads(response.body.decode('utf8'))
+        self.assertEqual([r'(\d+)'], list(result.keys()))
+        self.assertEqual(5, result[r'(\d+)']['get']['count'])
+        self.assertEqual(5, result[r'(\d+)']['latency']['get']['count'])
+
+        response = self.fetch('/_system/stats/routestats-docs')
+        result = json.loads(response.body.decode('utf8'))
+        self.assertEqual(1, result['get']['count'])
+
+    def test_cardinality_guard(self):
+        with mock.patch.object(supercell.stats, 'MAX_STATS_PATHS', 0):
+            container = stats_container('routestats/one/of/many')
+        self.assertIs(stats_container(OVERFLOW_STATS_PATH), container)